@@ -1,26 +1,53 @@
 # Copyright (c) Iuga Marin
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains the implementation of an AI agent with basic tooling capabilities.
-from typing import Annotated, Optional, TypedDict
+import os
+import json
+import logging
+from typing import Annotated, Callable, Iterable, List, Optional, TypedDict
 
-from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage
-from langgraph.graph import START, StateGraph
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
 from setup import get_baseline_LLM
 
-from library_tools import get_tools_description
+from library_deadline import is_deadline_expired
+from library_ledger import is_question_budget_exceeded
+from library_tools import get_tools_description, memoize_tool
+from library_tracing import TRACER, trace_tool, traced
 
 from tools_arithmetic import add_values, add_multiple_values, subtract_values
 from tools_audio import get_analysis_information_from_audio_file
 from tools_excel import process_EXCEL_file
 from tools_image import get_requested_information_from_image
 from tools_chess import get_chess_analysis_information_from_image
+from tools_knowledge_base import get_knowledge_base_index, search_knowledge_base
 from tools_python import get_python_file_data
 from tools_web import search_web_natural_language
 from tools_youtube import get_analysis_information_from_youtube_video
 
+# tool results are memoized across runs, tools without a time to live keep their results until evicted
+TOOLS_MEMOIZATION_ENABLED = os.environ.get("TOOLS_MEMOIZATION_ENABLED", "1") == "1"
+TOOLS_MEMOIZATION_TTL_SECONDS = {
+    "search_web_natural_language": 7 * 24 * 60 * 60,
+    "get_analysis_information_from_youtube_video": 30 * 24 * 60 * 60
+}
+
+# tools which are cheaper to run than to memoize, or which already cache their own work
+TOOLS_MEMOIZATION_OPT_OUTS = {
+    "add_values",
+    "add_multiple_values",
+    "subtract_values",
+    "search_knowledge_base"
+}
+
+# the assistant is escalated to the strong model once it repeats the same tool call this many times
+AGENT_TOOL_LOOP_REPEATS = 2
+
+
 class AgentState(TypedDict):
     """
     Represents the state of the agent.
@@ -32,9 +59,11 @@ class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
 
 
-def get_tools():
+def get_tools(excluded_tools: Optional[Iterable[str]] = None):
     """
     Retrieves a list of tool functions that can be used for various operations.
+    Args:
+        excluded_tools (Optional[Iterable[str]], optional): The names of the tools to leave out. Defaults to None.
     Returns:
         list: A list of callable tool functions.
     """
@@ -48,37 +77,114 @@ def get_tools():
         get_requested_information_from_image,
         get_chess_analysis_information_from_image,
         get_analysis_information_from_youtube_video,
+        search_knowledge_base,
         search_web_natural_language
     ]
 
-    return tools
+    if excluded_tools is not None:
+        tools = [tool for tool in tools if tool.__name__ not in set(excluded_tools)]
 
+    if TOOLS_MEMOIZATION_ENABLED:
+        tools = [
+            tool if tool.__name__ in TOOLS_MEMOIZATION_OPT_OUTS
+            else memoize_tool(tool, TOOLS_MEMOIZATION_TTL_SECONDS.get(tool.__name__))
+            for tool in tools
+        ]
 
-def create_tooling_LLM():
+    return [trace_tool(tool) for tool in tools]
+
+
+def create_tooling_LLM(tools: Optional[List[Callable]] = None, escalation_reason: Optional[str] = None):
     """
     Creates and returns a tooling-enabled language model (LLM) by binding tools
     to a baseline LLM.
+    Args:
+        tools (Optional[List[Callable]], optional): The tools to bind, all the tools when None.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
     Returns:
         An instance of a tooling-enabled LLM.
     """
-    baseline_LLM = get_baseline_LLM()
-    tooling_LLM = baseline_LLM.bind_tools(get_tools())
+    if tools is None:
+        tools = get_tools()
+
+    baseline_LLM = get_baseline_LLM(escalation_reason)
+    tooling_LLM = baseline_LLM.bind_tools(tools)
 
     return tooling_LLM
 
 
-def assistant(state: AgentState) -> AgentState:
+def get_best_answer_so_far(messages: list[AnyMessage]) -> str:
+    """
+    Retrieves the best answer available when a run is ended before the assistant could conclude.
+    Args:
+        messages (list[AnyMessage]): The messages exchanged with the agent.
+    Returns:
+        str: The latest assistant text answer or tool result, or a message stating that no answer was found.
+    """
+    for message in reversed(messages):
+        if isinstance(message, (AIMessage, ToolMessage)) and isinstance(message.content, str) and len(message.content.strip()) > 0:
+            return message.content
+
+    return "No answer could be found within the question budget and deadline."
+
+
+def is_tool_loop(messages: list[AnyMessage]) -> bool:
+    """
+    Checks whether the assistant is looping, repeating a tool call with the same arguments.
+    Args:
+        messages (list[AnyMessage]): The messages exchanged with the agent.
+    Returns:
+        bool: True if a tool call was repeated at least AGENT_TOOL_LOOP_REPEATS times.
+    """
+    tool_calls_counts = {}
+    for message in messages:
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                tool_call_key = (tool_call["name"], json.dumps(tool_call["args"], sort_keys=True, default=str))
+                tool_calls_counts[tool_call_key] = tool_calls_counts.get(tool_call_key, 0) + 1
+
+    return any(count >= AGENT_TOOL_LOOP_REPEATS for count in tool_calls_counts.values())
+
+
+def route_assistant(state: AgentState) -> str:
+    """
+    Routes the assistant output to the tools, unless the question exceeded its budget or its deadline.
+    Args:
+        state (AgentState): The current state of the agent.
+    Returns:
+        str: The next node, "tools" or END.
+    """
+    if is_question_budget_exceeded() or is_deadline_expired():
+        logging.warning(f"The question budget or deadline is exceeded, the run ends with the best answer so far.")
+        return END
+
+    return tools_condition(state)
+
+
+@traced("graph.assistant")
+def assistant(state: AgentState, tools: Optional[List[Callable]] = None) -> AgentState:
     """
     Processes the given agent state to analyze input files and execute tasks using available tools.
     Args:
         state (AgentState): A dictionary containing the current state of the agent, including:
             - "input_file": The file to be analyzed (can be None if no file is provided).
             - "messages": A list of messages representing the conversation history.
+        tools (Optional[List[Callable]], optional): The tools available to the assistant, all the tools when None.
     Returns:
         dict: A dictionary containing:
             - "messages": A list of processed messages, including the system's response.
             - "input_file": The input file provided in the state.
     """
+    if is_question_budget_exceeded() or is_deadline_expired():
+        logging.warning(f"The question budget or deadline is exceeded, the assistant answers without calling the model.")
+        return {
+            "messages": [AIMessage(content=get_best_answer_so_far(state["messages"]))],
+            "input_file": state["input_file"]
+        }
+
+    if tools is None:
+        tools = get_tools()
+
     input_file = state["input_file"]
     if input_file is None:
         input_file = "No input file was provided."
@@ -92,7 +198,7 @@ def assistant(state: AgentState) -> AgentState:
             <tools>
                 You are provided with the following tools:
 ---
-{get_tools_description(get_tools())}
+{get_tools_description(tools)}
 ---
                 You will call any tools as many times as needed in order to fulfill a requested task.
                 If you are missing information, you can use the tools to find it.
@@ -110,7 +216,8 @@ def assistant(state: AgentState) -> AgentState:
             </final_answer>
         """)
 
-    tooling_llm = create_tooling_LLM()
+    escalation_reason = "tool_loop" if is_tool_loop(state["messages"]) else None
+    tooling_llm = create_tooling_LLM(tools, escalation_reason)
 
     return {
         "messages": [tooling_llm.invoke([sys_msg] + state["messages"])],
@@ -125,8 +232,8 @@ class AgentBasicTooling():
     by invoking a REACT graph and returning the response.
     Methods
     -------
-    __init__():
-        Initializes the REACT graph for processing queries.
+    __init__(excluded_tools: Optional[Iterable[str]] = None):
+        Initializes the REACT graph for processing queries, without the excluded tools.
     __call__(query: str, input_file: str = None) -> str:
         Executes a query against the REACT graph and returns the response.
     """
@@ -142,20 +249,37 @@ class AgentBasicTooling():
         """
         builder = StateGraph(AgentState)
 
+        tool_node = ToolNode(self._tools)
+
+        def assistant_with_tools(state: AgentState) -> AgentState:
+            return assistant(state, self._tools)
+
+        def tools(state: AgentState, config: RunnableConfig) -> AgentState:
+            with TRACER.start_as_current_span("graph.tools"):
+                return tool_node.invoke(state, config)
+
         # Add nodes for assistant logic and tools.
-        builder.add_node("assistant", assistant)
-        builder.add_node("tools", ToolNode(get_tools()))
+        builder.add_node("assistant", assistant_with_tools)
+        builder.add_node("tools", tools)
 
         # Define graph flow: start -> assistant -> tools (if needed) -> assistant.
         builder.add_edge(START, "assistant")
-        builder.add_conditional_edges("assistant", tools_condition)
+        builder.add_conditional_edges("assistant", route_assistant)
         builder.add_edge("tools", "assistant")
 
         # Compile and return the state graph.
         return builder.compile()
 
-    def __init__(self):
-        """Initializes the instance and sets up the REACT graph."""
+    def __init__(self, excluded_tools: Optional[Iterable[str]] = None):
+        """
+        Initializes the instance, builds the knowledge base index and sets up the REACT graph.
+        Args:
+            excluded_tools (Optional[Iterable[str]], optional): The names of the tools the agent cannot use.
+                Defaults to None.
+        """
+        self._tools = get_tools(excluded_tools)
+        if search_knowledge_base.__name__ not in set(excluded_tools or []):
+            get_knowledge_base_index()
         self._react_graph = self._create_REACT_graph()
 
     def __call__(self, query: str, input_file: str = None) -> str:
@@ -177,4 +301,9 @@ class AgentBasicTooling():
         response_messages = self._react_graph.invoke({"messages": messages, "input_file": input_file})
         response_content = response_messages["messages"][-1].content
 
+        # the run was ended by the budget or the deadline while tools were requested
+        last_message = response_messages["messages"][-1]
+        if isinstance(last_message, AIMessage) and len(last_message.tool_calls) > 0:
+            response_content = get_best_answer_so_far(response_messages["messages"])
+
         return response_messages, response_content
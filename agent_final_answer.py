@@ -3,11 +3,25 @@
 # It contains the implementation of a cached response handler for an AI agent, which formats intermediate answers into final responses.
 
 import logging
-from typing import Any, List, Tuple
+from typing import Any, Iterable, List, Optional, Tuple
 
 from agent_basic_tooling import AgentBasicTooling
 from langchain_core.messages import HumanMessage
 from setup import get_final_answer_LLM
+from library_deadline import QuestionDeadline
+from library_ledger import QuestionLedger
+from library_tracing import set_span_attributes, traced
+
+
+def is_final_answer_malformed(final_answer: Any) -> bool:
+    """
+    Checks whether a final answer breaks the formatting rules: empty, not a text, or spread over several lines.
+    Args:
+        final_answer (Any): The content of the final answer message.
+    Returns:
+        bool: True if the final answer is malformed.
+    """
+    return not isinstance(final_answer, str) or len(final_answer.strip()) == 0 or "\n" in final_answer.strip()
 
 
 class AgentFinalAnswer():
@@ -18,8 +32,22 @@ class AgentFinalAnswer():
         __call__(query: str, input_file_name: str = None) -> Tuple[List[Any], str]:
             Executes the agent pipeline to process the query and input file, 
             returning intermediate answers and a final formatted answer.
+        Attributes
+        ----------
+        question_ledger (QuestionLedger): The token usage and cost ledger of the last processed query.
     """
 
+    def __init__(self, excluded_tools: Optional[Iterable[str]] = None):
+        """
+        Initializes the instance.
+        Args:
+            excluded_tools (Optional[Iterable[str]], optional): The names of the tools the agent cannot use,
+                e.g. the knowledge base search when evaluating the agent against the knowledge base. Defaults to None.
+        """
+        self.question_ledger = None
+        self._excluded_tools = excluded_tools
+
+    @traced("question")
     def __call__(self, query: str, input_file_name: str = None) -> Tuple[List[Any], str]:
         """
         Executes the main logic of the agent by processing a query and optionally an input file, 
@@ -38,14 +66,18 @@ class AgentFinalAnswer():
         
         logging.debug(f"Using query: {query}")
         logging.debug(f"Using input_file: {input_file_name}")
+        set_span_attributes(**{"question.text": query, "question.input_file": input_file_name})
 
-        agent_basic_tooling = AgentBasicTooling()
-        intermediate_answers, intermediate_answer = agent_basic_tooling(
-            query=query,
-            input_file=input_file_name
-        )
+        self.question_ledger = QuestionLedger()
 
-        logging.debug(f"Obtained tooling agent answer : {intermediate_answer}")
+        agent_basic_tooling = AgentBasicTooling(self._excluded_tools)
+        with self.question_ledger, QuestionDeadline():
+            intermediate_answers, intermediate_answer = agent_basic_tooling(
+                query=query,
+                input_file=input_file_name
+            )
+
+        logging.debug("Obtained tooling agent answer : %s", intermediate_answer)
 
         formatting_prompt = f"""
             <role>
@@ -70,8 +102,15 @@ class AgentFinalAnswer():
         """
 
         final_answer_llm = get_final_answer_LLM()
-        final_answer_content = final_answer_llm.invoke([HumanMessage(content=formatting_prompt)]).content
+        with self.question_ledger:
+            final_answer_content = final_answer_llm.invoke([HumanMessage(content=formatting_prompt)]).content
+
+            if is_final_answer_malformed(final_answer_content):
+                logging.warning(f"The final answer is not formatted as requested, its formatting is escalated.")
+                final_answer_llm = get_final_answer_LLM("formatting_failure")
+                final_answer_content = final_answer_llm.invoke([HumanMessage(content=formatting_prompt)]).content
 
-        logging.debug(f"Obtained final answer : {final_answer_content}")
+        logging.debug("Obtained final answer : %s", final_answer_content)
+        logging.debug(f"Question token usage : {self.question_ledger.get_totals()}")
 
         return intermediate_answers, final_answer_content
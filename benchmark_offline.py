@@ -0,0 +1,389 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module benchmarks the agent offline, with scripted chat models and a local web server replaying saved pages.
+
+import os
+import re
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+# the benchmark never reaches the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+os.environ.setdefault("HF_TOKEN", "offline-benchmark")
+os.environ.setdefault("TAVILY_API_KEY", "offline-benchmark")
+os.environ.setdefault("MEDIA_UPLOAD_BACKEND", "local")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("TOOLS_MEMOIZATION_ENABLED", "0")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="benchmark_cache_"))
+
+import requests
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from opentelemetry import trace
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+import tools_web
+from agent_final_answer import AgentFinalAnswer
+from library_tools import get_percentile
+from setup import set_chat_LLM_factory
+from tools_knowledge_base import get_knowledge_base_index
+
+BENCHMARK_DIRECTORY = "./data/benchmark"
+BENCHMARK_PAGES_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "pages")
+BENCHMARK_QUESTIONS_FILE = os.path.join(BENCHMARK_DIRECTORY, "questions.json")
+BENCHMARK_BASELINES_FILE = os.path.join(BENCHMARK_DIRECTORY, "baselines.json")
+
+# a scenario regresses when its throughput drops, or its peak memory grows, by more than this fraction
+BENCHMARK_REGRESSION_TOLERANCE = 0.2
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A deterministic chat model answering the benchmark questions according to its role in the agent.
+    The assistant calls the web search tool once and then answers with its result, the content analysis models
+    find the expected answer only in the pages containing it, the other roles return well formed responses.
+    """
+
+    role: str
+    questions: List[Dict]
+    latency_seconds: float = 0.0
+    model: str = "scripted"
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools: List[Any], **kwargs: Any) -> "ScriptedChatModel":
+        return self
+
+    def _find_question(self, text: str) -> Optional[Dict]:
+        """
+        Finds the benchmark question a prompt is about.
+        Args:
+            text (str): The prompt text.
+        Returns:
+            Optional[Dict]: The benchmark question, None when the prompt is about none of them.
+        """
+        for question in self.questions:
+            if question["question"] in text:
+                return question
+
+        return None
+
+    def _get_response(self, messages: List[BaseMessage]) -> AIMessage:
+        """
+        Creates the scripted response of the model role.
+        Args:
+            messages (List[BaseMessage]): The input messages.
+        Returns:
+            AIMessage: The response.
+        """
+        text = "\n".join(message.content for message in messages if isinstance(message.content, str))
+        question = self._find_question(text)
+
+        if self.role == "baseline":
+            tool_messages = [message for message in messages if isinstance(message, ToolMessage)]
+            if len(tool_messages) > 0:
+                return AIMessage(content=tool_messages[-1].content)
+            return AIMessage(content="", tool_calls=[{
+                "name": "search_web_natural_language",
+                "args": {"query": question["question"] if question is not None else text},
+                "id": f"call_{uuid.uuid4().hex}"
+            }])
+
+        if self.role in ("strict_content_analysis", "loose_content_analysis"):
+            page_content = text.split("<page_content>")[-1]
+            if question is not None and question["answer"] in page_content:
+                return AIMessage(content=json.dumps({
+                    "confidence": 0.9, "response": question["answer"], "reasoning": "The page states the answer."
+                }))
+            return AIMessage(content=json.dumps({
+                "confidence": 0.0, "response": "", "reasoning": "The page does not answer the query."
+            }))
+
+        if self.role == "content_relevance":
+            return AIMessage(content=", ".join(re.findall(r'<page id="(\d+)">', text)))
+
+        if self.role == "final_answer":
+            intermediate_answer = text.split("<intermediate_answer>")[-1].split("</intermediate_answer>")[0]
+            return AIMessage(content=intermediate_answer.strip())
+
+        if self.role == "query_optimization" and question is not None:
+            return AIMessage(content=question["question"].rstrip("?"))
+
+        return AIMessage(content="")
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_seconds)
+
+        response = self._get_response(messages)
+
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        output_tokens = len(str(response.content)) // 4 + 10 * len(response.tool_calls)
+        response.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+
+class _LocalWebRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the saved pages under /pages/ and a search endpoint under /search ranking them by shared query terms.
+    """
+
+    def do_GET(self):
+        url_parts = urlsplit(self.path)
+
+        if url_parts.path == "/search":
+            query = parse_qs(url_parts.query).get("q", [""])[0]
+            links = [f"http://{self.headers['host']}/pages/{name}" for name in get_local_search_results(query)]
+            self._send(200, "application/json", json.dumps({"links": links}).encode("utf-8"))
+            return
+
+        page_name = os.path.basename(url_parts.path)
+        page_path = os.path.join(BENCHMARK_PAGES_DIRECTORY, page_name)
+        if not url_parts.path.startswith("/pages/") or not os.path.isfile(page_path):
+            self._send(404, "text/plain", b"Not found")
+            return
+
+        with open(page_path, "rb") as f:
+            self._send(200, "text/html; charset=utf-8", f.read())
+
+    def _send(self, status: int, content_type: str, data: bytes) -> None:
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def get_local_search_results(query: str) -> List[str]:
+    """
+    Ranks the saved pages by the number of query terms they contain.
+    Args:
+        query (str): The search query.
+    Returns:
+        List[str]: The names of the pages sharing at least one term with the query, best first.
+    """
+    query_terms = {term for term in re.findall(r"\w+", query.lower()) if len(term) > 3}
+
+    pages_scores = []
+    for page_name in sorted(os.listdir(BENCHMARK_PAGES_DIRECTORY)):
+        with open(os.path.join(BENCHMARK_PAGES_DIRECTORY, page_name), encoding="utf-8") as f:
+            page_terms = set(re.findall(r"\w+", f.read().lower()))
+        score = len(query_terms & page_terms)
+        if score > 0:
+            pages_scores.append((page_name, score))
+
+    return [page_name for page_name, _ in sorted(pages_scores, key=lambda item: item[1], reverse=True)]
+
+
+def start_local_web_server() -> ThreadingHTTPServer:
+    """
+    Starts the local web server on a free port, in a background thread.
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _LocalWebRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def get_stages_latencies(spans: List[Any]) -> Dict[str, Dict]:
+    """
+    Aggregates the latency of the finished spans by span name.
+    Args:
+        spans (List[Any]): The finished spans.
+    Returns:
+        Dict[str, Dict]: The number of spans and their mean, median and 95th percentile durations in milliseconds, by stage.
+    """
+    stages_durations = {}
+    for span in spans:
+        stages_durations.setdefault(span.name, []).append((span.end_time - span.start_time) / 1000000)
+
+    return {
+        stage: {
+            "count": len(durations),
+            "mean_ms": sum(durations) / len(durations),
+            "p50_ms": get_percentile(durations, 50),
+            "p95_ms": get_percentile(durations, 95)
+        }
+        for stage, durations in sorted(stages_durations.items())
+    }
+
+
+def run_scenario(
+        name: str,
+        questions: List[Dict],
+        answer: Callable[[Dict], str],
+        repeats: int,
+        latency_seconds: float,
+        spans_exporter: InMemorySpanExporter) -> Dict:
+    """
+    Runs the benchmark questions through a scenario, measuring throughput, stages latencies and peak memory.
+    Args:
+        name (str): The name of the scenario.
+        questions (List[Dict]): The benchmark questions.
+        answer (Callable[[Dict], str]): The function answering a question.
+        repeats (int): The number of times the questions are answered.
+        latency_seconds (float): The latency of the scripted model calls, recorded with the measurements.
+        spans_exporter (InMemorySpanExporter): The exporter collecting the spans of the run.
+    Returns:
+        Dict: The measurements of the scenario.
+    """
+    spans_exporter.clear()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+
+    correct_answers = 0
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for question in questions:
+            if answer(question).strip() == question["answer"]:
+                correct_answers = correct_answers + 1
+    elapsed_time = time.perf_counter() - start_time
+
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    answered_questions = len(questions) * repeats
+
+    return {
+        "scenario": name,
+        "latency_seconds": latency_seconds,
+        "questions": answered_questions,
+        "accuracy": correct_answers / answered_questions,
+        "questions_per_second": answered_questions / elapsed_time,
+        "peak_memory_bytes": peak_memory,
+        "stages": get_stages_latencies(spans_exporter.get_finished_spans())
+    }
+
+
+def compare_with_baseline(measurement: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Compares the measurements of a scenario with its baseline.
+    Args:
+        measurement (Dict): The measurements of the scenario.
+        baseline (Dict): The baseline measurements of the scenario.
+        tolerance (float): The fraction by which throughput may drop, and peak memory grow, without regressing.
+    Returns:
+        List[str]: The regressions found, empty when there are none.
+    """
+    regressions = []
+
+    if measurement["questions_per_second"] < baseline["questions_per_second"] * (1 - tolerance):
+        regressions.append(
+            f"{measurement['scenario']}: throughput dropped from {baseline['questions_per_second']:.2f} "
+            f"to {measurement['questions_per_second']:.2f} questions per second")
+    if measurement["peak_memory_bytes"] > baseline["peak_memory_bytes"] * (1 + tolerance):
+        regressions.append(
+            f"{measurement['scenario']}: peak memory grew from {baseline['peak_memory_bytes']} "
+            f"to {measurement['peak_memory_bytes']} bytes")
+    if measurement["accuracy"] < baseline["accuracy"]:
+        regressions.append(
+            f"{measurement['scenario']}: accuracy dropped from {baseline['accuracy']:.2f} to {measurement['accuracy']:.2f}")
+
+    return regressions
+
+
+def print_measurement(measurement: Dict, baseline: Optional[Dict]) -> None:
+    """
+    Prints the measurements of a scenario, along with its baseline stages latencies when available.
+    Args:
+        measurement (Dict): The measurements of the scenario.
+        baseline (Optional[Dict]): The baseline measurements of the scenario.
+    """
+    print(f"\n{measurement['scenario']}: {measurement['questions_per_second']:.2f} questions/s, "
+          f"accuracy {measurement['accuracy']:.2f}, peak memory {measurement['peak_memory_bytes'] / 1024 / 1024:.1f} MB")
+    print(f"{'stage':<48}{'count':>7}{'p50 (ms)':>12}{'p95 (ms)':>12}{'baseline p50':>14}")
+    for stage, latencies in measurement["stages"].items():
+        baseline_latencies = (baseline or {}).get("stages", {}).get(stage)
+        baseline_p50 = "-" if baseline_latencies is None else f"{baseline_latencies['p50_ms']:.1f}"
+        print(f"{stage:<48}{latencies['count']:>7}{latencies['p50_ms']:>12.1f}{latencies['p95_ms']:>12.1f}{baseline_p50:>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the agent offline, with scripted models and a local web server.")
+    parser.add_argument("--latency", type=float, default=0.05, help="The latency of each scripted model call, in seconds.")
+    parser.add_argument("--repeats", type=int, default=3, help="The number of times the questions are answered.")
+    parser.add_argument("--tolerance", type=float, default=BENCHMARK_REGRESSION_TOLERANCE, help="The regression tolerance.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the measurements as the new baselines.")
+    arguments = parser.parse_args()
+
+    with open(BENCHMARK_QUESTIONS_FILE, encoding="utf-8") as f:
+        benchmark_questions = json.load(f)
+
+    set_chat_LLM_factory(lambda role, model_parameters, callbacks: ScriptedChatModel(
+        role=role, questions=benchmark_questions, latency_seconds=arguments.latency, callbacks=callbacks
+    ))
+
+    local_web_server = start_local_web_server()
+    search_url = f"http://127.0.0.1:{local_web_server.server_address[1]}/search"
+    tools_web.WEB_SEARCH_PROVIDERS = {
+        "local": lambda query: requests.get(search_url, params={"q": query}, timeout=5).json()["links"]
+    }
+
+    # the knowledge base index is built once per process, outside of the measurements
+    get_knowledge_base_index()
+
+    benchmark_spans_exporter = InMemorySpanExporter()
+    trace.get_tracer_provider().add_span_processor(SimpleSpanProcessor(benchmark_spans_exporter))
+
+    def answer_with_agent(question: Dict) -> str:
+        _, final_answer = AgentFinalAnswer()(question["question"])
+        return final_answer
+
+    def answer_with_url_processing(question: Dict) -> str:
+        url_links, url_scores = tools_web.get_web_search_results_links(question["question"])
+        return tools_web.process_results_url_links(url_links, url_scores, question["question"])
+
+    measurements = [
+        run_scenario("agent_final_answer", benchmark_questions, answer_with_agent, arguments.repeats,
+                     arguments.latency, benchmark_spans_exporter),
+        run_scenario("process_results_url_links", benchmark_questions, answer_with_url_processing, arguments.repeats,
+                     arguments.latency, benchmark_spans_exporter)
+    ]
+    local_web_server.shutdown()
+
+    baselines = {}
+    if os.path.isfile(BENCHMARK_BASELINES_FILE):
+        with open(BENCHMARK_BASELINES_FILE, encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    regressions = []
+    for measurement in measurements:
+        baseline = baselines.get(measurement["scenario"])
+        if baseline is not None and baseline["latency_seconds"] != measurement["latency_seconds"]:
+            print(f"\nThe {measurement['scenario']} baseline was measured with another model latency and is ignored.")
+            baseline = None
+        print_measurement(measurement, baseline)
+        if baseline is not None:
+            regressions = regressions + compare_with_baseline(measurement, baseline, arguments.tolerance)
+
+    if arguments.save_baseline:
+        baselines.update({measurement["scenario"]: measurement for measurement in measurements})
+        with open(BENCHMARK_BASELINES_FILE, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=4)
+        print(f"\nBaselines saved to {BENCHMARK_BASELINES_FILE}")
+    elif len(regressions) > 0:
+        print("\nRegressions against the baselines:")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
@@ -0,0 +1,88 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module compares the payload size and latency of the inline and the preprocessed video analysis paths.
+
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from langchain_core.messages import HumanMessage
+
+from setup import get_video_LLM
+from tools_video import get_video_inline_content_parts, get_video_preprocessed_content_parts
+
+
+def get_payload_size(content_parts: List[Dict]) -> int:
+    """
+    Computes the size of the data carried by message content parts.
+    Args:
+        content_parts (List[Dict]): The message content parts.
+    Returns:
+        int: The size of the payload, in bytes.
+    """
+    payload_size = 0
+    for content_part in content_parts:
+        if content_part["type"] == "media":
+            payload_size = payload_size + len(content_part.get("data", content_part.get("file_uri", "")))
+        elif content_part["type"] == "image_url":
+            payload_size = payload_size + len(content_part["image_url"]["url"])
+        else:
+            payload_size = payload_size + len(content_part["text"])
+
+    return payload_size
+
+
+def benchmark_video_path(name: str, create_content_parts: Callable, video_file_path: str, query: str, invoke: bool) -> Dict:
+    """
+    Measures one video analysis path.
+    Args:
+        name (str): The name of the measured path.
+        create_content_parts (Callable): The function creating the message content parts for the video.
+        video_file_path (str): The path of the video file.
+        query (str): The query sent to the model when the model call is measured.
+        invoke (bool): Whether the model call should be measured as well.
+    Returns:
+        Dict: The measurements of the path.
+    """
+    start_time = time.perf_counter()
+    content_parts = create_content_parts(video_file_path)
+    preparation_time = time.perf_counter() - start_time
+
+    measurement = {
+        "path": name,
+        "payload_bytes": get_payload_size(content_parts),
+        "parts": len(content_parts),
+        "preparation_seconds": preparation_time,
+        "model_seconds": None
+    }
+
+    if invoke:
+        start_time = time.perf_counter()
+        get_video_LLM().invoke([HumanMessage(content=[{"type": "text", "text": query}] + content_parts)])
+        measurement["model_seconds"] = time.perf_counter() - start_time
+
+    return measurement
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the inline and the preprocessed video analysis payloads.")
+    parser.add_argument("video_file_path", help="The path of the video file to benchmark.")
+    parser.add_argument("--query", default="Describe what happens in the video.", help="The query used for the model call.")
+    parser.add_argument("--invoke", action="store_true", help="Also measure the model call latency (uses quota).")
+    arguments = parser.parse_args()
+
+    measurements = [
+        benchmark_video_path("inline", get_video_inline_content_parts,
+                             arguments.video_file_path, arguments.query, arguments.invoke),
+        benchmark_video_path("preprocessed", get_video_preprocessed_content_parts,
+                             arguments.video_file_path, arguments.query, arguments.invoke)
+    ]
+
+    print(f"{'path':<14}{'payload bytes':>16}{'parts':>8}{'prepare (s)':>14}{'model (s)':>12}")
+    for measurement in measurements:
+        model_seconds = "-" if measurement["model_seconds"] is None else f"{measurement['model_seconds']:.2f}"
+        print(f"{measurement['path']:<14}{measurement['payload_bytes']:>16}{measurement['parts']:>8}"
+              f"{measurement['preparation_seconds']:>14.2f}{model_seconds:>12}")
+
+    reduction = measurements[0]["payload_bytes"] / max(measurements[1]["payload_bytes"], 1)
+    print(f"Payload reduction factor: {reduction:.1f}x")
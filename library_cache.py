@@ -0,0 +1,271 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains a persistent file based cache used to avoid repeating expensive model and network calls.
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from library_tracing import set_span_attributes
+
+# the cache directory may be moved, e.g. so that benchmarks run with cold caches
+CACHE_DIRECTORY = os.environ.get("CACHE_DIRECTORY", "./data/cache")
+
+
+_FILE_LOCKS = {}
+_FILE_LOCKS_LOCK = threading.Lock()
+
+
+@contextmanager
+def file_lock(lock_path: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on a lock file, shared by the threads of the process and, where supported, other processes.
+    Args:
+        lock_path (str): The path of the lock file, created if needed.
+    """
+    with _FILE_LOCKS_LOCK:
+        thread_lock = _FILE_LOCKS.setdefault(os.path.abspath(lock_path), threading.Lock())
+
+    with thread_lock:
+        with open(lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_cache_key(*key_parts: Any) -> str:
+    """
+    Creates a stable cache key from JSON-serializable key parts.
+    Args:
+        *key_parts (Any): The parts identifying a cached value.
+    Returns:
+        str: The cache key.
+    """
+    return json.dumps(key_parts, sort_keys=True, ensure_ascii=False)
+
+
+class FileCache():
+    """
+    A persistent key-value cache storing each JSON-serializable value in its own file.
+    Entries are stored in a named directory under CACHE_DIRECTORY and may expire after a time to live.
+    When a maximum size is set, the least recently used entries are evicted once the cache grows above it.
+    """
+
+    def __init__(self, name: str, ttl_seconds: Optional[float] = None, max_size_bytes: Optional[int] = None):
+        """
+        Initializes the cache.
+        Args:
+            name (str): The name of the cache, used as its directory name.
+            ttl_seconds (Optional[float], optional): The time to live of the entries, None if entries never expire.
+            max_size_bytes (Optional[int], optional): The maximum size of the cache files, None for no limit.
+        """
+        self._name = name
+        self._directory = os.path.join(CACHE_DIRECTORY, name)
+        self._ttl_seconds = ttl_seconds
+        self._max_size_bytes = max_size_bytes
+
+        self._statistics = {"hits": 0, "stale_hits": 0, "misses": 0}
+        self._revalidated_keys = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(self._directory, exist_ok=True)
+
+    def _get_entry_path(self, key: str) -> str:
+        """
+        Returns the path of the file holding the entry for a key.
+        Args:
+            key (str): The cache key.
+        Returns:
+            str: The path of the entry file.
+        """
+        key_digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, f"{key_digest}.json")
+
+    def _read_entry(self, key: str) -> Optional[Dict]:
+        """
+        Reads the entry stored for a key, regardless of its age.
+        Args:
+            key (str): The cache key.
+        Returns:
+            Optional[Dict]: The entry, holding the creation time and the value, or None if no entry is stored.
+        """
+        entry_path = self._get_entry_path(key)
+        if not os.path.isfile(entry_path):
+            return None
+
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Cache {self._name} entry could not be read and is ignored: {str(e)}")
+            return None
+
+    def _touch_entry(self, key: str) -> None:
+        """
+        Marks an entry as recently used, the modification time of entry files ordering their eviction.
+        Args:
+            key (str): The cache key.
+        """
+        if self._max_size_bytes is None:
+            return
+
+        try:
+            os.utime(self._get_entry_path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache files fit within the maximum size.
+        """
+        if self._max_size_bytes is None:
+            return
+
+        entries = []
+        for entry_name in os.listdir(self._directory):
+            if not entry_name.endswith(".json"):
+                continue
+            entry_path = os.path.join(self._directory, entry_name)
+            try:
+                entry_stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+
+        cache_size = sum(entry_size for _, entry_size, _ in entries)
+        evicted_entries = 0
+        for _, entry_size, entry_path in sorted(entries):
+            if cache_size <= self._max_size_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            cache_size = cache_size - entry_size
+            evicted_entries = evicted_entries + 1
+
+        if evicted_entries > 0:
+            logging.debug(f"Cache {self._name} evicted {evicted_entries} entries, {cache_size} bytes are kept")
+
+    def _record_access(self, outcome: str) -> None:
+        """
+        Records the outcome of a cache access in the cache statistics.
+        Args:
+            outcome (str): One of "hits", "stale_hits" or "misses".
+        """
+        with self._lock:
+            self._statistics[outcome] = self._statistics[outcome] + 1
+
+        set_span_attributes(**{f"cache.{self._name}": outcome})
+        logging.debug(f"Cache {self._name} access outcome: {outcome}, statistics: {self.get_statistics()}")
+
+    def get_statistics(self) -> Dict:
+        """
+        Returns the access statistics of the cache since the process started.
+        Returns:
+            Dict: The number of hits, stale hits and misses, along with the hit rate (stale hits included).
+        """
+        with self._lock:
+            statistics = dict(self._statistics)
+
+        accesses = statistics["hits"] + statistics["stale_hits"] + statistics["misses"]
+        statistics["hit_rate"] = (statistics["hits"] + statistics["stale_hits"]) / accesses if accesses > 0 else 0.0
+
+        return statistics
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Retrieves a cached value.
+        Args:
+            key (str): The cache key.
+        Returns:
+            Optional[Any]: The cached value, or None if the value is not cached or has expired.
+        """
+        entry = self._read_entry(key)
+        if entry is None or (self._ttl_seconds is not None and time.time() - entry["created"] > self._ttl_seconds):
+            self._record_access("misses")
+            return None
+
+        self._record_access("hits")
+        self._touch_entry(key)
+        return entry["value"]
+
+    def _revalidate(self, key: str, compute: Callable[[], Any]) -> None:
+        """
+        Recomputes a stale value and stores it, at most one revalidation running per key.
+        Args:
+            key (str): The cache key.
+            compute (Callable[[], Any]): The function computing the value.
+        """
+        try:
+            self.set(key, compute())
+        except Exception as e:
+            logging.warning(f"Cache {self._name} revalidation failed, the stale value is kept: {str(e)}")
+        finally:
+            with self._lock:
+                self._revalidated_keys.discard(key)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], stale_seconds: float = 0) -> Any:
+        """
+        Retrieves a cached value, computing and storing it when it is missing.
+        Values older than the time to live, but within the stale period, are returned immediately
+        while being recomputed in the background (stale-while-revalidate).
+        Args:
+            key (str): The cache key.
+            compute (Callable[[], Any]): The function computing the value.
+            stale_seconds (float, optional): How long after expiry a stale value may still be served. Defaults to 0.
+        Returns:
+            Any: The cached or computed value.
+        """
+        entry = self._read_entry(key)
+        age = time.time() - entry["created"] if entry is not None else None
+
+        if entry is not None and (self._ttl_seconds is None or age <= self._ttl_seconds):
+            self._record_access("hits")
+            self._touch_entry(key)
+            return entry["value"]
+
+        if entry is not None and age <= self._ttl_seconds + stale_seconds:
+            self._record_access("stale_hits")
+            with self._lock:
+                is_revalidating = key in self._revalidated_keys
+                self._revalidated_keys.add(key)
+            if not is_revalidating:
+                threading.Thread(target=self._revalidate, args=(key, compute), daemon=True).start()
+            return entry["value"]
+
+        self._record_access("misses")
+        value = compute()
+        self.set(key, value)
+
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores a value in the cache.
+        Args:
+            key (str): The cache key.
+            value (Any): The JSON-serializable value to store.
+        """
+        entry_path = self._get_entry_path(key)
+        temporary_entry_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with open(temporary_entry_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "created": time.time(), "value": value}, f)
+        os.replace(temporary_entry_path, entry_path)
+
+        self._evict()
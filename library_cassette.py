@@ -0,0 +1,320 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains the cassettes recording the model, search, web and dataset interactions of a run, so that it can be replayed offline.
+
+import os
+import json
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from library_cache import get_cache_key
+
+# cassettes may be configured in the .env file, which can be imported before setup loads it
+load_dotenv()
+
+# "record" appends the interactions of the run to CASSETTE_FILE, "replay" serves them from it, "off" disables cassettes
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off")
+CASSETTE_FILE = os.environ.get("CASSETTE_FILE", "./data/cassettes/cassette.jsonl")
+
+# replayed interactions take their recorded duration divided by this speed, 0 replays them without any delay
+CASSETTE_REPLAY_SPEED = float(os.environ.get("CASSETTE_REPLAY_SPEED", "1"))
+
+# model parameters which change from one call to the other without changing the response
+CASSETTE_IGNORED_MODEL_PARAMETERS = {"timeout", "max_retries"}
+
+
+class Cassette():
+    """
+    Records interactions with external services in a JSON lines file, or replays them from it.
+    Interactions are identified by their kind and the digest of their request, the same request being
+    replayed in the order it was recorded.
+    """
+
+    def __init__(self, file_path: str, mode: str, replay_speed: float = 1.0):
+        """
+        Initializes the cassette.
+        Args:
+            file_path (str): The path of the cassette file.
+            mode (str): "record" or "replay".
+            replay_speed (float, optional): The replay speed of the recorded durations, 0 for no delay.
+        """
+        if mode not in ("record", "replay"):
+            raise Exception(f"The cassette mode {mode} is not supported.")
+
+        self._file_path = file_path
+        self._files_directory = os.path.splitext(file_path)[0] + "_files"
+        self._mode = mode
+        self._replay_speed = replay_speed
+        self._interactions = {}
+        self._replay_positions = {}
+        self._lock = threading.Lock()
+
+        if mode == "record":
+            os.makedirs(self._files_directory, exist_ok=True)
+        else:
+            with open(file_path, encoding="utf-8") as f:
+                for line in f:
+                    interaction = json.loads(line)
+                    self._interactions.setdefault(interaction["key"], []).append(interaction)
+
+            logging.debug(f"Cassette {file_path} loaded with {sum(len(items) for items in self._interactions.values())} interactions")
+
+    @property
+    def is_recording(self) -> bool:
+        return self._mode == "record"
+
+    def _record(self, interaction: Dict) -> None:
+        """
+        Appends an interaction to the cassette file.
+        Args:
+            interaction (Dict): The interaction.
+        """
+        with self._lock:
+            with open(self._file_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+
+    def _get_recorded_interaction(self, key: str, kind: str) -> Dict:
+        """
+        Retrieves the next recorded interaction of a request, the last one being repeated once all were replayed.
+        Args:
+            key (str): The digest of the request.
+            kind (str): The kind of interaction, for error reporting.
+        Returns:
+            Dict: The interaction.
+        """
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if interactions is None:
+                raise Exception(f"The cassette {self._file_path} holds no {kind} interaction for this request.")
+
+            position = self._replay_positions.get(key, 0)
+            self._replay_positions[key] = position + 1
+
+        return interactions[min(position, len(interactions) - 1)]
+
+    def call(self, kind: str, key_parts: List[Any], compute: Callable[[], Any],
+             to_record: Callable[[Any], Any] = lambda value: value,
+             from_record: Callable[[Any], Any] = lambda value: value) -> Any:
+        """
+        Performs an interaction, recording it, or replays it.
+        Failed interactions are recorded as well, and replayed as exceptions.
+        Args:
+            kind (str): The kind of interaction, e.g. "llm" or "http".
+            key_parts (List[Any]): The JSON-serializable parts identifying the request.
+            compute (Callable[[], Any]): The function performing the interaction.
+            to_record (Callable[[Any], Any], optional): Converts the result to a JSON-serializable value.
+            from_record (Callable[[Any], Any], optional): Converts a recorded value back to the result.
+        Returns:
+            Any: The result of the interaction.
+        """
+        key = hashlib.sha256(get_cache_key(kind, *key_parts).encode("utf-8")).hexdigest()
+
+        if not self.is_recording:
+            interaction = self._get_recorded_interaction(key, kind)
+            if self._replay_speed > 0:
+                time.sleep(interaction["duration_seconds"] / self._replay_speed)
+            if "error" in interaction:
+                raise Exception(interaction["error"])
+            return from_record(interaction["result"])
+
+        start_time = time.perf_counter()
+        try:
+            result = compute()
+        except Exception as e:
+            self._record({"key": key, "kind": kind, "duration_seconds": time.perf_counter() - start_time, "error": str(e)})
+            raise
+
+        self._record({"key": key, "kind": kind, "duration_seconds": time.perf_counter() - start_time, "result": to_record(result)})
+
+        return result
+
+    def call_file(self, kind: str, key_parts: List[Any], compute: Callable[[], str]) -> str:
+        """
+        Performs an interaction producing a file, copying the file next to the cassette, or replays it.
+        Args:
+            kind (str): The kind of interaction.
+            key_parts (List[Any]): The JSON-serializable parts identifying the request.
+            compute (Callable[[], str]): The function performing the interaction and returning the file path.
+        Returns:
+            str: The path of the file, the copy held by the cassette when replaying.
+        """
+        def compute_file() -> str:
+            file_path = compute()
+            shutil.copyfile(file_path, os.path.join(self._files_directory, os.path.basename(file_path)))
+            return file_path
+
+        return self.call(
+            kind,
+            key_parts,
+            compute_file,
+            to_record=os.path.basename,
+            from_record=lambda file_name: os.path.join(self._files_directory, file_name)
+        )
+
+
+CASSETTE = Cassette(CASSETTE_FILE, CASSETTE_MODE, CASSETTE_REPLAY_SPEED) if CASSETTE_MODE != "off" else None
+
+
+def record_or_replay(kind: str, key_parts: List[Any], compute: Callable[[], Any],
+                     to_record: Callable[[Any], Any] = lambda value: value,
+                     from_record: Callable[[Any], Any] = lambda value: value) -> Any:
+    """
+    Performs an interaction through the cassette of the run, or directly when cassettes are off.
+    Args:
+        kind (str): The kind of interaction.
+        key_parts (List[Any]): The JSON-serializable parts identifying the request.
+        compute (Callable[[], Any]): The function performing the interaction.
+        to_record (Callable[[Any], Any], optional): Converts the result to a JSON-serializable value.
+        from_record (Callable[[Any], Any], optional): Converts a recorded value back to the result.
+    Returns:
+        Any: The result of the interaction.
+    """
+    if CASSETTE is None:
+        return compute()
+
+    return CASSETTE.call(kind, key_parts, compute, to_record, from_record)
+
+
+def record_or_replay_file(kind: str, key_parts: List[Any], compute: Callable[[], str]) -> str:
+    """
+    Performs an interaction producing a file through the cassette of the run, or directly when cassettes are off.
+    Args:
+        kind (str): The kind of interaction.
+        key_parts (List[Any]): The JSON-serializable parts identifying the request.
+        compute (Callable[[], str]): The function performing the interaction and returning the file path.
+    Returns:
+        str: The path of the file.
+    """
+    if CASSETTE is None:
+        return compute()
+
+    return CASSETTE.call_file(kind, key_parts, compute)
+
+
+def encode_bytes(data: bytes) -> str:
+    """
+    Encodes binary data for recording.
+    Args:
+        data (bytes): The data.
+    Returns:
+        str: The base 64 encoded data.
+    """
+    return base64.b64encode(data).decode("ascii")
+
+
+def decode_bytes(data: str) -> bytes:
+    """
+    Decodes recorded binary data.
+    Args:
+        data (str): The base 64 encoded data.
+    Returns:
+        bytes: The data.
+    """
+    return base64.b64decode(data)
+
+
+def _get_content_key(content: Any) -> Any:
+    """
+    Creates the part of an LLM request key identifying a message content.
+    Uploaded file URIs are left out, as the same file gets a new URI once its upload expires.
+    Args:
+        content (Any): The message content, a string or a list of content parts.
+    Returns:
+        Any: The content without uploaded file URIs.
+    """
+    if not isinstance(content, list):
+        return content
+
+    return [
+        {name: value for name, value in part.items() if name != "file_uri"} if isinstance(part, dict) else part
+        for part in content
+    ]
+
+
+def _get_messages_key(messages: List[BaseMessage]) -> List:
+    """
+    Creates the part of an LLM request key identifying its messages.
+    Message and tool call ids are left out, as they differ from one run to the other.
+    Args:
+        messages (List[BaseMessage]): The messages.
+    Returns:
+        List: The type, content and tool calls of each message.
+    """
+    return [
+        [
+            message.type,
+            _get_content_key(message.content),
+            [[tool_call["name"], tool_call["args"]] for tool_call in getattr(message, "tool_calls", [])]
+        ]
+        for message in messages
+    ]
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    A chat model recording the responses of the wrapped model, or replaying them without any model.
+    """
+
+    role: str
+    model: str
+    parameters: Dict
+    tools_names: List[str] = []
+    chat_LLM: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def bind_tools(self, tools: List[Any], **kwargs: Any) -> "CassetteChatModel":
+        return CassetteChatModel(
+            role=self.role,
+            model=self.model,
+            parameters=self.parameters,
+            tools_names=[getattr(tool, "__name__", getattr(tool, "name", str(tool))) for tool in tools],
+            chat_LLM=self.chat_LLM.bind_tools(tools, **kwargs) if self.chat_LLM is not None else None,
+            callbacks=self.callbacks
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        response = record_or_replay(
+            "llm",
+            [self.role, self.parameters, self.tools_names, _get_messages_key(messages)],
+            lambda: self.chat_LLM.invoke(messages, stop=stop),
+            to_record=message_to_dict,
+            from_record=lambda recorded_message: messages_from_dict([recorded_message])[0]
+        )
+
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+
+def create_cassette_chat_LLM(role: str, model_parameters: Dict, callbacks: List,
+                             create_chat_LLM: Callable[[str, Dict, List], BaseChatModel]) -> CassetteChatModel:
+    """
+    Creates a chat model going through the cassette of the run.
+    Args:
+        role (str): The role of the model in the agent.
+        model_parameters (Dict): The model parameters.
+        callbacks (List): The callbacks of the model invocations, called once per recorded or replayed response.
+        create_chat_LLM (Callable[[str, Dict, List], BaseChatModel]): The factory of the recorded models.
+    Returns:
+        CassetteChatModel: The chat model.
+    """
+    return CassetteChatModel(
+        role=role,
+        model=model_parameters["model"],
+        parameters={
+            name: value for name, value in model_parameters.items() if name not in CASSETTE_IGNORED_MODEL_PARAMETERS
+        },
+        chat_LLM=create_chat_LLM(role, model_parameters, []) if CASSETTE.is_recording else None,
+        callbacks=callbacks
+    )
@@ -0,0 +1,260 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains a local chess position analysis, using a UCI engine when available and a built-in search otherwise.
+
+import os
+import time
+import shutil
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import chess
+import chess.engine
+
+# path of a UCI engine such as Stockfish, the built-in search is used when none is available
+CHESS_ENGINE_PATH = os.environ.get("CHESS_ENGINE_PATH") or shutil.which("stockfish")
+
+CHESS_ANALYSIS_DEPTH = 4
+CHESS_ANALYSIS_TIME_LIMIT = 2.0
+
+MATE_SCORE = 100000
+
+PIECES_VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 320,
+    chess.BISHOP: 330,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 0
+}
+
+
+class _SearchTimeout(Exception):
+    """
+    Raised when the built-in search runs out of time.
+    """
+    pass
+
+
+def _evaluate(board: chess.Board) -> int:
+    """
+    Evaluates a position from the point of view of the side to move, using material and piece centralization.
+    Args:
+        board (chess.Board): The position to evaluate.
+    Returns:
+        int: The evaluation in centipawns.
+    """
+    score = 0
+    for square, piece in board.piece_map().items():
+        centralization = 3 - max(abs(chess.square_file(square) - 3.5), abs(chess.square_rank(square) - 3.5))
+        piece_score = PIECES_VALUES[piece.piece_type]
+        if piece.piece_type in (chess.KNIGHT, chess.BISHOP, chess.PAWN):
+            piece_score = piece_score + int(10 * centralization)
+
+        score = score + (piece_score if piece.color == chess.WHITE else -piece_score)
+
+    return score if board.turn == chess.WHITE else -score
+
+
+def _get_ordered_moves(board: chess.Board, moves) -> List[chess.Move]:
+    """
+    Orders moves so that promising moves (promotions, good captures, checks) are searched first.
+    Args:
+        board (chess.Board): The current position.
+        moves: The moves to order.
+    Returns:
+        List[chess.Move]: The ordered moves.
+    """
+    def get_move_priority(move: chess.Move) -> int:
+        priority = 0
+        if move.promotion is not None:
+            priority = priority + PIECES_VALUES[move.promotion]
+        if board.is_capture(move):
+            victim = board.piece_at(move.to_square)
+            victim_value = PIECES_VALUES[victim.piece_type] if victim is not None else PIECES_VALUES[chess.PAWN]
+            priority = priority + 10 * victim_value - PIECES_VALUES[board.piece_at(move.from_square).piece_type]
+        if board.gives_check(move):
+            priority = priority + 500
+        return priority
+
+    return sorted(moves, key=get_move_priority, reverse=True)
+
+
+def _quiescence(board: chess.Board, alpha: int, beta: int, deadline: float) -> int:
+    """
+    Searches captures only, so that positions are not evaluated in the middle of an exchange.
+    Args:
+        board (chess.Board): The current position.
+        alpha (int): The lower bound of the search window.
+        beta (int): The upper bound of the search window.
+        deadline (float): The monotonic time at which the search must stop.
+    Returns:
+        int: The evaluation in centipawns from the point of view of the side to move.
+    """
+    stand_pat = _evaluate(board)
+    if stand_pat >= beta:
+        return stand_pat
+    alpha = max(alpha, stand_pat)
+
+    for move in _get_ordered_moves(board, board.generate_legal_captures()):
+        board.push(move)
+        score = -_quiescence(board, -beta, -alpha, deadline)
+        board.pop()
+
+        if score >= beta:
+            return score
+        alpha = max(alpha, score)
+
+    return alpha
+
+
+def _negamax(board: chess.Board, depth: int, alpha: int, beta: int, ply: int, deadline: float) -> Tuple[int, List[chess.Move]]:
+    """
+    Searches a position using negamax with alpha-beta pruning.
+    Args:
+        board (chess.Board): The current position.
+        depth (int): The remaining search depth, in plies.
+        alpha (int): The lower bound of the search window.
+        beta (int): The upper bound of the search window.
+        ply (int): The distance from the root position, in plies.
+        deadline (float): The monotonic time at which the search must stop.
+    Returns:
+        Tuple[int, List[chess.Move]]: The score from the point of view of the side to move and the principal variation.
+    """
+    if time.monotonic() > deadline:
+        raise _SearchTimeout()
+
+    if board.is_checkmate():
+        return -MATE_SCORE + ply, []
+    if board.is_stalemate() or board.is_insufficient_material():
+        return 0, []
+    if depth == 0:
+        return _quiescence(board, alpha, beta, deadline), []
+
+    best_score = -MATE_SCORE - 1
+    best_variation = []
+    for move in _get_ordered_moves(board, board.legal_moves):
+        board.push(move)
+        score, variation = _negamax(board, depth - 1, -beta, -alpha, ply + 1, deadline)
+        board.pop()
+        score = -score
+
+        if score > best_score:
+            best_score = score
+            best_variation = [move] + variation
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+
+    return best_score, best_variation
+
+
+def _search_position(board: chess.Board, depth: int, time_limit: float) -> Tuple[int, List[chess.Move], int]:
+    """
+    Searches a position with iterative deepening until the depth or the time limit is reached.
+    Args:
+        board (chess.Board): The position to search.
+        depth (int): The maximum search depth, in plies.
+        time_limit (float): The maximum search time, in seconds.
+    Returns:
+        Tuple[int, List[chess.Move], int]: The score of the side to move, the principal variation and the reached depth.
+    """
+    deadline = time.monotonic() + time_limit
+    search_board = board.copy(stack=False)
+
+    best_score, best_variation, reached_depth = 0, [], 0
+    for current_depth in range(1, depth + 1):
+        try:
+            best_score, best_variation = _negamax(search_board, current_depth, -MATE_SCORE - 1, MATE_SCORE + 1, 0, deadline)
+            reached_depth = current_depth
+        except _SearchTimeout:
+            logging.debug(f"Chess search stopped by the time limit at depth {current_depth}")
+            break
+
+        # a forced mate was found, deeper searches cannot improve it
+        if abs(best_score) > MATE_SCORE - 1000:
+            break
+
+    return best_score, best_variation, reached_depth
+
+
+def _get_variation_san(board: chess.Board, variation: List[chess.Move]) -> List[str]:
+    """
+    Converts a sequence of moves to standard algebraic notation.
+    Args:
+        board (chess.Board): The position the variation starts from.
+        variation (List[chess.Move]): The moves of the variation.
+    Returns:
+        List[str]: The moves in standard algebraic notation.
+    """
+    variation_board = board.copy(stack=False)
+    variation_san = []
+    for move in variation:
+        variation_san.append(variation_board.san(move))
+        variation_board.push(move)
+
+    return variation_san
+
+
+def analyse_chess_position(
+        board: chess.Board,
+        depth: int = CHESS_ANALYSIS_DEPTH,
+        time_limit: float = CHESS_ANALYSIS_TIME_LIMIT) -> Optional[Dict]:
+    """
+    Finds the best move of a legal chess position.
+    A UCI engine is used when CHESS_ENGINE_PATH is available, otherwise the built-in alpha-beta search is used.
+    Args:
+        board (chess.Board): The position to analyse.
+        depth (int, optional): The search depth of the built-in search, in plies.
+        time_limit (float, optional): The maximum analysis time, in seconds.
+    Returns:
+        Optional[Dict]: The analysis, holding the best move, the evaluation, the principal variation and whether
+            the analysis is approximate, or None if the side to move has no legal moves.
+    """
+    if board.is_game_over():
+        return None
+
+    start_time = time.perf_counter()
+
+    if CHESS_ENGINE_PATH is not None:
+        with chess.engine.SimpleEngine.popen_uci(CHESS_ENGINE_PATH) as engine:
+            engine_analysis = engine.analyse(board, chess.engine.Limit(time=time_limit))
+
+        variation = engine_analysis.get("pv", [])
+        score = engine_analysis["score"].pov(board.turn)
+        mate_in = score.mate()
+        centipawns = score.score()
+        engine_name = os.path.basename(CHESS_ENGINE_PATH)
+        reached_depth = engine_analysis.get("depth")
+        is_approximate = False
+    else:
+        search_score, variation, reached_depth = _search_position(board, depth, time_limit)
+        mate_in = None
+        centipawns = search_score
+        if abs(search_score) > MATE_SCORE - 1000:
+            mate_plies = MATE_SCORE - abs(search_score)
+            mate_in = (mate_plies + 1) // 2 if search_score > 0 else -((mate_plies + 1) // 2)
+            centipawns = None
+        engine_name = "built-in alpha-beta search"
+        # a forced mate found by the search is exact, a shallow material evaluation is not
+        is_approximate = mate_in is None
+
+    # the principal variation is empty only when the search was stopped before completing depth 1
+    if len(variation) == 0:
+        variation = [next(iter(board.legal_moves))]
+
+    analysis = {
+        "engine": engine_name,
+        "depth": reached_depth,
+        "best_move_san": board.san(variation[0]),
+        "best_move_uci": variation[0].uci(),
+        "mate_in": mate_in,
+        "centipawns": centipawns,
+        "principal_variation": _get_variation_san(board, variation),
+        "is_approximate": is_approximate,
+        "seconds": time.perf_counter() - start_time
+    }
+
+    logging.debug(f"Chess position analysis: {analysis}")
+
+    return analysis
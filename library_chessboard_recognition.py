@@ -0,0 +1,436 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains a local computer vision pipeline converting rendered chessboard diagrams to FEN notation.
+
+import os
+import json
+import shutil
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# piece templates bundled for the standard diagram style (see processing_chess_templates.py),
+# extended with templates learned from diagrams whose FEN notation was reviewed
+CHESS_TEMPLATES_FILE = "./data/chess_templates/templates.json"
+
+# diagrams read by the vision model wait here, with their FEN notation, until they are reviewed
+CHESS_TEMPLATES_CANDIDATES_DIRECTORY = "./data/chess_templates/candidates"
+
+# neighbour pixels differing by more than this are edges, the squares sizes are searched by fractions of a pixel
+GRID_EDGE_MIN_DIFFERENCE = 0.04
+GRID_STEP_RESOLUTION = 4
+
+SQUARE_SAMPLE_SIZE = 32
+SQUARE_BORDER_RATIO = 0.12
+
+# squares whose inner pixels vary less than this are considered empty
+EMPTY_SQUARE_MAX_DEVIATION = 0.035
+
+# pieces are recognized only when their best template matches at least this well
+PIECE_MATCH_MIN_SIMILARITY = 0.8
+
+# the kings, or failing that the pawns, of each side must be this many rows apart for the orientation to be trusted
+ORIENTATION_MIN_ROWS_DIFFERENCE = 1.0
+
+# templates of the same piece learned from other diagrams are merged above this similarity
+TEMPLATES_MERGE_MIN_SIMILARITY = 0.95
+TEMPLATES_MAX_PER_PIECE = 8
+
+
+def _load_grayscale_image(file_path: str) -> np.ndarray:
+    """
+    Loads an image as a grayscale array with values between 0 and 1.
+    Args:
+        file_path (str): The path of the image file.
+    Returns:
+        np.ndarray: The grayscale image.
+    """
+    image = ImageOps.exif_transpose(Image.open(file_path)).convert("L")
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def _find_grid_axis(edges_profile: np.ndarray) -> Tuple[float, float]:
+    """
+    Finds the 9 equally spaced lines of a chessboard grid along one axis.
+    Lines may fall one pixel off their expected position, so that non integer square sizes are found,
+    exact positions breaking the ties.
+    Args:
+        edges_profile (np.ndarray): The share of edge pixels along the other axis, for each boundary between two pixels.
+    Returns:
+        Tuple[float, float]: The position of the first line and the spacing between lines, in pixels.
+    """
+    length = len(edges_profile)
+    tolerant_profile = np.maximum(edges_profile, np.maximum(np.roll(edges_profile, 1), np.roll(edges_profile, -1)))
+    best_score, best_start, best_step = -1.0, 0.0, length / 8
+
+    for step in np.arange(np.ceil(length / 12 * GRID_STEP_RESOLUTION) / GRID_STEP_RESOLUTION, length / 8 + 1, 1 / GRID_STEP_RESOLUTION):
+        # the outer lines of a board filling the image fall on its borders, one boundary before the first pixel
+        starts = np.arange(-1, int(length - 8 * step) + 2)
+        if len(starts) == 0:
+            continue
+
+        lines_positions = np.clip(np.round(starts[:, None] + np.arange(9)[None, :] * step).astype(int), 0, length - 1)
+        scores = tolerant_profile[lines_positions].sum(axis=1) + edges_profile[lines_positions].sum(axis=1)
+
+        best_index = int(np.argmax(scores))
+        if scores[best_index] >= best_score:
+            best_score, best_start, best_step = float(scores[best_index]), float(starts[best_index]), float(step)
+
+    # the boundary following the pixel at the start position is the first line
+    return best_start + 1, best_step
+
+
+def find_chessboard_grid(image: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Locates the chessboard in a rendered diagram, using the periodic lines along which most pixels are edges.
+    The share of edge pixels is used rather than the edges strength, so that the contrasted outlines of the pieces
+    do not outweigh the squares boundaries.
+    Args:
+        image (np.ndarray): The grayscale image.
+    Returns:
+        Tuple[float, float, float]: The left and top coordinates of the board and the size of a square, in pixels.
+    """
+    horizontal_edges = (np.abs(np.diff(image, axis=1)) > GRID_EDGE_MIN_DIFFERENCE).mean(axis=0)
+    vertical_edges = (np.abs(np.diff(image, axis=0)) > GRID_EDGE_MIN_DIFFERENCE).mean(axis=1)
+
+    left, horizontal_step = _find_grid_axis(horizontal_edges)
+    top, vertical_step = _find_grid_axis(vertical_edges)
+
+    return left, top, (horizontal_step + vertical_step) / 2
+
+
+def get_squares_samples(image: np.ndarray, grid: Tuple[float, float, float]) -> List[List[np.ndarray]]:
+    """
+    Extracts normalized samples of the 64 squares of a chessboard, ranks from top to bottom.
+    Args:
+        image (np.ndarray): The grayscale image.
+        grid (Tuple[float, float, float]): The board left, top and square size, in pixels.
+    Returns:
+        List[List[np.ndarray]]: The samples of the squares, as 8 rows of 8 arrays.
+    """
+    left, top, square_size = grid
+    border = square_size * SQUARE_BORDER_RATIO
+
+    rows = []
+    for row in range(8):
+        samples = []
+        for column in range(8):
+            square = image[
+                int(top + row * square_size + border):int(top + (row + 1) * square_size - border),
+                int(left + column * square_size + border):int(left + (column + 1) * square_size - border)
+            ]
+            sample = Image.fromarray((square * 255).astype(np.uint8)).resize((SQUARE_SAMPLE_SIZE, SQUARE_SAMPLE_SIZE))
+            samples.append(np.asarray(sample, dtype=np.float32) / 255.0)
+        rows.append(samples)
+
+    return rows
+
+
+def _is_empty_square(sample: np.ndarray) -> bool:
+    """
+    Checks whether a square sample holds no piece.
+    Args:
+        sample (np.ndarray): The square sample.
+    Returns:
+        bool: True if the square is empty.
+    """
+    return float(sample.std()) < EMPTY_SQUARE_MAX_DEVIATION
+
+
+def _get_similarity(first_sample: np.ndarray, second_sample: np.ndarray) -> float:
+    """
+    Computes the normalized cross-correlation of two samples.
+    Args:
+        first_sample (np.ndarray): The first sample.
+        second_sample (np.ndarray): The second sample.
+    Returns:
+        float: The similarity, between -1 and 1.
+    """
+    first_centered = first_sample - first_sample.mean()
+    second_centered = second_sample - second_sample.mean()
+    norm = np.linalg.norm(first_centered) * np.linalg.norm(second_centered)
+    if norm == 0:
+        return 0.0
+
+    return float((first_centered * second_centered).sum() / norm)
+
+
+def load_piece_templates() -> Dict[str, List[np.ndarray]]:
+    """
+    Loads the learned piece templates.
+    Returns:
+        Dict[str, List[np.ndarray]]: The templates of each piece, keyed by the FEN piece symbol.
+    """
+    if not os.path.isfile(CHESS_TEMPLATES_FILE):
+        return {}
+
+    with open(CHESS_TEMPLATES_FILE, "r", encoding="utf-8") as f:
+        templates_json = json.load(f)
+
+    return {
+        piece: [np.array(template, dtype=np.float32) for template in templates]
+        for piece, templates in templates_json.items()
+    }
+
+
+def _save_piece_templates(templates: Dict[str, List[np.ndarray]]) -> None:
+    """
+    Saves the learned piece templates.
+    Args:
+        templates (Dict[str, List[np.ndarray]]): The templates of each piece, keyed by the FEN piece symbol.
+    """
+    os.makedirs(os.path.dirname(CHESS_TEMPLATES_FILE), exist_ok=True)
+
+    templates_json = {
+        piece: [np.round(template, 3).tolist() for template in piece_templates]
+        for piece, piece_templates in templates.items()
+    }
+
+    temporary_templates_file = CHESS_TEMPLATES_FILE + ".tmp"
+    with open(temporary_templates_file, "w", encoding="utf-8") as f:
+        json.dump(templates_json, f)
+    os.replace(temporary_templates_file, CHESS_TEMPLATES_FILE)
+
+
+def _get_board_rows(fen: str) -> List[str]:
+    """
+    Expands the piece placement of a FEN notation to 8 rows of 8 characters, "." marking empty squares.
+    Args:
+        fen (str): The FEN notation.
+    Returns:
+        List[str]: The rows of the board, from rank 8 to rank 1.
+    """
+    rows = []
+    for rank in fen.split()[0].split("/"):
+        rows.append("".join("." * int(symbol) if symbol.isdigit() else symbol for symbol in rank))
+
+    return rows
+
+
+def _get_fen_placement(rows: List[str]) -> str:
+    """
+    Compresses 8 rows of 8 characters to the piece placement of a FEN notation.
+    Args:
+        rows (List[str]): The rows of the board, from rank 8 to rank 1, "." marking empty squares.
+    Returns:
+        str: The FEN piece placement.
+    """
+    ranks = []
+    for row in rows:
+        rank = ""
+        empty_squares = 0
+        for symbol in row:
+            if symbol == ".":
+                empty_squares = empty_squares + 1
+                continue
+            if empty_squares > 0:
+                rank = rank + str(empty_squares)
+                empty_squares = 0
+            rank = rank + symbol
+        if empty_squares > 0:
+            rank = rank + str(empty_squares)
+        ranks.append(rank)
+
+    return "/".join(ranks)
+
+
+def _is_flipped_board(rows: List[str]) -> Optional[bool]:
+    """
+    Guesses whether a diagram is drawn from black's point of view, using the kings positions,
+    or the pawns positions when the kings do not tell.
+    Args:
+        rows (List[str]): The rows of the board as seen in the diagram, "." marking empty squares.
+    Returns:
+        Optional[bool]: True if black pieces start from the bottom of the diagram, None if the orientation is ambiguous.
+    """
+    for white_pieces, black_pieces in (("K", "k"), ("P", "p")):
+        white_rows = [index for index, row in enumerate(rows) for symbol in row if symbol in white_pieces]
+        black_rows = [index for index, row in enumerate(rows) for symbol in row if symbol in black_pieces]
+        if len(white_rows) == 0 or len(black_rows) == 0:
+            continue
+
+        rows_difference = np.mean(white_rows) - np.mean(black_rows)
+        if abs(rows_difference) >= ORIENTATION_MIN_ROWS_DIFFERENCE:
+            return bool(rows_difference < 0)
+
+    return None
+
+
+def _flip_rows(rows: List[str]) -> List[str]:
+    """
+    Rotates the rows of a board by 180 degrees.
+    Args:
+        rows (List[str]): The rows of the board.
+    Returns:
+        List[str]: The rotated rows.
+    """
+    return [row[::-1] for row in reversed(rows)]
+
+
+def _classify_piece(sample: np.ndarray, templates: Dict[str, List[np.ndarray]]) -> Tuple[str, float]:
+    """
+    Classifies the piece of a square sample by template matching.
+    Args:
+        sample (np.ndarray): The square sample.
+        templates (Dict[str, List[np.ndarray]]): The templates of each piece, keyed by the FEN piece symbol.
+    Returns:
+        Tuple[str, float]: The best matching piece and the margin of its similarity over the second best matching piece,
+            0 when even the best match is too weak.
+    """
+    pieces_similarities = sorted(
+        ((max(_get_similarity(sample, template) for template in piece_templates), piece)
+         for piece, piece_templates in templates.items() if len(piece_templates) > 0),
+        reverse=True
+    )
+
+    best_similarity, best_piece = pieces_similarities[0]
+    if best_similarity < PIECE_MATCH_MIN_SIMILARITY:
+        return best_piece, 0.0
+
+    second_similarity = pieces_similarities[1][0] if len(pieces_similarities) > 1 else 0.0
+
+    return best_piece, best_similarity - max(second_similarity, 0.0)
+
+
+def recognize_chessboard(file_path: str) -> Tuple[Optional[str], float]:
+    """
+    Recognizes a rendered chessboard diagram, producing the FEN piece placement and a confidence score.
+    Empty squares are detected from their uniformity, pieces are classified by template matching against
+    the learned templates. The confidence is the lowest margin between the best and the second best matching
+    pieces of a square, so that look-alike pieces are not confused silently. It is 0 when templates are missing
+    or the diagram orientation is ambiguous.
+    Args:
+        file_path (str): The path of the chessboard image file.
+    Returns:
+        Tuple[Optional[str], float]: The FEN piece placement (None if it cannot be produced) and the confidence.
+    """
+    templates = load_piece_templates()
+    if len(templates) == 0:
+        return None, 0.0
+
+    image = _load_grayscale_image(file_path)
+    samples = get_squares_samples(image, find_chessboard_grid(image))
+
+    rows = []
+    confidence = 1.0
+    for samples_row in samples:
+        row = ""
+        for sample in samples_row:
+            if _is_empty_square(sample):
+                row = row + "."
+                continue
+
+            piece, margin = _classify_piece(sample, templates)
+            row = row + piece
+            confidence = min(confidence, margin)
+        rows.append(row)
+
+    is_flipped = _is_flipped_board(rows)
+    if is_flipped is None:
+        logging.debug(f"The chessboard diagram orientation is ambiguous")
+        return None, 0.0
+
+    if is_flipped:
+        logging.debug(f"The chessboard diagram is drawn from black's point of view")
+        rows = _flip_rows(rows)
+
+    placement = _get_fen_placement(rows)
+    logging.debug(f"Recognized chessboard placement {placement} with confidence {confidence}")
+
+    return placement, confidence
+
+
+def learn_piece_templates(file_path: str, fen: str) -> None:
+    """
+    Learns piece templates from a chessboard diagram whose FEN notation was reviewed.
+    The diagram orientation is chosen as the one whose occupied squares best match the FEN placement.
+    Args:
+        file_path (str): The path of the chessboard image file.
+        fen (str): The FEN notation of the diagram.
+    """
+    image = _load_grayscale_image(file_path)
+    samples = get_squares_samples(image, find_chessboard_grid(image))
+    board_rows = _get_board_rows(fen)
+
+    occupancy = [["." if _is_empty_square(sample) else "x" for sample in samples_row] for samples_row in samples]
+
+    def get_occupancy_agreement(rows: List[str]) -> int:
+        return sum(
+            (rows[row][column] == ".") == (occupancy[row][column] == ".")
+            for row in range(8) for column in range(8)
+        )
+
+    if get_occupancy_agreement(_flip_rows(board_rows)) > get_occupancy_agreement(board_rows):
+        board_rows = _flip_rows(board_rows)
+
+    if get_occupancy_agreement(board_rows) < 64:
+        logging.debug(f"The FEN notation does not match the diagram occupancy, no templates are learned")
+        return
+
+    templates = load_piece_templates()
+    for row in range(8):
+        for column in range(8):
+            piece = board_rows[row][column]
+            if piece == ".":
+                continue
+
+            sample = samples[row][column]
+            piece_templates = templates.setdefault(piece, [])
+            if all(_get_similarity(sample, template) < TEMPLATES_MERGE_MIN_SIMILARITY for template in piece_templates):
+                piece_templates.append(sample)
+                del piece_templates[:-TEMPLATES_MAX_PER_PIECE]
+
+    _save_piece_templates(templates)
+    logging.debug(f"Learned chess piece templates from {file_path}")
+
+
+def save_template_candidate(file_path: str, fen: str) -> None:
+    """
+    Keeps a diagram read by the vision model, along with its FEN notation, so that it can be reviewed
+    before piece templates are learned from it. Vision model readings are not trusted as they are, a misread
+    piece would otherwise become a template.
+    Args:
+        file_path (str): The path of the chessboard image file.
+        fen (str): The FEN notation read by the vision model.
+    """
+    os.makedirs(CHESS_TEMPLATES_CANDIDATES_DIRECTORY, exist_ok=True)
+
+    candidate_file = os.path.join(CHESS_TEMPLATES_CANDIDATES_DIRECTORY, os.path.basename(file_path))
+    shutil.copyfile(file_path, candidate_file)
+    with open(candidate_file + ".fen", "w", encoding="utf-8") as f:
+        f.write(fen)
+
+    logging.debug(f"Chessboard diagram {file_path} kept for templates review")
+
+
+def get_template_candidates() -> List[Tuple[str, str]]:
+    """
+    Lists the diagrams kept for learning templates, waiting to be reviewed.
+    Returns:
+        List[Tuple[str, str]]: The path of each candidate diagram and the FEN notation read by the vision model.
+    """
+    if not os.path.isdir(CHESS_TEMPLATES_CANDIDATES_DIRECTORY):
+        return []
+
+    template_candidates = []
+    for file_name in sorted(os.listdir(CHESS_TEMPLATES_CANDIDATES_DIRECTORY)):
+        if not file_name.endswith(".fen"):
+            continue
+
+        candidate_file = os.path.join(CHESS_TEMPLATES_CANDIDATES_DIRECTORY, file_name[:-len(".fen")])
+        with open(candidate_file + ".fen", "r", encoding="utf-8") as f:
+            template_candidates.append((candidate_file, f.read().strip()))
+
+    return template_candidates
+
+
+def remove_template_candidate(candidate_file: str) -> None:
+    """
+    Removes a reviewed diagram, along with its FEN notation, from the template candidates.
+    Args:
+        candidate_file (str): The path of the candidate diagram.
+    """
+    os.remove(candidate_file)
+    os.remove(candidate_file + ".fen")
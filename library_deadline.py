@@ -0,0 +1,123 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains the per-question deadline, capping the timeouts of model and network calls.
+
+import os
+import time
+import contextvars
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# the deadline may be configured in the .env file, which can be imported before setup loads it
+load_dotenv()
+
+QUESTION_DEADLINE_SECONDS = float(os.environ.get("QUESTION_DEADLINE_SECONDS", "600"))
+
+# within this many seconds of the deadline, tools switch to cheaper modes
+QUESTION_DEADLINE_CLOSE_SECONDS = 120
+
+# timeouts are never capped below this, so that calls started just before the deadline can still fail cleanly
+MINIMUM_TIMEOUT_SECONDS = 1.0
+
+_CURRENT_DEADLINE = contextvars.ContextVar("question_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised at cooperative cancellation points once the question deadline has expired.
+    """
+    pass
+
+
+class QuestionDeadline():
+    """
+    The wall clock deadline of a question.
+    Used as a context manager, the deadline becomes the current deadline of the question, threads submitted
+    with a copy of the context included.
+    """
+
+    def __init__(self, seconds: float = QUESTION_DEADLINE_SECONDS):
+        """
+        Initializes the deadline.
+        Args:
+            seconds (float, optional): The time allowed for the question, in seconds.
+        """
+        self._deadline = time.monotonic() + seconds
+        self._context_token = None
+
+    def __enter__(self):
+        self._context_token = _CURRENT_DEADLINE.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _CURRENT_DEADLINE.reset(self._context_token)
+        return False
+
+    def get_remaining_time(self) -> float:
+        """
+        Returns the time left before the deadline.
+        Returns:
+            float: The remaining time in seconds, negative once expired.
+        """
+        return self._deadline - time.monotonic()
+
+
+def get_remaining_time() -> Optional[float]:
+    """
+    Returns the time left before the deadline of the question being answered.
+    Returns:
+        Optional[float]: The remaining time in seconds, or None outside of a question.
+    """
+    deadline = _CURRENT_DEADLINE.get()
+
+    return deadline.get_remaining_time() if deadline is not None else None
+
+
+def is_deadline_close() -> bool:
+    """
+    Checks whether the deadline of the question is close, so that cheaper modes should be used.
+    Returns:
+        bool: True within QUESTION_DEADLINE_CLOSE_SECONDS of the deadline.
+    """
+    remaining_time = get_remaining_time()
+
+    return remaining_time is not None and remaining_time < QUESTION_DEADLINE_CLOSE_SECONDS
+
+
+def is_deadline_expired() -> bool:
+    """
+    Checks whether the deadline of the question has expired.
+    Returns:
+        bool: True once expired, False as well outside of a question.
+    """
+    remaining_time = get_remaining_time()
+
+    return remaining_time is not None and remaining_time <= 0
+
+
+def check_deadline() -> None:
+    """
+    Cooperative cancellation point, stopping the current work once the question deadline has expired.
+    Raises:
+        DeadlineExceeded: If the deadline has expired.
+    """
+    if is_deadline_expired():
+        raise DeadlineExceeded("The question deadline has expired.")
+
+
+def get_deadline_timeout(timeout: Optional[float]) -> Optional[float]:
+    """
+    Caps a timeout by the time left before the question deadline.
+    Args:
+        timeout (Optional[float]): The timeout in seconds, None for no timeout.
+    Returns:
+        Optional[float]: The capped timeout, None only when there is neither a timeout nor a deadline.
+    """
+    remaining_time = get_remaining_time()
+    if remaining_time is None:
+        return timeout
+
+    capped_timeout = max(remaining_time, MINIMUM_TIMEOUT_SECONDS)
+
+    return capped_timeout if timeout is None else min(timeout, capped_timeout)
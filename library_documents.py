@@ -0,0 +1,182 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains text extractors for the documents retrieved from the web: HTML, PDF, plain text, JSON and CSV.
+
+import io
+import re
+import csv
+import json
+import logging
+from typing import Optional
+
+import markdownify
+from pypdf import PdfReader
+
+# extraction stops at these budgets, the extracted text is marked as truncated
+DOCUMENT_MAX_TEXT_SIZE = 200000
+DOCUMENT_PDF_MAX_PAGES = 40
+DOCUMENT_CSV_MAX_ROWS = 500
+
+DOCUMENT_TRUNCATION_MARKER = "\n\n[... the document was truncated ...]"
+
+# HTML documents without a declared encoding are searched for a <meta charset> declaration within this many bytes,
+# as browsers do
+HTML_CHARSET_SNIFF_SIZE = 1024
+HTML_CHARSET_PATTERN = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?\s*([A-Za-z0-9_.:-]+)", re.IGNORECASE)
+
+
+def _decode_text(data: bytes, encoding: Optional[str]) -> str:
+    """
+    Decodes document data to text, replacing undecodable bytes.
+    Args:
+        data (bytes): The document data.
+        encoding (Optional[str]): The encoding declared by the server, UTF-8 is used when None.
+    Returns:
+        str: The decoded text.
+    """
+    try:
+        return data.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+
+def _truncate_text(text: str, is_truncated: bool = False) -> str:
+    """
+    Truncates an extracted text to DOCUMENT_MAX_TEXT_SIZE, marking truncated texts.
+    Args:
+        text (str): The extracted text.
+        is_truncated (bool, optional): Whether the document was already truncated before extraction.
+    Returns:
+        str: The truncated text.
+    """
+    if len(text) > DOCUMENT_MAX_TEXT_SIZE:
+        return text[:DOCUMENT_MAX_TEXT_SIZE] + DOCUMENT_TRUNCATION_MARKER
+    if is_truncated:
+        return text + DOCUMENT_TRUNCATION_MARKER
+
+    return text
+
+
+def get_html_encoding(data: bytes) -> Optional[str]:
+    """
+    Finds the encoding of an HTML document from its byte order mark or its <meta charset> declaration.
+    Args:
+        data (bytes): The document data.
+    Returns:
+        Optional[str]: The encoding, None when the document does not declare it.
+    """
+    if data.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return "utf-16"
+
+    match = HTML_CHARSET_PATTERN.search(data[:HTML_CHARSET_SNIFF_SIZE])
+    if match is None:
+        return None
+
+    return match.group(1).decode("ascii")
+
+
+def extract_html_text(data: bytes, encoding: Optional[str], is_truncated: bool = False) -> str:
+    """
+    Converts an HTML document to markdown.
+    Args:
+        data (bytes): The document data.
+        encoding (Optional[str]): The encoding declared by the server, the one declared by the document is used when None.
+        is_truncated (bool, optional): Whether the data stops before the end of the document.
+    Returns:
+        str: The markdown content.
+    """
+    text = _decode_text(data, encoding or get_html_encoding(data))
+
+    return _truncate_text(markdownify.markdownify(text, heading_style="ATX"), is_truncated)
+
+
+def extract_plain_text(data: bytes, encoding: Optional[str], is_truncated: bool = False) -> str:
+    """
+    Extracts a plain text document, markdown documents included.
+    Args:
+        data (bytes): The document data.
+        encoding (Optional[str]): The encoding declared by the server.
+        is_truncated (bool, optional): Whether the data stops before the end of the document.
+    Returns:
+        str: The text content.
+    """
+    return _truncate_text(_decode_text(data, encoding), is_truncated)
+
+
+def extract_json_text(data: bytes, encoding: Optional[str], is_truncated: bool = False) -> str:
+    """
+    Extracts a JSON document, indented for readability when it can be parsed.
+    Args:
+        data (bytes): The document data.
+        encoding (Optional[str]): The encoding declared by the server.
+        is_truncated (bool, optional): Whether the data stops before the end of the document.
+    Returns:
+        str: The JSON content.
+    """
+    text = _decode_text(data, encoding)
+    if not is_truncated:
+        try:
+            text = json.dumps(json.loads(text), indent=1, ensure_ascii=False)
+        except ValueError:
+            logging.debug(f"JSON document cannot be parsed and is used as plain text")
+
+    return _truncate_text(text, is_truncated)
+
+
+def extract_csv_text(data: bytes, encoding: Optional[str], is_truncated: bool = False) -> str:
+    """
+    Converts a CSV document to a markdown table, up to DOCUMENT_CSV_MAX_ROWS rows.
+    Args:
+        data (bytes): The document data.
+        encoding (Optional[str]): The encoding declared by the server.
+        is_truncated (bool, optional): Whether the data stops before the end of the document.
+    Returns:
+        str: The markdown table.
+    """
+    text = _decode_text(data, encoding)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096])
+    except csv.Error:
+        dialect = csv.excel
+
+    lines = []
+    for index, row in enumerate(csv.reader(io.StringIO(text), dialect)):
+        if index > DOCUMENT_CSV_MAX_ROWS:
+            is_truncated = True
+            break
+
+        lines.append("| " + " | ".join(cell.replace("|", "\\|").strip() for cell in row) + " |")
+        if index == 0:
+            lines.append("|" + " --- |" * len(row))
+
+    return _truncate_text("\n".join(lines), is_truncated)
+
+
+def extract_pdf_text(data: bytes, encoding: Optional[str] = None, is_truncated: bool = False) -> str:
+    """
+    Extracts the text of a PDF document, page by page, up to DOCUMENT_PDF_MAX_PAGES pages or DOCUMENT_MAX_TEXT_SIZE characters.
+    Args:
+        data (bytes): The document data.
+        encoding (Optional[str], optional): Unused, PDF documents declare their own encodings.
+        is_truncated (bool, optional): Whether the data stops before the end of the document.
+    Returns:
+        str: The text content, pages being separated by page headers.
+    """
+    reader = PdfReader(io.BytesIO(data), strict=False)
+
+    pages_texts = []
+    text_size = 0
+    for index, page in enumerate(reader.pages):
+        if index >= DOCUMENT_PDF_MAX_PAGES or text_size >= DOCUMENT_MAX_TEXT_SIZE:
+            is_truncated = True
+            break
+
+        page_text = page.extract_text() or ""
+        pages_texts.append(f"## Page {index + 1}\n\n{page_text}")
+        text_size = text_size + len(page_text)
+
+    logging.debug(f"Extracted {len(pages_texts)} PDF pages out of {len(reader.pages)}")
+
+    return _truncate_text("\n\n".join(pages_texts), is_truncated)
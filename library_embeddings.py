@@ -0,0 +1,83 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains local text embedding utilities, running the chromadb default embedding model on CPU.
+
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+# texts are split in overlapping chunks of this size, in characters, before being embedded
+EMBEDDING_CHUNK_SIZE = 1000
+EMBEDDING_CHUNK_OVERLAP = 200
+
+_EMBEDDING_FUNCTION = None
+_EMBEDDING_FUNCTION_LOCK = threading.Lock()
+
+
+def get_embedding_function():
+    """
+    Returns the chromadb default embedding function (all-MiniLM-L6-v2 on ONNX runtime), created once per process.
+    The model is downloaded on first use.
+    Returns:
+        The embedding function, callable with a list of texts.
+    """
+    global _EMBEDDING_FUNCTION
+
+    with _EMBEDDING_FUNCTION_LOCK:
+        if _EMBEDDING_FUNCTION is None:
+            from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+            _EMBEDDING_FUNCTION = DefaultEmbeddingFunction()
+            logging.debug(f"Local embedding function initialized")
+
+    return _EMBEDDING_FUNCTION
+
+
+def get_text_chunks(
+        text: str,
+        chunk_size: int = EMBEDDING_CHUNK_SIZE,
+        chunk_overlap: int = EMBEDDING_CHUNK_OVERLAP,
+        max_chunks: Optional[int] = None) -> List[str]:
+    """
+    Splits a text in overlapping chunks, cutting at whitespace where possible.
+    Args:
+        text (str): The text to split.
+        chunk_size (int, optional): The maximum size of a chunk, in characters.
+        chunk_overlap (int, optional): The number of characters shared by consecutive chunks.
+        max_chunks (Optional[int], optional): The maximum number of chunks returned, None for no limit.
+    Returns:
+        List[str]: The chunks of the text.
+    """
+    chunks = []
+    start = 0
+    while start < len(text) and (max_chunks is None or len(chunks) < max_chunks):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            whitespace_index = text.rfind(" ", start + chunk_size // 2, end)
+            if whitespace_index != -1:
+                end = whitespace_index
+
+        chunk = text[start:end].strip()
+        if len(chunk) > 0:
+            chunks.append(chunk)
+
+        if end == len(text):
+            break
+        start = max(end - chunk_overlap, start + 1)
+
+    return chunks
+
+
+def get_embeddings(texts: List[str]) -> np.ndarray:
+    """
+    Embeds texts with the local embedding model.
+    Args:
+        texts (List[str]): The texts to embed.
+    Returns:
+        np.ndarray: The unit-normalized embeddings, one row per text.
+    """
+    embeddings = np.array(get_embedding_function()(texts), dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    return embeddings / np.maximum(norms, 1e-12)
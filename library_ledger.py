@@ -0,0 +1,227 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains the per-question ledger of LLM token usage and cost, along with its budget enforcement.
+
+import os
+import logging
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# budgets may be configured in the .env file, which can be imported before setup loads it
+load_dotenv()
+
+# a question ends with its best answer so far once either budget is exceeded
+QUESTION_TOKEN_BUDGET = int(os.environ.get("QUESTION_TOKEN_BUDGET", "500000"))
+QUESTION_COST_BUDGET = float(os.environ.get("QUESTION_COST_BUDGET", "0.25"))
+
+# prices in USD per million input and output tokens, models are matched by name prefix
+LLM_COSTS_PER_MILLION_TOKENS = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.15, 0.60),
+    "gemini-2.5-pro": (1.25, 10.00)
+}
+
+_CURRENT_LEDGER = contextvars.ContextVar("question_ledger", default=None)
+
+
+def get_LLM_cost(model: Optional[str], input_tokens: int, output_tokens: int) -> float:
+    """
+    Computes the cost of an LLM call.
+    Args:
+        model (Optional[str]): The model name, with or without the "models/" prefix.
+        input_tokens (int): The number of input tokens.
+        output_tokens (int): The number of output tokens.
+    Returns:
+        float: The cost in USD, 0 for models missing from LLM_COSTS_PER_MILLION_TOKENS.
+    """
+    model_name = (model or "").split("/")[-1]
+
+    matching_models = [name for name in LLM_COSTS_PER_MILLION_TOKENS if model_name.startswith(name)]
+    if len(matching_models) == 0:
+        logging.warning(f"No cost is known for the model {model}, its calls are counted as free")
+        return 0.0
+
+    input_cost, output_cost = LLM_COSTS_PER_MILLION_TOKENS[max(matching_models, key=len)]
+
+    return (input_tokens * input_cost + output_tokens * output_cost) / 1000000
+
+
+class QuestionLedger():
+    """
+    Accumulates the token usage and cost of the LLM calls made while answering one question.
+    Used as a context manager, the ledger becomes the current ledger of the question, threads submitted
+    with a copy of the context included.
+    """
+
+    def __init__(self, token_budget: int = QUESTION_TOKEN_BUDGET, cost_budget: float = QUESTION_COST_BUDGET):
+        """
+        Initializes the ledger.
+        Args:
+            token_budget (int, optional): The maximum number of tokens of the question.
+            cost_budget (float, optional): The maximum cost of the question, in USD.
+        """
+        self._token_budget = token_budget
+        self._cost_budget = cost_budget
+        self._totals = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cost": 0.0}
+        self._roles_totals = {}
+        self._routing_decisions = []
+        self._lock = threading.Lock()
+        self._context_token = None
+
+    def __enter__(self):
+        self._context_token = _CURRENT_LEDGER.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _CURRENT_LEDGER.reset(self._context_token)
+        return False
+
+    def add_usage(self, role: str, model: Optional[str], input_tokens: int, output_tokens: int) -> None:
+        """
+        Records the usage of an LLM call.
+        Args:
+            role (str): The role of the model in the agent.
+            model (Optional[str]): The model name.
+            input_tokens (int): The number of input tokens.
+            output_tokens (int): The number of output tokens.
+        """
+        usage = {
+            "calls": 1,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "cost": get_LLM_cost(model, input_tokens, output_tokens)
+        }
+
+        with self._lock:
+            role_totals = self._roles_totals.setdefault(role, {name: 0 for name in usage})
+            for name, value in usage.items():
+                self._totals[name] = self._totals[name] + value
+                role_totals[name] = role_totals[name] + value
+
+        logging.debug(f"LLM usage of {role} ({model}): {usage}, question totals: {self._totals}")
+
+    def add_routing_decision(self, role: str, reason: str, model: str, is_escalated: bool) -> None:
+        """
+        Records a request to escalate a role to the stronger model.
+        Args:
+            role (str): The role of the model in the agent.
+            reason (str): The signal which asked for the escalation.
+            model (str): The model used.
+            is_escalated (bool): Whether the stronger model was used, escalations being declined close to the deadline.
+        """
+        with self._lock:
+            self._routing_decisions.append({"role": role, "reason": reason, "model": model, "escalated": is_escalated})
+
+    def get_routing_decisions(self) -> List[Dict]:
+        """
+        Returns the escalation requests of the question.
+        Returns:
+            List[Dict]: The role, reason, model and outcome of each escalation request, in order.
+        """
+        with self._lock:
+            return [dict(routing_decision) for routing_decision in self._routing_decisions]
+
+    def is_budget_exceeded(self) -> bool:
+        """
+        Checks whether the question exceeded its token or cost budget.
+        Returns:
+            bool: True if a budget is exceeded.
+        """
+        with self._lock:
+            return self._totals["total_tokens"] > self._token_budget or self._totals["cost"] > self._cost_budget
+
+    def get_totals(self) -> Dict:
+        """
+        Returns the usage totals of the question.
+        Returns:
+            Dict: The number of calls, the tokens and the cost, overall and by model role,
+                along with the budgets and whether they were exceeded.
+        """
+        with self._lock:
+            totals = dict(self._totals)
+            totals["by_role"] = {role: dict(role_totals) for role, role_totals in self._roles_totals.items()}
+
+        totals["token_budget"] = self._token_budget
+        totals["cost_budget"] = self._cost_budget
+        totals["budget_exceeded"] = self.is_budget_exceeded()
+
+        return totals
+
+
+def get_question_ledger() -> Optional[QuestionLedger]:
+    """
+    Returns the ledger of the question being answered.
+    Returns:
+        Optional[QuestionLedger]: The current ledger, or None outside of a question.
+    """
+    return _CURRENT_LEDGER.get()
+
+
+def record_routing_decision(role: str, reason: str, model: str, is_escalated: bool) -> None:
+    """
+    Records an escalation request in the ledger of the question being answered, if any.
+    Args:
+        role (str): The role of the model in the agent.
+        reason (str): The signal which asked for the escalation.
+        model (str): The model used.
+        is_escalated (bool): Whether the stronger model was used.
+    """
+    ledger = get_question_ledger()
+    if ledger is not None:
+        ledger.add_routing_decision(role, reason, model, is_escalated)
+
+
+def is_question_budget_exceeded() -> bool:
+    """
+    Checks whether the question being answered exceeded its budget.
+    Returns:
+        bool: True if a budget is exceeded, False as well outside of a question.
+    """
+    ledger = get_question_ledger()
+
+    return ledger is not None and ledger.is_budget_exceeded()
+
+
+class LedgerCallbackHandler(BaseCallbackHandler):
+    """
+    Reports the usage metadata of each LLM call to the ledger of the current question.
+    """
+
+    def __init__(self, role: str):
+        """
+        Initializes the handler.
+        Args:
+            role (str): The role of the model in the agent.
+        """
+        self._role = role
+        self._models = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._models[run_id] = (kwargs.get("metadata") or {}).get("ls_model_name") or (kwargs.get("invocation_params") or {}).get("model")
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        model = self._models.pop(run_id, None)
+
+        ledger = get_question_ledger()
+        if ledger is None:
+            return
+
+        for generations in response.generations:
+            for generation in generations:
+                usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                ledger.add_usage(
+                    self._role,
+                    model,
+                    usage_metadata.get("input_tokens", 0),
+                    usage_metadata.get("output_tokens", 0)
+                )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._models.pop(run_id, None)
@@ -0,0 +1,148 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains the asynchronous logging pipeline: records are queued on the hot path and formatted and written
+# by a background listener, with per-field truncation, file rotation and an optional JSON format.
+
+import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Any
+
+LOGGING_FORMAT = '%(asctime)s - %(levelname)s - %(module)s - %(funcName)s : %(message)s'
+
+# the queue is bounded, records are dropped rather than blocking the agent when the listener falls behind
+LOGGING_QUEUE_MAX_SIZE = 10000
+
+
+def _truncate(value: Any, max_size: int) -> Any:
+    """
+    Truncates the string form of a logged value.
+    Args:
+        value (Any): The logged value.
+        max_size (int): The maximum size, in characters.
+    Returns:
+        Any: The value itself when short enough, otherwise its truncated string form.
+    """
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= max_size:
+        return value
+
+    return f"{text[:max_size]} ... [{len(text) - max_size} characters truncated]"
+
+
+class TruncatingFilter(logging.Filter):
+    """
+    Truncates the message and each argument of the log records, so that large payloads do not reach the log files.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        Initializes the filter.
+        Args:
+            max_size (int): The maximum size of the message and of each argument, in characters.
+        """
+        super().__init__()
+        self._max_size = max_size
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # a message with arguments is a format string, only its arguments are truncated
+        if not record.args:
+            record.msg = _truncate(record.msg, self._max_size)
+        elif isinstance(record.args, tuple):
+            record.args = tuple(_truncate(arg, self._max_size) for arg in record.args)
+        elif isinstance(record.args, dict):
+            record.args = {name: _truncate(arg, self._max_size) for name, arg in record.args.items()}
+
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats log records as JSON lines.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_item = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "function": record.funcName,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            log_item["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_item["exception"] = record.exc_text
+
+        return json.dumps(log_item, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues log records without formatting them, the formatting being left to the listener thread.
+    Records are dropped when the queue is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # exceptions tracebacks are rendered now, as the exception objects may not outlive the current frame
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def configure_logging(
+        level: int,
+        file_path: str,
+        max_bytes: int,
+        backup_count: int,
+        field_max_size: int,
+        use_json: bool = False) -> logging.handlers.QueueListener:
+    """
+    Configures the root logger to queue records, which are written by a background listener to a rotating file.
+    The previous log file is rotated at start instead of being truncated.
+    Args:
+        level (int): The logging level of the root logger.
+        file_path (str): The path of the log file.
+        max_bytes (int): The size at which the log file is rotated.
+        backup_count (int): The number of rotated log files kept.
+        field_max_size (int): The maximum size of the message and of each argument, in characters.
+        use_json (bool, optional): Whether records are written as JSON lines. Defaults to False.
+    Returns:
+        logging.handlers.QueueListener: The started listener, stopped at exit.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        file_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+    if os.path.isfile(file_path) and os.path.getsize(file_path) > 0:
+        file_handler.doRollover()
+
+    file_handler.setFormatter(JSONFormatter() if use_json else logging.Formatter(LOGGING_FORMAT))
+    file_handler.addFilter(TruncatingFilter(field_max_size))
+
+    records_queue = queue.Queue(maxsize=LOGGING_QUEUE_MAX_SIZE)
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(DeferredQueueHandler(records_queue))
+    root_logger.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
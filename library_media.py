@@ -0,0 +1,279 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains utility functions for local media preprocessing using ffmpeg.
+
+import os
+import re
+import logging
+import subprocess
+import tempfile
+from typing import List, Optional, Tuple
+
+FFMPEG_EXECUTABLE = "ffmpeg"
+FFPROBE_EXECUTABLE = "ffprobe"
+
+# shortest interval between two regularly sampled frames, in seconds
+VIDEO_MINIMUM_SAMPLING_INTERVAL = 0.5
+
+
+def run_media_command(arguments: List[str]) -> subprocess.CompletedProcess:
+    """
+    Runs an ffmpeg / ffprobe command and checks its outcome.
+    Args:
+        arguments (List[str]): The command line arguments, including the executable.
+    Returns:
+        subprocess.CompletedProcess: The completed process, with captured stdout and stderr.
+    Raises:
+        Exception: If the command fails.
+    """
+    result = subprocess.run(arguments, capture_output=True, check=False)
+    if result.returncode != 0:
+        error_output = result.stderr.decode("utf-8", errors="ignore")[-2000:]
+        raise Exception(f"Media command failed: {' '.join(arguments)} \n{error_output}")
+
+    return result
+
+
+def get_media_duration(file_path: str) -> float:
+    """
+    Retrieves the duration of an audio or video file.
+    Args:
+        file_path (str): The path of the media file.
+    Returns:
+        float: The duration of the media file in seconds.
+    """
+    result = run_media_command([
+        FFPROBE_EXECUTABLE,
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        file_path
+    ])
+
+    return float(result.stdout.decode("utf-8").strip())
+
+
+def has_audio_stream(file_path: str) -> bool:
+    """
+    Checks whether a media file contains at least one audio stream.
+    Args:
+        file_path (str): The path of the media file.
+    Returns:
+        bool: True if the file contains an audio stream, False otherwise.
+    """
+    result = run_media_command([
+        FFPROBE_EXECUTABLE,
+        "-v", "error",
+        "-select_streams", "a",
+        "-show_entries", "stream=index",
+        "-of", "csv=p=0",
+        file_path
+    ])
+
+    return len(result.stdout.strip()) > 0
+
+
+def subsample_evenly(items: List, count: int) -> List:
+    """
+    Selects a given number of items evenly spread over a list, always keeping the first and the last item.
+    Args:
+        items (List): The items to select from.
+        count (int): The number of items to select.
+    Returns:
+        List: The selected items, in their original order.
+    """
+    if count >= len(items):
+        return list(items)
+    if count <= 0:
+        return []
+    if count == 1:
+        return [items[0]]
+
+    indexes = sorted({round(index * (len(items) - 1) / (count - 1)) for index in range(count)})
+    return [items[index] for index in indexes]
+
+
+def extract_video_keyframes(
+        video_file_path: str,
+        frames_budget: int,
+        frame_max_size: int,
+        scene_change_threshold: float) -> List[Tuple[float, bytes]]:
+    """
+    Extracts downscaled JPEG keyframes from a video file.
+    Frames are sampled at an adaptive rate, so that a regular sampling of the whole video fits the frames budget,
+    and additionally whenever a scene change is detected. The result is then evenly reduced to the frames budget.
+    Args:
+        video_file_path (str): The path of the video file.
+        frames_budget (int): The maximum number of frames to extract.
+        frame_max_size (int): The maximum width and height of an extracted frame, in pixels.
+        scene_change_threshold (float): The scene change score (between 0 and 1) above which a frame is always sampled.
+    Returns:
+        List[Tuple[float, bytes]]: The extracted frames as (timestamp in seconds, JPEG data) tuples.
+    """
+    duration = get_media_duration(video_file_path)
+    sampling_interval = max(duration / max(frames_budget, 1), VIDEO_MINIMUM_SAMPLING_INTERVAL)
+
+    logging.debug(f"Video duration is {duration}s, using sampling interval {sampling_interval}s")
+
+    video_filter = ",".join([
+        f"select='gt(scene,{scene_change_threshold})+isnan(prev_selected_t)+gte(t-prev_selected_t,{sampling_interval})'",
+        f"scale='min({frame_max_size},iw)':'min({frame_max_size},ih)':force_original_aspect_ratio=decrease",
+        "showinfo"
+    ])
+
+    with tempfile.TemporaryDirectory() as frames_directory:
+        result = run_media_command([
+            FFMPEG_EXECUTABLE,
+            "-hide_banner",
+            "-i", video_file_path,
+            "-an",
+            "-vf", video_filter,
+            "-vsync", "vfr",
+            "-q:v", "5",
+            os.path.join(frames_directory, "frame_%05d.jpg")
+        ])
+
+        frames_timestamps = [
+            float(timestamp)
+            for timestamp in re.findall(r"pts_time:\s*([0-9.]+)", result.stderr.decode("utf-8", errors="ignore"))
+        ]
+        frames_files = sorted(os.listdir(frames_directory))
+
+        frames = []
+        for index, frame_file in enumerate(frames_files):
+            timestamp = frames_timestamps[index] if index < len(frames_timestamps) else index * sampling_interval
+            with open(os.path.join(frames_directory, frame_file), "rb") as f:
+                frames.append((timestamp, f.read()))
+
+    logging.debug(f"Extracted {len(frames)} candidate keyframes")
+
+    return subsample_evenly(frames, frames_budget)
+
+
+def extract_audio_track(media_file_path: str, bitrate: str = "32k", sample_rate: int = 16000) -> Optional[bytes]:
+    """
+    Extracts the audio track of a media file as a compact mono MP3.
+    Args:
+        media_file_path (str): The path of the media file.
+        bitrate (str, optional): The target MP3 bitrate. Defaults to "32k".
+        sample_rate (int, optional): The target sample rate in Hz. Defaults to 16000.
+    Returns:
+        Optional[bytes]: The MP3 audio data, or None if the media file has no audio stream.
+    """
+    if not has_audio_stream(media_file_path):
+        return None
+
+    result = run_media_command([
+        FFMPEG_EXECUTABLE,
+        "-hide_banner",
+        "-i", media_file_path,
+        "-vn",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-b:a", bitrate,
+        "-f", "mp3",
+        "pipe:1"
+    ])
+
+    return result.stdout
+
+
+def detect_silences(media_file_path: str, noise_level: str, minimum_duration: float) -> List[Tuple[float, float]]:
+    """
+    Detects the silent intervals of a media file.
+    Args:
+        media_file_path (str): The path of the media file.
+        noise_level (str): The volume under which audio is considered silent, for example "-35dB".
+        minimum_duration (float): The minimum duration of a silent interval, in seconds.
+    Returns:
+        List[Tuple[float, float]]: The silent intervals as (start, end) tuples, in seconds.
+    """
+    result = run_media_command([
+        FFMPEG_EXECUTABLE,
+        "-hide_banner",
+        "-i", media_file_path,
+        "-vn",
+        "-af", f"silencedetect=noise={noise_level}:d={minimum_duration}",
+        "-f", "null",
+        "-"
+    ])
+
+    detection_output = result.stderr.decode("utf-8", errors="ignore")
+    silences_starts = [float(value) for value in re.findall(r"silence_start:\s*(-?[0-9.]+)", detection_output)]
+    silences_ends = [float(value) for value in re.findall(r"silence_end:\s*([0-9.]+)", detection_output)]
+
+    return list(zip(silences_starts, silences_ends))
+
+
+def get_segments_boundaries(
+        duration: float,
+        silences: List[Tuple[float, float]],
+        target_duration: float,
+        maximum_duration: float) -> List[Tuple[float, float]]:
+    """
+    Splits a media duration into segments cut in the middle of silent intervals.
+    Each cut is placed on the silence closest to the target segment duration, a segment is cut without
+    a silence only when no silence is found before the maximum segment duration.
+    Args:
+        duration (float): The duration of the media file, in seconds.
+        silences (List[Tuple[float, float]]): The silent intervals as (start, end) tuples, in seconds.
+        target_duration (float): The preferred duration of a segment, in seconds.
+        maximum_duration (float): The maximum duration of a segment, in seconds.
+    Returns:
+        List[Tuple[float, float]]: The segments as (start, end) tuples, in seconds.
+    """
+    silences_middles = [(silence_start + silence_end) / 2 for silence_start, silence_end in silences]
+
+    segments = []
+    segment_start = 0.0
+    while duration - segment_start > maximum_duration:
+        candidate_cuts = [
+            middle for middle in silences_middles
+            if segment_start + target_duration / 2 <= middle <= segment_start + maximum_duration
+        ]
+
+        if len(candidate_cuts) > 0:
+            segment_end = min(candidate_cuts, key=lambda middle: abs(middle - segment_start - target_duration))
+        else:
+            segment_end = segment_start + maximum_duration
+
+        segments.append((segment_start, segment_end))
+        segment_start = segment_end
+
+    segments.append((segment_start, duration))
+
+    return segments
+
+
+def extract_audio_segment(
+        media_file_path: str,
+        start: float,
+        end: float,
+        bitrate: str = "32k",
+        sample_rate: int = 16000) -> bytes:
+    """
+    Extracts a segment of the audio track of a media file as a compact mono MP3.
+    Args:
+        media_file_path (str): The path of the media file.
+        start (float): The start of the segment, in seconds.
+        end (float): The end of the segment, in seconds.
+        bitrate (str, optional): The target MP3 bitrate. Defaults to "32k".
+        sample_rate (int, optional): The target sample rate in Hz. Defaults to 16000.
+    Returns:
+        bytes: The MP3 audio data of the segment.
+    """
+    result = run_media_command([
+        FFMPEG_EXECUTABLE,
+        "-hide_banner",
+        "-ss", f"{start:.3f}",
+        "-to", f"{end:.3f}",
+        "-i", media_file_path,
+        "-vn",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-b:a", bitrate,
+        "-f", "mp3",
+        "pipe:1"
+    ])
+
+    return result.stdout
@@ -0,0 +1,69 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains a limiter keeping concurrent model requests under the API quota.
+
+import time
+import threading
+import collections
+
+# Gemini free tier quota, shared by all concurrent model requests of the process
+LLM_MAX_CONCURRENT_REQUESTS = 4
+LLM_MAX_REQUESTS_PER_MINUTE = 15
+
+
+class QuotaLimiter():
+    """
+    Limits both the number of concurrent requests and the number of requests started within a time window.
+    Can be used as a context manager around each request.
+    """
+
+    def __init__(self, max_concurrency: int, max_requests_per_window: int, window_seconds: float = 60):
+        """
+        Initializes the limiter.
+        Args:
+            max_concurrency (int): The maximum number of requests running at the same time.
+            max_requests_per_window (int): The maximum number of requests started within a time window.
+            window_seconds (float, optional): The length of the time window, in seconds. Defaults to 60.
+        """
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._max_requests_per_window = max_requests_per_window
+        self._window_seconds = window_seconds
+        self._requests_start_times = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a new request is allowed to start.
+        """
+        self._semaphore.acquire()
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while len(self._requests_start_times) > 0 and now - self._requests_start_times[0] >= self._window_seconds:
+                    self._requests_start_times.popleft()
+
+                if len(self._requests_start_times) < self._max_requests_per_window:
+                    self._requests_start_times.append(now)
+                    return
+
+                wait_time = self._window_seconds - (now - self._requests_start_times[0])
+
+            time.sleep(wait_time)
+
+    def release(self) -> None:
+        """
+        Marks a request as finished.
+        """
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+LLM_QUOTA_LIMITER = QuotaLimiter(LLM_MAX_CONCURRENT_REQUESTS, LLM_MAX_REQUESTS_PER_MINUTE)
@@ -1,26 +1,188 @@
 # Copyright (c) Iuga Marin
 # This file is part of the HuggingFace free AI Agents course assignment.
-# It contains utility functions for handling base64 encoding and file retrieval.
+# It contains utility functions for handling base64 encoding, media payloads and file retrieval.
 
+import os
+import re
+import functools
+import json
+import time
 import base64
+import shutil
+import hashlib
+import logging
+import mimetypes
+import threading
 from inspect import signature
-from typing import List, Callable
+from typing import Any, Dict, Iterator, List, Callable, Optional, Tuple
+
+from library_cache import CACHE_DIRECTORY, FileCache, get_cache_key
+from library_cassette import record_or_replay
+from library_deadline import is_deadline_close
+from library_ledger import is_question_budget_exceeded
+from setup import GOOGLE_API_KEY, MEDIA_UPLOAD_BACKEND
 from tools_hfhub import get_GAIA_dataset_file
 
+# encoded payloads are streamed to disk in chunks which are a multiple of 3 bytes, so they concatenate cleanly
+MEDIA_ENCODING_CHUNK_SIZE = 3 * 1024 * 1024
+MEDIA_PAYLOADS_DIRECTORY = os.path.join(CACHE_DIRECTORY, "media_payloads")
+
+# the encoded payloads directory is kept under this size by evicting the least recently used payloads
+MEDIA_PAYLOADS_MAX_SIZE_BYTES = 1024 * 1024 * 1024
+
+# media files whose encoded payload is larger than this are uploaded to the model backend instead of being sent inline,
+# the payload stays under the model API request limit and larger payloads are never loaded into memory
+MEDIA_INLINE_MAX_SIZE_BYTES = 16 * 1024 * 1024
+
+# Gemini uploaded files expire after 48 hours, handles are reused for a bit less than that
+MEDIA_UPLOAD_HANDLES_CACHE = FileCache("media_upload_handles", ttl_seconds=46 * 60 * 60)
+
+# outcomes of the model JSON responses parsing: parsed as is, parsed after repair, or failed
+_JSON_PARSING_STATISTICS = {"parsed": 0, "repaired": 0, "failed": 0}
+_JSON_PARSING_STATISTICS_LOCK = threading.Lock()
+
+_FILE_DIGESTS = {}
+_FILE_DIGESTS_LOCK = threading.Lock()
+
+# memoized tool results are stored in one cache per tool, each cache holding at most this size
+TOOL_RESULTS_CACHE_MAX_SIZE_BYTES = 64 * 1024 * 1024
+
+_TOOL_RESULTS_CACHES = {}
+_TOOL_RESULTS_CACHES_LOCK = threading.Lock()
+
+
+def iter_base_64_file_data_by_path(file_path: str, chunk_size: int = MEDIA_ENCODING_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Encodes the content of a file to Base64 chunk by chunk, without reading the whole file into memory.
+    Args:
+        file_path (str): The path to the file to be encoded.
+        chunk_size (int, optional): The size of the read chunks, must be a multiple of 3.
+    Returns:
+        Iterator[str]: The consecutive Base64-encoded chunks of the file's content.
+    """
+    with open(file_path, "rb") as f:
+        while True:
+            file_chunk = f.read(chunk_size)
+            if len(file_chunk) == 0:
+                break
+            yield base64.b64encode(file_chunk).decode("utf-8")
+
+
+def get_file_digest(file_path: str) -> str:
+    """
+    Computes the SHA-256 digest of a file, reading it in chunks.
+    Digests are remembered for the lifetime of the process while the file size and modification time are unchanged.
+    Args:
+        file_path (str): The path to the file to be hashed.
+    Returns:
+        str: The hexadecimal SHA-256 digest of the file's content.
+    """
+    file_stat = os.stat(file_path)
+    file_key = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+
+    with _FILE_DIGESTS_LOCK:
+        if file_key in _FILE_DIGESTS:
+            return _FILE_DIGESTS[file_key]
+
+    with open(file_path, "rb") as f:
+        file_digest = hashlib.file_digest(f, "sha256").hexdigest()
+
+    with _FILE_DIGESTS_LOCK:
+        _FILE_DIGESTS[file_key] = file_digest
+
+    return file_digest
+
+
+def _evict_media_payloads(kept_payload_path: str) -> None:
+    """
+    Evicts the least recently used encoded payloads until the payloads fit MEDIA_PAYLOADS_MAX_SIZE_BYTES.
+    Args:
+        kept_payload_path (str): The path of a payload which must not be evicted.
+    """
+    payloads = []
+    for payload_name in os.listdir(MEDIA_PAYLOADS_DIRECTORY):
+        payload_path = os.path.join(MEDIA_PAYLOADS_DIRECTORY, payload_name)
+        if not payload_name.endswith(".b64") or payload_path == kept_payload_path:
+            continue
+        try:
+            payload_stat = os.stat(payload_path)
+        except OSError:
+            continue
+        payloads.append((payload_stat.st_mtime, payload_stat.st_size, payload_path))
+
+    payloads_size = os.path.getsize(kept_payload_path) + sum(payload_size for _, payload_size, _ in payloads)
+    for _, payload_size, payload_path in sorted(payloads):
+        if payloads_size <= MEDIA_PAYLOADS_MAX_SIZE_BYTES:
+            break
+        try:
+            os.remove(payload_path)
+        except OSError:
+            continue
+        logging.debug(f"Evicted encoded media payload: {payload_path}")
+        payloads_size = payloads_size - payload_size
+
+
+def get_base_64_payload_path(file_path: str) -> str:
+    """
+    Returns the path of the cached Base64-encoded payload of a file, encoding it in a streaming way if needed.
+    Args:
+        file_path (str): The path to the file to be encoded.
+    Returns:
+        str: The path of the file holding the Base64-encoded content.
+    """
+    os.makedirs(MEDIA_PAYLOADS_DIRECTORY, exist_ok=True)
+    payload_path = os.path.join(MEDIA_PAYLOADS_DIRECTORY, f"{get_file_digest(file_path)}.b64")
+
+    if os.path.isfile(payload_path):
+        # the modification time orders the payloads eviction
+        os.utime(payload_path)
+    else:
+        temporary_payload_path = f"{payload_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_payload_path, "w", encoding="utf-8") as f:
+            for encoded_chunk in iter_base_64_file_data_by_path(file_path):
+                f.write(encoded_chunk)
+        os.replace(temporary_payload_path, payload_path)
+
+        _evict_media_payloads(payload_path)
+
+    return payload_path
+
+
+def get_base_64_encoded_size(file_size: int) -> int:
+    """
+    Computes the size of the Base64-encoded content of a file.
+    Args:
+        file_size (int): The size of the file, in bytes.
+    Returns:
+        int: The size of the Base64-encoded content, in bytes.
+    """
+    return 4 * ((file_size + 2) // 3)
+
 
 def get_base_64_file_data_by_path(file_path: str) -> str:
     """
     Converts the content of a file at the given path to a Base64-encoded string.
+    The encoded payload is cached by file digest, so each file is encoded only once.
     Args:
         file_path (str): The path to the file to be encoded.
     Returns:
         str: The Base64-encoded string representation of the file's content.
+    Raises:
+        Exception: If the encoded payload is larger than MEDIA_INLINE_MAX_SIZE_BYTES, such files must be uploaded.
     """
-    file_content = None
-    with open(file_path, "rb") as f:
-        file_content = f.read()
+    encoded_size = get_base_64_encoded_size(os.path.getsize(file_path))
+    if encoded_size > MEDIA_INLINE_MAX_SIZE_BYTES:
+        raise Exception(
+            f"The encoded payload of {encoded_size} bytes of the file {file_path} is larger than "
+            f"the {MEDIA_INLINE_MAX_SIZE_BYTES} bytes inline limit, the file must be uploaded.")
 
-    return base64.b64encode(file_content).decode("utf-8")
+    try:
+        with open(get_base_64_payload_path(file_path), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        # the payload was evicted by a concurrent call in the meantime, it is encoded again
+        with open(get_base_64_payload_path(file_path), "r", encoding="utf-8") as f:
+            return f.read()
 
 
 def get_file_data_base_64(file_name: str) -> str:
@@ -37,6 +199,528 @@ def get_file_data_base_64(file_name: str) -> str:
     return base_64_data
 
 
+class MediaUploader():
+    """
+    Uploads media files to a model backend file store, returning a file handle usable in model requests.
+    The base uploader stands for the "none" backend, which does not support uploads.
+    """
+    name = "none"
+    supports_uploads = False
+
+    def upload(self, file_path: str, mime_type: str) -> str:
+        """
+        Uploads a media file.
+        Args:
+            file_path (str): The path to the file to be uploaded.
+            mime_type (str): The mime type of the file.
+        Returns:
+            str: The URI of the uploaded file.
+        """
+        raise NotImplementedError(f"The {self.name} media uploader does not support uploads.")
+
+
+class GeminiMediaUploader(MediaUploader):
+    """
+    Uploads media files using the Gemini Files API. The file is streamed by the client, never fully loaded into memory.
+    """
+    name = "gemini"
+    supports_uploads = True
+
+    def upload(self, file_path: str, mime_type: str) -> str:
+        # uploads go through the cassette of the run, so that replays never reach the Files API
+        return record_or_replay(
+            "gemini_upload",
+            [get_file_digest(file_path), mime_type],
+            lambda: self._upload_file(file_path, mime_type)
+        )
+
+    def _upload_file(self, file_path: str, mime_type: str) -> str:
+        """
+        Uploads a media file using the Gemini Files API, waiting for the backend to process it.
+        Args:
+            file_path (str): The path to the file to be uploaded.
+            mime_type (str): The mime type of the file.
+        Returns:
+            str: The URI of the uploaded file.
+        """
+        from google import genai
+
+        client = genai.Client(api_key=GOOGLE_API_KEY)
+        uploaded_file = client.files.upload(file=file_path, config={"mime_type": mime_type})
+
+        # videos are processed by the backend before they can be used
+        while uploaded_file.state is not None and uploaded_file.state.name == "PROCESSING":
+            time.sleep(2)
+            uploaded_file = client.files.get(name=uploaded_file.name)
+
+        if uploaded_file.state is not None and uploaded_file.state.name == "FAILED":
+            raise Exception(f"The Gemini backend failed to process the uploaded file: {file_path}")
+
+        return uploaded_file.uri
+
+
+class LocalMediaUploader(MediaUploader):
+    """
+    Local stand-in for a model backend file store, used for tests and offline runs.
+    Files are copied to a local directory and referenced using file URIs.
+    """
+    name = "local"
+    supports_uploads = True
+
+    def __init__(self, directory: str = os.path.join(CACHE_DIRECTORY, "media_uploads")):
+        self._directory = directory
+
+    def upload(self, file_path: str, mime_type: str) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+
+        extension = mimetypes.guess_extension(mime_type) or ""
+        uploaded_file_path = os.path.join(self._directory, f"{get_file_digest(file_path)}{extension}")
+        shutil.copyfile(file_path, uploaded_file_path)
+
+        return f"file://{os.path.abspath(uploaded_file_path)}"
+
+
+def get_media_uploader() -> MediaUploader:
+    """
+    Returns the media uploader of the configured model backend.
+    Returns:
+        MediaUploader: The media uploader selected by MEDIA_UPLOAD_BACKEND.
+    Raises:
+        Exception: If MEDIA_UPLOAD_BACKEND names an unknown backend.
+    """
+    media_uploaders = {
+        GeminiMediaUploader.name: GeminiMediaUploader,
+        LocalMediaUploader.name: LocalMediaUploader,
+        MediaUploader.name: MediaUploader
+    }
+
+    if MEDIA_UPLOAD_BACKEND not in media_uploaders:
+        raise Exception(
+            f"The media upload backend {MEDIA_UPLOAD_BACKEND} is not supported, "
+            f"set MEDIA_UPLOAD_BACKEND to one of: {', '.join(media_uploaders)}.")
+
+    return media_uploaders[MEDIA_UPLOAD_BACKEND]()
+
+
+def get_media_content_part(file_path: str, mime_type: str) -> Dict:
+    """
+    Creates the message content part used for sending a media file to the model.
+    Small files are sent inline from the encoded payloads cache, large files are uploaded once per digest
+    and referenced by the returned file handle afterwards.
+    Args:
+        file_path (str): The path to the media file.
+        mime_type (str): The mime type of the media file.
+    Returns:
+        Dict: The message content part referencing the media file.
+    Raises:
+        Exception: If the file is too large to be sent inline and cannot be uploaded.
+    """
+    file_size = os.path.getsize(file_path)
+    is_sent_inline = get_base_64_encoded_size(file_size) <= MEDIA_INLINE_MAX_SIZE_BYTES
+    media_uploader = None if is_sent_inline else get_media_uploader()
+
+    if media_uploader is not None and not media_uploader.supports_uploads:
+        raise Exception(
+            f"Media file of {file_size} bytes is too large to be sent inline and the {media_uploader.name} "
+            f"media upload backend does not support uploads.")
+
+    if media_uploader is not None:
+        upload_key = get_cache_key(media_uploader.name, get_file_digest(file_path))
+
+        try:
+            file_uri = MEDIA_UPLOAD_HANDLES_CACHE.get(upload_key)
+            if file_uri is None:
+                logging.debug(f"Uploading media file of {file_size} bytes using the {media_uploader.name} backend")
+                file_uri = media_uploader.upload(file_path, mime_type)
+                MEDIA_UPLOAD_HANDLES_CACHE.set(upload_key, file_uri)
+            else:
+                logging.debug(f"Reusing uploaded media file handle: {file_uri}")
+
+            return {
+                "type": "media",
+                "file_uri": file_uri,
+                "mime_type": mime_type
+            }
+        except Exception as e:
+            raise Exception(f"Media file of {file_size} bytes is too large to be sent inline and could not be uploaded: {str(e)}")
+
+    return {
+        "type": "media",
+        "data": get_base_64_file_data_by_path(file_path),
+        "mime_type": mime_type
+    }
+
+
+def get_file_media_content_part(file_name: str) -> Dict:
+    """
+    Creates the message content part used for sending a media file from the GAIA dataset to the model.
+    Args:
+        file_name (str): The name of the file from the GAIA dataset.
+    Returns:
+        Dict: The message content part referencing the media file.
+    """
+    file_location = get_GAIA_dataset_file(file_name)
+    mime_type = mimetypes.guess_type(file_name)[0]
+
+    return get_media_content_part(file_location, mime_type)
+
+
+def get_reciprocal_rank_fusion(ranked_lists: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Merges several ranked lists of items using reciprocal rank fusion.
+    Each item scores the sum of 1 / (k + rank) over the lists it appears in, so items ranked well
+    by several lists come first, without needing comparable scores between lists.
+    Args:
+        ranked_lists (List[List[str]]): The ranked lists of items, best items first.
+        k (int, optional): The rank smoothing constant. Defaults to 60.
+    Returns:
+        List[Tuple[str, float]]: The fused items and their scores, best items first.
+    """
+    fused_scores = {}
+    for ranked_list in ranked_lists:
+        for rank, item in enumerate(ranked_list, start=1):
+            fused_scores[item] = fused_scores.get(item, 0.0) + 1.0 / (k + rank)
+
+    return sorted(fused_scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def get_percentile(values: List[float], percentile: float) -> Optional[float]:
+    """
+    Computes a percentile of values, interpolating linearly between the closest ranks.
+    Args:
+        values (List[float]): The values.
+        percentile (float): The percentile, between 0 and 100.
+    Returns:
+        Optional[float]: The percentile value, None when there are no values.
+    """
+    if len(values) == 0:
+        return None
+
+    sorted_values = sorted(values)
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower_index = int(position)
+    upper_index = min(lower_index + 1, len(sorted_values) - 1)
+
+    return sorted_values[lower_index] + (sorted_values[upper_index] - sorted_values[lower_index]) * (position - lower_index)
+
+
+def _record_json_parsing(outcome: str) -> None:
+    """
+    Records the outcome of a JSON response parsing.
+    Args:
+        outcome (str): One of "parsed", "repaired" or "failed".
+    """
+    with _JSON_PARSING_STATISTICS_LOCK:
+        _JSON_PARSING_STATISTICS[outcome] = _JSON_PARSING_STATISTICS[outcome] + 1
+        statistics = dict(_JSON_PARSING_STATISTICS)
+
+    logging.debug(f"JSON response parsing outcome: {outcome}, statistics: {statistics}")
+
+
+def get_json_parsing_statistics() -> Dict:
+    """
+    Returns the model JSON responses parsing statistics since the process started.
+    Returns:
+        Dict: The number of responses parsed as is, parsed after repair and failed, along with the failure rate.
+    """
+    with _JSON_PARSING_STATISTICS_LOCK:
+        statistics = dict(_JSON_PARSING_STATISTICS)
+
+    parsings = statistics["parsed"] + statistics["repaired"] + statistics["failed"]
+    statistics["failure_rate"] = statistics["failed"] / parsings if parsings > 0 else 0.0
+
+    return statistics
+
+
+def _get_json_object_text(content: str) -> str:
+    """
+    Extracts the text of the outermost JSON object from a model response, ignoring code fences and surrounding text.
+    Args:
+        content (str): The model response.
+    Returns:
+        str: The text from the first opening brace to its matching closing brace, or to the end of the
+            response when the object is truncated.
+    """
+    start = content.find("{")
+    if start == -1:
+        return content.strip()
+
+    depth = 0
+    in_string = False
+    is_escaped = False
+    for index in range(start, len(content)):
+        character = content[index]
+        if in_string:
+            if is_escaped:
+                is_escaped = False
+            elif character == "\\":
+                is_escaped = True
+            elif character == '"':
+                in_string = False
+        elif character == '"':
+            in_string = True
+        elif character == "{":
+            depth = depth + 1
+        elif character == "}":
+            depth = depth - 1
+            if depth == 0:
+                return content[start:index + 1]
+
+    return content[start:]
+
+
+def _is_single_quoted_string_end(json_text: str, index: int) -> bool:
+    """
+    Tells whether a single quote inside a single quoted string closes it, rather than being an apostrophe.
+    Args:
+        json_text (str): The JSON text.
+        index (int): The position of the single quote.
+    Returns:
+        bool: True if the quote is followed by a separator, a closing bracket or the end of the text.
+    """
+    following_text = json_text[index + 1:].lstrip()
+    return following_text == "" or following_text[0] in ":,}]"
+
+
+def _repair_json_text(json_text: str) -> str:
+    """
+    Repairs the most common defects of model generated JSON: typographic quotes, single quoted strings,
+    Python literals, trailing commas and truncated objects.
+    The text is scanned keeping track of the strings, so that their content is never altered and apostrophes
+    inside single quoted strings are kept.
+    Args:
+        json_text (str): The JSON text.
+    Returns:
+        str: The repaired JSON text.
+    """
+    json_text = json_text.replace("\u201c", '"').replace("\u201d", '"')
+
+    repaired_characters = []
+    open_brackets = []
+    string_quote = None
+    is_escaped = False
+    index = 0
+    while index < len(json_text):
+        character = json_text[index]
+
+        if string_quote is not None:
+            if is_escaped:
+                is_escaped = False
+                # an escaped single quote is not a valid JSON escape sequence
+                if character == "'":
+                    repaired_characters[-1] = "'"
+                else:
+                    repaired_characters.append(character)
+            elif character == "\\":
+                is_escaped = True
+                repaired_characters.append(character)
+            elif character == string_quote and (string_quote == '"' or _is_single_quoted_string_end(json_text, index)):
+                string_quote = None
+                repaired_characters.append('"')
+            elif character == '"':
+                repaired_characters.append('\\"')
+            else:
+                repaired_characters.append(character)
+            index = index + 1
+            continue
+
+        literal_match = re.match(r"(True|False|None)\b", json_text[index:])
+        if character in "\"'":
+            string_quote = character
+            repaired_characters.append('"')
+        elif literal_match:
+            repaired_characters.append({"True": "true", "False": "false", "None": "null"}[literal_match.group(1)])
+            index = index + len(literal_match.group(1))
+            continue
+        elif character == ",":
+            # trailing commas are dropped
+            following_text = json_text[index + 1:].lstrip()
+            if following_text == "" or following_text[0] not in "}]":
+                repaired_characters.append(character)
+        elif character in "{[":
+            open_brackets.append("}" if character == "{" else "]")
+            repaired_characters.append(character)
+        elif character in "}]":
+            if open_brackets:
+                open_brackets.pop()
+            repaired_characters.append(character)
+        else:
+            repaired_characters.append(character)
+        index = index + 1
+
+    # close a truncated string, drop a dangling separator and close the open objects and arrays
+    if string_quote is not None:
+        if is_escaped:
+            repaired_characters.pop()
+        repaired_characters.append('"')
+    repaired_text = re.sub(r"[,:]\s*$", "", "".join(repaired_characters).rstrip())
+
+    return repaired_text + "".join(reversed(open_brackets))
+
+
+def _extract_json_fields(json_text: str) -> Dict:
+    """
+    Extracts the top level string and number fields of a JSON object which cannot be parsed.
+    Args:
+        json_text (str): The JSON text.
+    Returns:
+        Dict: The extracted fields.
+    """
+    # string values end at a quote followed by the next key or the end of the object, so unescaped quotes are kept
+    field_pattern = r'"(\w+)"\s*:\s*(?:"((?:\\.|[^\\])*?)"(?=\s*(?:,\s*"\w+"\s*:|\}|$))|(-?\d+(?:\.\d+)?))'
+
+    fields = {}
+    for match in re.finditer(field_pattern, json_text, flags=re.DOTALL):
+        key, string_value, number_value = match.group(1), match.group(2), match.group(3)
+        if key in fields:
+            continue
+        if string_value is not None:
+            fields[key] = json.loads('"' + re.sub(r'(?<!\\)"', r'\\"', string_value) + '"', strict=False)
+        else:
+            fields[key] = float(number_value)
+
+    return fields
+
+
+def parse_json_response(content: str, required_keys: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Parses a JSON object generated by a model, repairing it when needed instead of failing.
+    The outcome of each parsing is counted, see get_json_parsing_statistics.
+    Args:
+        content (str): The model response.
+        required_keys (Optional[List[str]], optional): The keys the parsed object must contain.
+    Returns:
+        Dict[str, Any]: The parsed object.
+    Raises:
+        Exception: If no object holding the required keys can be recovered.
+    """
+    required_keys = required_keys or []
+    json_text = _get_json_object_text(content)
+
+    try:
+        json_content = json.loads(json_text, strict=False)
+        if isinstance(json_content, dict) and all(key in json_content for key in required_keys):
+            _record_json_parsing("parsed")
+            return json_content
+    except ValueError:
+        pass
+
+    logging.debug(f"JSON response is malformed and will be repaired: \n{content}\n")
+
+    try:
+        json_content = json.loads(_repair_json_text(json_text), strict=False)
+    except ValueError:
+        json_content = _extract_json_fields(json_text)
+
+    if isinstance(json_content, dict) and all(key in json_content for key in required_keys):
+        _record_json_parsing("repaired")
+        return json_content
+
+    _record_json_parsing("failed")
+    raise Exception(f"The JSON response could not be parsed: {content}")
+
+
+def get_canonical_tool_arguments(tool: Callable, args: Tuple, kwargs: Dict) -> Dict[str, Any]:
+    """
+    Canonicalizes the arguments of a tool call, so that equivalent calls share memoized results.
+    Arguments are bound to their parameter names, defaults are applied and strings have their whitespace collapsed.
+    Args:
+        tool (Callable): The tool function.
+        args (Tuple): The positional arguments of the call.
+        kwargs (Dict): The keyword arguments of the call.
+    Returns:
+        Dict[str, Any]: The canonical arguments, keyed by parameter name.
+    """
+    bound_arguments = signature(tool).bind(*args, **kwargs)
+    bound_arguments.apply_defaults()
+
+    return {
+        name: re.sub(r"\s+", " ", value).strip() if isinstance(value, str) else value
+        for name, value in bound_arguments.arguments.items()
+    }
+
+
+def get_tool_results_cache(tool_name: str, ttl_seconds: Optional[float]) -> FileCache:
+    """
+    Returns the persistent cache of the memoized results of a tool, created once per process.
+    Args:
+        tool_name (str): The name of the tool.
+        ttl_seconds (Optional[float]): The time to live of the results, None if results never expire.
+    Returns:
+        FileCache: The tool results cache.
+    """
+    with _TOOL_RESULTS_CACHES_LOCK:
+        if tool_name not in _TOOL_RESULTS_CACHES:
+            _TOOL_RESULTS_CACHES[tool_name] = FileCache(
+                os.path.join("tool_results", tool_name),
+                ttl_seconds=ttl_seconds,
+                max_size_bytes=TOOL_RESULTS_CACHE_MAX_SIZE_BYTES
+            )
+
+        return _TOOL_RESULTS_CACHES[tool_name]
+
+
+class UncachedToolResult(str):
+    """
+    A tool result which is returned to the model but never memoized, such as a failure message.
+    """
+    pass
+
+
+def is_tool_result_memoizable(result: Any) -> bool:
+    """
+    Checks whether a tool result may be memoized.
+    Failures are not, nor are results produced once the question deadline was close or its budget exceeded,
+    as the tools then switch to cheaper modes giving partial results.
+    Args:
+        result (Any): The tool result.
+    Returns:
+        bool: True if the result may be memoized.
+    """
+    if result is None or isinstance(result, UncachedToolResult):
+        return False
+
+    return not is_deadline_close() and not is_question_budget_exceeded()
+
+
+def memoize_tool(tool: Callable, ttl_seconds: Optional[float] = None) -> Callable:
+    """
+    Wraps a tool so that its results are persisted and reused across runs.
+    Results are keyed by the tool name, the canonical arguments and, for tools receiving a "file_name" argument,
+    the digest of the attached file. Failed calls, failure results and partial results are not memoized.
+    The name, signature and docstring of the tool are kept, so the wrapper can be bound to the model.
+    Args:
+        tool (Callable): The tool function.
+        ttl_seconds (Optional[float], optional): The time to live of the results, None if results never expire.
+    Returns:
+        Callable: The memoized tool function.
+    """
+    tool_results_cache = get_tool_results_cache(tool.__name__, ttl_seconds)
+
+    @functools.wraps(tool)
+    def memoized_tool(*args, **kwargs):
+        canonical_arguments = get_canonical_tool_arguments(tool, args, kwargs)
+
+        file_name = canonical_arguments.get("file_name")
+        file_digest = get_file_digest(get_GAIA_dataset_file(file_name)) if file_name else None
+
+        cache_key = get_cache_key(tool.__name__, canonical_arguments, file_digest)
+        result = tool_results_cache.get(cache_key)
+        if result is not None:
+            logging.debug(f"Using memoized result of the tool {tool.__name__}")
+            return result
+
+        result = tool(*args, **kwargs)
+        if is_tool_result_memoizable(result):
+            tool_results_cache.set(cache_key, result)
+        else:
+            logging.debug(f"The result of the tool {tool.__name__} is not memoized")
+
+        return result
+
+    return memoized_tool
+
+
 def get_tool_description(tool: Callable) -> str:
     """
     Generate a formatted description of a given tool function.
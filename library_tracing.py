@@ -0,0 +1,214 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains the OpenTelemetry tracing of questions, graph nodes, tools, HTTP fetches and LLM calls.
+
+import os
+import functools
+import threading
+import contextvars
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Sequence
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+# tracing may be configured in the .env file, which can be imported before setup loads it
+load_dotenv()
+
+# spans exporter: "file" (JSON lines in TRACES_FILE), "otlp" (collector at OTEL_EXPORTER_OTLP_ENDPOINT) or "none"
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "otlp" if "OTEL_EXPORTER_OTLP_ENDPOINT" in os.environ else "file")
+TRACES_FILE = "./data/traces/traces.jsonl"
+
+TRACING_SERVICE_NAME = "gaia-agent"
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Exports finished spans as JSON lines appended to a local file.
+    """
+
+    def __init__(self, file_path: str = TRACES_FILE):
+        """
+        Initializes the exporter.
+        Args:
+            file_path (str, optional): The path of the traces file.
+        """
+        self._file_path = file_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        with self._lock:
+            with open(self._file_path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(span.to_json(indent=None) + "\n")
+
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def _create_tracer_provider() -> TracerProvider:
+    """
+    Creates the tracer provider, exporting spans according to TRACING_EXPORTER.
+    Returns:
+        TracerProvider: The tracer provider.
+    """
+    tracer_provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    elif TRACING_EXPORTER == "file":
+        tracer_provider.add_span_processor(BatchSpanProcessor(FileSpanExporter()))
+
+    return tracer_provider
+
+
+trace.set_tracer_provider(_create_tracer_provider())
+TRACER = trace.get_tracer("gaia_agent")
+
+
+def set_span_attributes(**attributes: Any) -> None:
+    """
+    Sets attributes on the current span, ignoring None values.
+    Args:
+        **attributes (Any): The attributes, string, boolean or numeric values.
+    """
+    span = trace.get_current_span()
+    for name, value in attributes.items():
+        if value is not None:
+            span.set_attribute(name, value)
+
+
+def traced(span_name: str) -> Callable:
+    """
+    Decorates a function so that each call runs in its own span.
+    Args:
+        span_name (str): The name of the span.
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def traced_function(*args, **kwargs):
+            with TRACER.start_as_current_span(span_name):
+                return function(*args, **kwargs)
+
+        return traced_function
+
+    return decorator
+
+
+def trace_tool(tool: Callable) -> Callable:
+    """
+    Wraps an agent tool so that each call runs in a "tool.<name>" span.
+    The name, signature and docstring of the tool are kept, so the wrapper can be bound to the model.
+    Args:
+        tool (Callable): The tool function.
+    Returns:
+        Callable: The traced tool function.
+    """
+    @functools.wraps(tool)
+    def traced_tool(*args, **kwargs):
+        with TRACER.start_as_current_span(f"tool.{tool.__name__}") as span:
+            span.set_attribute("tool.name", tool.__name__)
+            result = tool(*args, **kwargs)
+            span.set_attribute("tool.result_size", len(str(result)))
+            return result
+
+    return traced_tool
+
+
+def submit_with_context(executor: Executor, function: Callable, *args, **kwargs) -> Future:
+    """
+    Submits a function to an executor, running it in a copy of the current context,
+    so that spans created by the function are children of the current span.
+    Args:
+        executor (Executor): The executor.
+        function (Callable): The function to run.
+        *args: The positional arguments of the function.
+        **kwargs: The keyword arguments of the function.
+    Returns:
+        Future: The future of the function result.
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, function, *args, **kwargs)
+
+
+def _get_payload_size(value: Any) -> int:
+    """
+    Computes the size of the text and data carried by message contents.
+    Args:
+        value (Any): A message content, made of strings, lists and dictionaries.
+    Returns:
+        int: The payload size, in characters.
+    """
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_get_payload_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_get_payload_size(item) for item in value)
+
+    return 0
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records each LLM invocation in an "llm.<role>" span, holding the model, the payload size and the token counts.
+    """
+
+    def __init__(self, role: str):
+        """
+        Initializes the handler.
+        Args:
+            role (str): The role of the model in the agent, used in the span name.
+        """
+        self._role = role
+        self._spans = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any) -> None:
+        model = (kwargs.get("metadata") or {}).get("ls_model_name") or (kwargs.get("invocation_params") or {}).get("model")
+
+        span = TRACER.start_span(f"llm.{self._role}")
+        span.set_attribute("llm.role", self._role)
+        if model is not None:
+            span.set_attribute("llm.model", model)
+        span.set_attribute("llm.payload_size", sum(
+            _get_payload_size(message.content) for messages_batch in messages for message in messages_batch
+        ))
+
+        self._spans[run_id] = span
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+
+        for generations in response.generations:
+            for generation in generations:
+                usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                for name in ("input_tokens", "output_tokens", "total_tokens"):
+                    if name in usage_metadata:
+                        span.set_attribute(f"llm.{name}", usage_metadata[name])
+
+        span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+
+        span.record_exception(error)
+        span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+        span.end()
@@ -0,0 +1,366 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module builds, reviews and checks the piece templates of the local chessboard recognition.
+
+import os
+import re
+import math
+import argparse
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Tuple
+
+import chess
+import chess.svg
+from PIL import Image, ImageChops, ImageDraw
+
+from library_chessboard_recognition import (
+    CHESS_TEMPLATES_FILE,
+    get_template_candidates,
+    learn_piece_templates,
+    recognize_chessboard,
+    remove_template_candidate
+)
+
+# the bundled templates are learned from diagrams using the python-chess pieces, the cburnett set drawn by Lichess
+# and by most generated diagrams, rendered with the Lichess and the Wikipedia squares colors at several sizes
+STANDARD_DIAGRAMS_SQUARES_COLORS = [("#f0d9b5", "#b58863"), ("#ffce9e", "#d18b47")]
+STANDARD_DIAGRAMS_SQUARE_SIZES = [32, 48, 64, 96]
+
+# the positions put every piece of both sides on light and dark squares
+STANDARD_DIAGRAMS_FENS = [
+    chess.STARTING_FEN,
+    "rnbkqbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBKQBNR w - - 0 1",
+    "1r1kq1r1/b1n2n1b/p1p1p1p1/1p1p1p1p/P1P1P1P1/1P1P1P1P/B1N2N1B/1R1KQ1R1 w - - 0 1"
+]
+
+SVG_PIECE_SIZE = 45
+SVG_RENDERING_SUPERSAMPLING = 4
+SVG_CURVE_SEGMENTS = 16
+
+SVG_PATH_TOKEN_PATTERN = r"[MmLlHhVvCcSsAaZz]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?"
+SVG_COMMANDS_PARAMETERS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "A": 7, "Z": 0}
+
+
+def _get_arc_points(start: Tuple[float, float], arc_parameters: List[float]) -> List[Tuple[float, float]]:
+    """
+    Flattens an SVG elliptical arc, converting its endpoint parameters to center parameters.
+    Args:
+        start (Tuple[float, float]): The start point of the arc.
+        arc_parameters (List[float]): The radii, rotation, flags and end point of the arc.
+    Returns:
+        List[Tuple[float, float]]: The points of the arc, without its start point.
+    """
+    radius_x, radius_y, rotation, is_large_arc, is_sweep, end_x, end_y = arc_parameters
+    if radius_x == 0 or radius_y == 0:
+        return [(end_x, end_y)]
+
+    cos_rotation, sin_rotation = math.cos(math.radians(rotation)), math.sin(math.radians(rotation))
+    half_dx, half_dy = (start[0] - end_x) / 2, (start[1] - end_y) / 2
+    x1 = cos_rotation * half_dx + sin_rotation * half_dy
+    y1 = -sin_rotation * half_dx + cos_rotation * half_dy
+
+    radius_x, radius_y = abs(radius_x), abs(radius_y)
+    radii_scale = (x1 / radius_x) ** 2 + (y1 / radius_y) ** 2
+    if radii_scale > 1:
+        radius_x, radius_y = radius_x * math.sqrt(radii_scale), radius_y * math.sqrt(radii_scale)
+
+    numerator = (radius_x * radius_y) ** 2 - (radius_x * y1) ** 2 - (radius_y * x1) ** 2
+    denominator = (radius_x * y1) ** 2 + (radius_y * x1) ** 2
+    center_scale = math.sqrt(max(0.0, numerator / denominator)) if denominator > 0 else 0.0
+    if bool(is_large_arc) == bool(is_sweep):
+        center_scale = -center_scale
+
+    center_x1, center_y1 = center_scale * radius_x * y1 / radius_y, -center_scale * radius_y * x1 / radius_x
+    center_x = cos_rotation * center_x1 - sin_rotation * center_y1 + (start[0] + end_x) / 2
+    center_y = sin_rotation * center_x1 + cos_rotation * center_y1 + (start[1] + end_y) / 2
+
+    start_angle = math.atan2((y1 - center_y1) / radius_y, (x1 - center_x1) / radius_x)
+    end_angle = math.atan2((-y1 - center_y1) / radius_y, (-x1 - center_x1) / radius_x)
+    sweep_angle = end_angle - start_angle
+    if is_sweep and sweep_angle < 0:
+        sweep_angle = sweep_angle + 2 * math.pi
+    elif not is_sweep and sweep_angle > 0:
+        sweep_angle = sweep_angle - 2 * math.pi
+
+    points = []
+    for segment in range(1, SVG_CURVE_SEGMENTS + 1):
+        angle = start_angle + sweep_angle * segment / SVG_CURVE_SEGMENTS
+        ellipse_x, ellipse_y = radius_x * math.cos(angle), radius_y * math.sin(angle)
+        points.append((
+            cos_rotation * ellipse_x - sin_rotation * ellipse_y + center_x,
+            sin_rotation * ellipse_x + cos_rotation * ellipse_y + center_y
+        ))
+
+    return points
+
+
+def _get_path_subpaths(path_data: str) -> List[Tuple[List[Tuple[float, float]], bool]]:
+    """
+    Flattens SVG path data to polylines, supporting the commands used by the python-chess pieces.
+    Args:
+        path_data (str): The SVG path data.
+    Returns:
+        List[Tuple[List[Tuple[float, float]], bool]]: The points of each subpath and whether it is closed.
+    """
+    tokens = re.findall(SVG_PATH_TOKEN_PATTERN, path_data)
+
+    subpaths = []
+    points = []
+    current, subpath_start, last_control = (0.0, 0.0), (0.0, 0.0), None
+    command = None
+    index = 0
+
+    while index < len(tokens):
+        if re.fullmatch(r"[A-Za-z]", tokens[index]):
+            command = tokens[index]
+            index = index + 1
+
+        upper_command = command.upper()
+        is_relative = command.islower()
+        parameters = [float(token) for token in tokens[index:index + SVG_COMMANDS_PARAMETERS[upper_command]]]
+        index = index + len(parameters)
+
+        def absolute(x: float, y: float) -> Tuple[float, float]:
+            return (current[0] + x, current[1] + y) if is_relative else (x, y)
+
+        if upper_command == "M":
+            if len(points) > 1:
+                subpaths.append((points, False))
+            current = absolute(*parameters)
+            subpath_start = current
+            points = [current]
+            # coordinates following a move are implicit line commands
+            command = "l" if is_relative else "L"
+        elif upper_command == "L":
+            current = absolute(*parameters)
+            points.append(current)
+        elif upper_command == "H":
+            current = (current[0] + parameters[0] if is_relative else parameters[0], current[1])
+            points.append(current)
+        elif upper_command == "V":
+            current = (current[0], current[1] + parameters[0] if is_relative else parameters[0])
+            points.append(current)
+        elif upper_command in ("C", "S"):
+            if upper_command == "C":
+                first_control = absolute(parameters[0], parameters[1])
+                second_control, end = absolute(parameters[2], parameters[3]), absolute(parameters[4], parameters[5])
+            else:
+                first_control = (2 * current[0] - last_control[0], 2 * current[1] - last_control[1]) if last_control else current
+                second_control, end = absolute(parameters[0], parameters[1]), absolute(parameters[2], parameters[3])
+            for segment in range(1, SVG_CURVE_SEGMENTS + 1):
+                t = segment / SVG_CURVE_SEGMENTS
+                points.append(tuple(
+                    (1 - t) ** 3 * current[axis] + 3 * (1 - t) ** 2 * t * first_control[axis]
+                    + 3 * (1 - t) * t ** 2 * second_control[axis] + t ** 3 * end[axis]
+                    for axis in range(2)
+                ))
+            current = end
+            last_control = second_control
+            continue
+        elif upper_command == "A":
+            end = absolute(parameters[5], parameters[6])
+            points.extend(_get_arc_points(current, parameters[:5] + list(end)))
+            current = end
+        elif upper_command == "Z":
+            subpaths.append((points, True))
+            current = subpath_start
+            points = [current]
+
+        last_control = None
+
+    if len(points) > 1:
+        subpaths.append((points, False))
+
+    return subpaths
+
+
+def _get_element_style(element: ElementTree.Element, inherited_style: Dict[str, str]) -> Dict[str, str]:
+    """
+    Resolves the presentation attributes of an SVG element, style declarations taking precedence.
+    Args:
+        element (ElementTree.Element): The SVG element.
+        inherited_style (Dict[str, str]): The presentation attributes inherited from the parent group.
+    Returns:
+        Dict[str, str]: The presentation attributes of the element.
+    """
+    style = dict(inherited_style)
+    for attribute in ("fill", "stroke", "stroke-width", "stroke-linecap"):
+        if attribute in element.attrib:
+            style[attribute] = element.attrib[attribute]
+    for declaration in element.attrib.get("style", "").split(";"):
+        if ":" in declaration:
+            name, value = declaration.split(":", 1)
+            style[name.strip()] = value.strip()
+
+    return style
+
+
+def _draw_svg_element(piece_image: Image.Image, element: ElementTree.Element, inherited_style: Dict[str, str], scale: float) -> None:
+    """
+    Draws an SVG element of a python-chess piece, recursing into groups.
+    Args:
+        piece_image (Image.Image): The image the element is drawn on.
+        element (ElementTree.Element): The SVG element.
+        inherited_style (Dict[str, str]): The presentation attributes inherited from the parent group.
+        scale (float): The number of pixels per SVG unit.
+    """
+    style = _get_element_style(element, inherited_style)
+
+    if element.tag == "g":
+        for child_element in element:
+            _draw_svg_element(piece_image, child_element, style, scale)
+        return
+
+    if element.tag == "circle":
+        center_x, center_y, radius = (float(element.attrib[name]) for name in ("cx", "cy", "r"))
+        subpaths = [([
+            (center_x + radius * math.cos(2 * math.pi * segment / (4 * SVG_CURVE_SEGMENTS)),
+             center_y + radius * math.sin(2 * math.pi * segment / (4 * SVG_CURVE_SEGMENTS)))
+            for segment in range(4 * SVG_CURVE_SEGMENTS)
+        ], True)]
+    else:
+        subpaths = _get_path_subpaths(element.attrib["d"])
+
+    transform = [1.0, 0.0, 0.0, 1.0, 0.0, 0.0]
+    transform_match = re.match(r"matrix\(([^)]*)\)", element.attrib.get("transform", ""))
+    if transform_match is not None:
+        transform = [float(value) for value in transform_match.group(1).split(",")]
+
+    def to_pixels(point: Tuple[float, float]) -> Tuple[float, float]:
+        a, b, c, d, e, f = transform
+        return ((a * point[0] + c * point[1] + e) * scale, (b * point[0] + d * point[1] + f) * scale)
+
+    pixels_subpaths = [([to_pixels(point) for point in points], is_closed) for points, is_closed in subpaths]
+
+    if style["fill"] != "none":
+        # the subpaths are combined with the even-odd rule, holes being drawn by overlapping subpaths
+        fill_mask = Image.new("1", piece_image.size, 0)
+        for points, _ in pixels_subpaths:
+            if len(points) > 2:
+                subpath_mask = Image.new("1", piece_image.size, 0)
+                ImageDraw.Draw(subpath_mask).polygon(points, fill=1)
+                fill_mask = ImageChops.logical_xor(fill_mask, subpath_mask)
+        piece_image.paste(style["fill"], mask=fill_mask)
+
+    if style["stroke"] != "none":
+        stroke_width = max(1, round(float(style["stroke-width"]) * scale))
+        draw = ImageDraw.Draw(piece_image)
+        for points, is_closed in pixels_subpaths:
+            line_points = points + points[:1] if is_closed else points
+            draw.line(line_points, fill=style["stroke"], width=stroke_width, joint="curve")
+            if style.get("stroke-linecap") == "round" and not is_closed:
+                for end_x, end_y in (line_points[0], line_points[-1]):
+                    draw.ellipse((
+                        end_x - stroke_width / 2, end_y - stroke_width / 2,
+                        end_x + stroke_width / 2, end_y + stroke_width / 2
+                    ), fill=style["stroke"])
+
+
+def render_svg_piece(piece_symbol: str, size: int) -> Image.Image:
+    """
+    Renders a python-chess SVG piece on a transparent background.
+    Args:
+        piece_symbol (str): The FEN symbol of the piece.
+        size (int): The width and height of the rendered piece, in pixels.
+    Returns:
+        Image.Image: The rendered piece, as an RGBA image.
+    """
+    rendered_size = size * SVG_RENDERING_SUPERSAMPLING
+    piece_image = Image.new("RGBA", (rendered_size, rendered_size), (0, 0, 0, 0))
+
+    _draw_svg_element(
+        piece_image,
+        ElementTree.fromstring(chess.svg.PIECES[piece_symbol]),
+        {"fill": "#000", "stroke": "none", "stroke-width": "1"},
+        rendered_size / SVG_PIECE_SIZE
+    )
+
+    return piece_image.resize((size, size), Image.LANCZOS)
+
+
+def render_standard_diagram(fen: str, square_size: int, squares_colors: Tuple[str, str], file_path: str) -> None:
+    """
+    Renders a chessboard diagram in the standard style, white at the bottom.
+    Args:
+        fen (str): The FEN notation of the position.
+        square_size (int): The size of a square, in pixels.
+        squares_colors (Tuple[str, str]): The colors of the light and the dark squares.
+        file_path (str): The path of the rendered PNG image.
+    """
+    board = chess.Board(fen)
+    diagram = Image.new("RGB", (8 * square_size, 8 * square_size))
+    draw = ImageDraw.Draw(diagram)
+    pieces_images = {}
+
+    for row in range(8):
+        for column in range(8):
+            left, top = column * square_size, row * square_size
+            draw.rectangle((left, top, left + square_size - 1, top + square_size - 1), fill=squares_colors[(row + column) % 2])
+
+            piece = board.piece_at(chess.square(column, 7 - row))
+            if piece is not None:
+                if piece.symbol() not in pieces_images:
+                    pieces_images[piece.symbol()] = render_svg_piece(piece.symbol(), square_size)
+                piece_image = pieces_images[piece.symbol()]
+                diagram.paste(piece_image, (left, top), piece_image)
+
+    diagram.save(file_path)
+
+
+def build_standard_templates() -> None:
+    """
+    Learns the bundled piece templates from diagrams rendered in the standard style.
+    """
+    if os.path.isfile(CHESS_TEMPLATES_FILE):
+        os.remove(CHESS_TEMPLATES_FILE)
+
+    diagrams_directory = tempfile.mkdtemp(prefix="chess_diagrams_")
+    for squares_colors in STANDARD_DIAGRAMS_SQUARES_COLORS:
+        for square_size in STANDARD_DIAGRAMS_SQUARE_SIZES:
+            for fen_index, fen in enumerate(STANDARD_DIAGRAMS_FENS):
+                diagram_file = os.path.join(diagrams_directory, f"{squares_colors[0][1:]}_{square_size}_{fen_index}.png")
+                render_standard_diagram(fen, square_size, squares_colors, diagram_file)
+                learn_piece_templates(diagram_file, fen)
+
+
+def review_template_candidates() -> None:
+    """
+    Reviews the diagrams kept for learning templates, the templates being learned from the accepted ones.
+    Each candidate is removed once reviewed.
+    """
+    for candidate_file, fen in get_template_candidates():
+        print(f"Diagram: {candidate_file} \nFEN: {fen}")
+        answer = input("Learn templates from this diagram? Enter to accept, a corrected FEN, or 'n' to reject: ").strip()
+        if answer.lower() != "n":
+            learn_piece_templates(candidate_file, answer if len(answer) > 0 else fen)
+
+        remove_template_candidate(candidate_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds, reviews and checks the chess piece templates.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Learns the bundled templates from diagrams rendered in the standard style.")
+    subparsers.add_parser("review", help="Reviews the diagrams read by the vision model and learns templates from them.")
+    learn_parser = subparsers.add_parser("learn", help="Learns templates from a diagram and its reviewed FEN notation.")
+    learn_parser.add_argument("image", help="The chessboard image file.")
+    learn_parser.add_argument("fen", help="The reviewed FEN notation of the diagram.")
+    recognize_parser = subparsers.add_parser("recognize", help="Recognizes the placement of a diagram.")
+    recognize_parser.add_argument("image", help="The chessboard image file.")
+    arguments = parser.parse_args()
+
+    if arguments.command == "build":
+        build_standard_templates()
+        print(f"Learned templates are stored in {CHESS_TEMPLATES_FILE}")
+    elif arguments.command == "review":
+        review_template_candidates()
+        print(f"Learned templates are stored in {CHESS_TEMPLATES_FILE}")
+    elif arguments.command == "learn":
+        learn_piece_templates(arguments.image, arguments.fen)
+        print(f"Learned templates are stored in {CHESS_TEMPLATES_FILE}")
+    else:
+        start_time = time.perf_counter()
+        placement, confidence = recognize_chessboard(arguments.image)
+        print(f"Placement: {placement} \nConfidence: {confidence:.3f} \nTime: {time.perf_counter() - start_time:.3f}s")
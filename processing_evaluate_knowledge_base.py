@@ -0,0 +1,311 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module evaluates the accuracy, latency and usage of the agent against the final answers of the knowledge base.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import datetime
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+# evaluations run with cold caches unless --warm-caches is given, so that results memoized by earlier runs do not
+# hide the latency and accuracy of the code being evaluated, the environment must be set before the agent modules are imported
+EVALUATION_WARM_CACHES = "--warm-caches" in sys.argv
+if not EVALUATION_WARM_CACHES:
+    os.environ["TOOLS_MEMOIZATION_ENABLED"] = "0"
+    os.environ["CACHE_DIRECTORY"] = tempfile.mkdtemp(prefix="evaluation_cache_")
+
+from langchain_core.messages import AIMessage
+
+from agent_final_answer import AgentFinalAnswer
+from library_tools import get_percentile
+from tools_knowledge_base import load_knowledge_base_records, search_knowledge_base
+
+EVALUATIONS_DIRECTORY = "./data/evaluations"
+
+# the knowledge base holds the expected answers, the agent must not look them up while being evaluated
+EVALUATION_EXCLUDED_TOOLS = [search_knowledge_base.__name__]
+
+EVALUATION_MAX_WORKERS = 4
+
+LATENCY_PERCENTILES = (50, 90, 95)
+
+
+def _normalize_number(text: str) -> Optional[float]:
+    """
+    Normalizes a GAIA number answer, ignoring currency and percent signs and thousands separators.
+    Args:
+        text (str): The answer.
+    Returns:
+        Optional[float]: The number, None when the answer is not a number.
+    """
+    try:
+        return float(re.sub(r"[$%,\s]", "", text))
+    except ValueError:
+        return None
+
+
+def _normalize_text(text: str, remove_punctuation: bool = True) -> str:
+    """
+    Normalizes a GAIA string answer, ignoring case, whitespace and optionally punctuation.
+    Args:
+        text (str): The answer.
+        remove_punctuation (bool, optional): Whether punctuation is ignored. Defaults to True.
+    Returns:
+        str: The normalized answer.
+    """
+    normalized_text = re.sub(r"\s", "", text).lower()
+    if remove_punctuation:
+        normalized_text = re.sub(r"[^\w]", "", normalized_text)
+
+    return normalized_text
+
+
+def is_answer_correct(answer: str, expected_answer: str) -> bool:
+    """
+    Scores an answer using the GAIA normalized exact match.
+    Numbers are compared as numbers, comma or semicolon separated lists element by element,
+    and strings ignoring case, whitespace and punctuation.
+    Args:
+        answer (str): The answer of the agent.
+        expected_answer (str): The expected answer.
+    Returns:
+        bool: True if the answer matches the expected answer.
+    """
+    answer = str(answer) if answer is not None else ""
+
+    if _normalize_number(expected_answer) is not None:
+        return _normalize_number(answer) == _normalize_number(expected_answer)
+
+    if any(separator in expected_answer for separator in (",", ";")):
+        answer_items = re.split(r"[,;]", answer)
+        expected_items = re.split(r"[,;]", expected_answer)
+        if len(answer_items) != len(expected_items):
+            return False
+
+        for answer_item, expected_item in zip(answer_items, expected_items):
+            if _normalize_number(expected_item) is not None:
+                if _normalize_number(answer_item) != _normalize_number(expected_item):
+                    return False
+            elif _normalize_text(answer_item, remove_punctuation=False) != _normalize_text(expected_item, remove_punctuation=False):
+                return False
+
+        return True
+
+    return _normalize_text(answer) == _normalize_text(expected_answer)
+
+
+def get_attachment_type(file_name: str) -> str:
+    """
+    Returns the attachment type of a question.
+    Args:
+        file_name (str): The name of the attached file, empty when there is none.
+    Returns:
+        str: The file extension, or "none" when no file is attached.
+    """
+    if len(file_name) == 0:
+        return "none"
+
+    return os.path.splitext(file_name)[1].lstrip(".").lower() or "unknown"
+
+
+def get_tool_calls(intermediate_answers: Dict) -> Dict[str, int]:
+    """
+    Counts the tool calls of an agent run by tool.
+    Args:
+        intermediate_answers (Dict): The agent run state, holding its messages.
+    Returns:
+        Dict[str, int]: The number of calls of each tool.
+    """
+    tool_calls = {}
+    for message in intermediate_answers["messages"]:
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                tool_calls[tool_call["name"]] = tool_calls.get(tool_call["name"], 0) + 1
+
+    return tool_calls
+
+
+def evaluate_record(record: Dict, excluded_tools: List[str]) -> Dict:
+    """
+    Answers a knowledge base question with the agent and scores the answer.
+    Args:
+        record (Dict): The knowledge base record.
+        excluded_tools (List[str]): The names of the tools the agent cannot use.
+    Returns:
+        Dict: The evaluation of the question.
+    """
+    evaluation = {
+        "task_id": record["task_id"],
+        "level": record["Level"],
+        "attachment_type": get_attachment_type(record["file_name"]),
+        "expected_answer": record["Final answer"],
+        "answer": None,
+        "is_correct": False,
+        "latency_seconds": None,
+        "tokens": 0,
+        "cost": 0.0,
+        "tool_calls": {},
+        "escalations": 0,
+        "error": None
+    }
+
+    agent_final_answer = AgentFinalAnswer(excluded_tools)
+    input_file = record["file_name"] if len(record["file_name"]) > 0 else None
+
+    start_time = time.perf_counter()
+    try:
+        intermediate_answers, answer = agent_final_answer(record["Question"], input_file)
+        evaluation["answer"] = answer
+        evaluation["is_correct"] = is_answer_correct(answer, record["Final answer"])
+        evaluation["tool_calls"] = get_tool_calls(intermediate_answers)
+    except Exception as e:
+        logging.error(f"Evaluation of the question {record['task_id']} failed: {str(e)}")
+        evaluation["error"] = str(e)
+    evaluation["latency_seconds"] = time.perf_counter() - start_time
+
+    if agent_final_answer.question_ledger is not None:
+        token_usage = agent_final_answer.question_ledger.get_totals()
+        evaluation["tokens"] = token_usage["total_tokens"]
+        evaluation["cost"] = token_usage["cost"]
+        evaluation["escalations"] = len([decision for decision in agent_final_answer.question_ledger.get_routing_decisions() if decision["escalated"]])
+
+    return evaluation
+
+
+def get_evaluations_summary(evaluations: List[Dict]) -> Dict:
+    """
+    Summarizes question evaluations.
+    Args:
+        evaluations (List[Dict]): The question evaluations.
+    Returns:
+        Dict: The number of questions and errors, the accuracy, the latency percentiles, the mean tokens,
+            the total cost, the mean tool calls and the number of questions escalated to the strong model.
+    """
+    latencies = [evaluation["latency_seconds"] for evaluation in evaluations]
+
+    summary = {
+        "questions": len(evaluations),
+        "errors": len([evaluation for evaluation in evaluations if evaluation["error"] is not None]),
+        "accuracy": sum(evaluation["is_correct"] for evaluation in evaluations) / len(evaluations),
+        "mean_tokens": sum(evaluation["tokens"] for evaluation in evaluations) / len(evaluations),
+        "cost": sum(evaluation["cost"] for evaluation in evaluations),
+        "mean_tool_calls": sum(sum(evaluation["tool_calls"].values()) for evaluation in evaluations) / len(evaluations),
+        "escalated_questions": len([evaluation for evaluation in evaluations if evaluation["escalations"] > 0])
+    }
+    for percentile in LATENCY_PERCENTILES:
+        summary[f"latency_p{percentile}_seconds"] = get_percentile(latencies, percentile)
+
+    return summary
+
+
+def get_evaluation_report(evaluations: List[Dict]) -> Dict:
+    """
+    Summarizes question evaluations overall, by level and by attachment type.
+    Args:
+        evaluations (List[Dict]): The question evaluations.
+    Returns:
+        Dict: The summaries.
+    """
+    report = {"overall": get_evaluations_summary(evaluations), "by_level": {}, "by_attachment_type": {}}
+
+    for breakdown, field in (("by_level", "level"), ("by_attachment_type", "attachment_type")):
+        groups = {}
+        for evaluation in evaluations:
+            groups.setdefault(str(evaluation[field]), []).append(evaluation)
+        report[breakdown] = {group: get_evaluations_summary(group_evaluations) for group, group_evaluations in sorted(groups.items())}
+
+    return report
+
+
+def select_records(records: List[Dict], task_ids: Optional[List[str]], levels: Optional[List[int]],
+                   attachment_types: Optional[List[str]], limit: Optional[int]) -> List[Dict]:
+    """
+    Selects the knowledge base records to evaluate.
+    Args:
+        records (List[Dict]): The knowledge base records.
+        task_ids (Optional[List[str]]): The task ids to keep, all when None.
+        levels (Optional[List[int]]): The levels to keep, all when None.
+        attachment_types (Optional[List[str]]): The attachment types to keep, all when None.
+        limit (Optional[int]): The maximum number of records, no limit when None.
+    Returns:
+        List[Dict]: The selected records.
+    """
+    selected_records = [
+        record for record in records
+        if (task_ids is None or record["task_id"] in task_ids) and
+        (levels is None or record["Level"] in levels) and
+        (attachment_types is None or get_attachment_type(record["file_name"]) in attachment_types)
+    ]
+
+    return selected_records[:limit] if limit is not None else selected_records
+
+
+def print_evaluation_report(report: Dict) -> None:
+    """
+    Prints an evaluation report.
+    Args:
+        report (Dict): The evaluation report.
+    """
+    print(f"{'group':<24}{'questions':>10}{'errors':>8}{'accuracy':>10}{'p50 (s)':>10}{'p90 (s)':>10}{'p95 (s)':>10}"
+          f"{'tokens':>10}{'cost':>9}{'tools':>7}")
+
+    rows = [("overall", report["overall"])]
+    rows = rows + [(f"level {level}", summary) for level, summary in report["by_level"].items()]
+    rows = rows + [(f"attachment {attachment_type}", summary) for attachment_type, summary in report["by_attachment_type"].items()]
+
+    for group, summary in rows:
+        print(f"{group:<24}{summary['questions']:>10}{summary['errors']:>8}{summary['accuracy']:>10.2f}"
+              f"{summary['latency_p50_seconds']:>10.1f}{summary['latency_p90_seconds']:>10.1f}{summary['latency_p95_seconds']:>10.1f}"
+              f"{summary['mean_tokens']:>10.0f}{summary['cost']:>9.3f}{summary['mean_tool_calls']:>7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluates the agent against the final answers of the knowledge base.")
+    parser.add_argument("--task-ids", nargs="+", help="The task ids of the questions to evaluate.")
+    parser.add_argument("--levels", nargs="+", type=int, help="The levels of the questions to evaluate.")
+    parser.add_argument("--attachment-types", nargs="+", help="The attachment types to evaluate, \"none\" for questions without attachment.")
+    parser.add_argument("--limit", type=int, help="The maximum number of questions to evaluate.")
+    parser.add_argument("--workers", type=int, default=EVALUATION_MAX_WORKERS, help="The number of questions answered concurrently.")
+    parser.add_argument("--allow-knowledge-base", action="store_true", help="Let the agent search the knowledge base.")
+    parser.add_argument("--warm-caches", action="store_true", help="Reuse the memoized tool results and caches of earlier runs.")
+    arguments = parser.parse_args()
+
+    evaluated_records = select_records(
+        load_knowledge_base_records(), arguments.task_ids, arguments.levels, arguments.attachment_types, arguments.limit
+    )
+    if len(evaluated_records) == 0:
+        raise Exception("No knowledge base question matches the selection.")
+
+    evaluation_excluded_tools = [] if arguments.allow_knowledge_base else EVALUATION_EXCLUDED_TOOLS
+
+    question_evaluations = []
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        evaluation_futures = [
+            executor.submit(evaluate_record, record, evaluation_excluded_tools) for record in evaluated_records
+        ]
+        for evaluation_future in as_completed(evaluation_futures):
+            question_evaluation = evaluation_future.result()
+            question_evaluations.append(question_evaluation)
+            print(f"[{len(question_evaluations)}/{len(evaluated_records)}] {question_evaluation['task_id']}: "
+                  f"{'correct' if question_evaluation['is_correct'] else 'wrong'} in {question_evaluation['latency_seconds']:.1f}s")
+
+    evaluation_report = get_evaluation_report(question_evaluations)
+    print_evaluation_report(evaluation_report)
+
+    os.makedirs(EVALUATIONS_DIRECTORY, exist_ok=True)
+    report_file = os.path.join(EVALUATIONS_DIRECTORY, f"evaluation_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "excluded_tools": evaluation_excluded_tools,
+            "warm_caches": EVALUATION_WARM_CACHES,
+            "report": evaluation_report,
+            "evaluations": sorted(question_evaluations, key=lambda evaluation: evaluation["task_id"])
+        }, f, indent=2)
+    print(f"Evaluation report saved to {report_file}")
@@ -120,22 +120,25 @@ class GenerateAnswersDatabase():
             logging.debug(f"No cached answer was found.")
             return False
 
-    def _get_answer_for_question(self, question: str, input_file: str = None) -> Tuple[str, str]:
+    def _get_answer_for_question(self, question: str, input_file: str = None) -> Tuple[str, str, Dict, List[Dict]]:
         """
         Retrieves the intermediate and final answers for a given question.
         Args:
             question (str): The question to be answered.
             input_file (str, optional): Path to an input file with additional context. Defaults to None.
         Returns:
-            Tuple[str, str]: A tuple containing the intermediate answers and the final answer.
+            Tuple[str, str, Dict, List[Dict]]: A tuple containing the intermediate answers, the final answer,
+            the token usage and the model routing decisions.
         """
         _agent_final_answer = AgentFinalAnswer()
         intermediate_answers, answer = _agent_final_answer(question, input_file)
+        token_usage = _agent_final_answer.question_ledger.get_totals()
+        model_routing = _agent_final_answer.question_ledger.get_routing_decisions()
 
         # sleep to prevent over quota processing
         time.sleep(15)
 
-        return intermediate_answers, answer
+        return intermediate_answers, answer, token_usage, model_routing
 
     def _get_agentic_trace(self, intermediate_answers: List[Any], answer: str) -> str:
         """
@@ -186,9 +189,11 @@ class GenerateAnswersDatabase():
         question = question_item["question"]
         input_file = question_item["file_name"] if len(question_item["file_name"]) > 0 else None
 
-        intermediate_answers, answer = self._get_answer_for_question(question, input_file)
+        intermediate_answers, answer, token_usage, model_routing = self._get_answer_for_question(question, input_file)
 
         answer_item["agentic_trace"] = self._get_agentic_trace(intermediate_answers, answer)
+        answer_item["token_usage"] = token_usage
+        answer_item["model_routing"] = model_routing
         answer_item["answer"] = answer
         logging.debug(f"Obtained agentic answer: {answer_item["answer"]}")
 
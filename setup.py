@@ -4,10 +4,18 @@
 
 import os
 import logging
+from typing import Callable, Dict, List, Optional
 
 from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from library_cassette import CASSETTE, create_cassette_chat_LLM
+from library_deadline import get_deadline_timeout, is_deadline_close
+from library_ledger import LedgerCallbackHandler, record_routing_decision
+from library_logging import configure_logging
+from library_tracing import TracingCallbackHandler
+
 # load dotenv and check API keys are set
 load_dotenv()
 
@@ -19,17 +27,38 @@ assert not os.environ["TAVILY_API_KEY"] is None
 GOOGLE_API_KEY = os.environ["GOOGLE_API_KEY"]
 HF_TOKEN = os.environ["HF_TOKEN"]
 
+# backend used for uploading large media files: "gemini", "local" (offline stand-in) or "none"
+MEDIA_UPLOAD_BACKEND = os.environ.get("MEDIA_UPLOAD_BACKEND", "gemini")
+
 # Gemini models used for inference
 GEMINI_PRO = "gemini-2.5-pro-exp-03-25"
 GEMINI_FLASH = "gemini-2.0-flash"
 
-# change global logging
-TARGET_LOGGING_LEVEL = logging.DEBUG
-logging.basicConfig(
+# roles run on GEMINI_FLASH and are escalated to GEMINI_PRO only when a signal asks for it:
+# a low confidence web analysis, a formatting failure or a repeated tool call
+MODEL_ESCALATION_ENABLED = os.environ.get("MODEL_ESCALATION_ENABLED", "1") == "1"
+
+# LLM requests timeout, further capped by the deadline of the question being answered
+LLM_REQUEST_TIMEOUT = 300
+
+# change global logging, records are written by a background thread to a rotating file,
+# the previous run log being rotated to logging.log.1 instead of overwritten
+TARGET_LOGGING_LEVEL = logging.getLevelName(os.environ.get("LOGGING_LEVEL", "DEBUG").upper())
+LOGGING_FILE = 'logging.log'
+LOGGING_MAX_BYTES = 50 * 1024 * 1024
+LOGGING_BACKUP_COUNT = 5
+# large payloads (documents, transcripts, search results) are truncated to this many characters per field
+LOGGING_FIELD_MAX_SIZE = int(os.environ.get("LOGGING_FIELD_MAX_SIZE", "2000"))
+# "text" or "json" (one JSON object per line)
+LOGGING_FORMAT = os.environ.get("LOGGING_FORMAT", "text")
+
+configure_logging(
     level=TARGET_LOGGING_LEVEL,
-    filename='logging.log',
-    filemode='w',
-    format='%(asctime)s - %(levelname)s - %(module)s - %(funcName)s : %(message)s'
+    file_path=LOGGING_FILE,
+    max_bytes=LOGGING_MAX_BYTES,
+    backup_count=LOGGING_BACKUP_COUNT,
+    field_max_size=LOGGING_FIELD_MAX_SIZE,
+    use_json=LOGGING_FORMAT == "json"
 )
 
 # forcefully disable some modules
@@ -64,20 +93,104 @@ for name, _ in logging.root.manager.loggerDict.items():
         logging.getLogger(name).disabled = True
 
 
-def get_baseline_LLM() -> ChatGoogleGenerativeAI:
+# when set, creates the chat models instead of Gemini, e.g. scripted models for offline benchmarks
+_CHAT_LLM_FACTORY: Optional[Callable[[str, Dict, List], BaseChatModel]] = None
+
+
+def set_chat_LLM_factory(factory: Optional[Callable[[str, Dict, List], BaseChatModel]]) -> None:
+    """
+    Replaces the factory used by every LLM factory function to create the chat models.
+    Args:
+        factory (Optional[Callable[[str, Dict, List], BaseChatModel]]): A function receiving the model role,
+            the model parameters and the callbacks, and returning a chat model. None restores the Gemini models.
+    """
+    global _CHAT_LLM_FACTORY
+    _CHAT_LLM_FACTORY = factory
+
+
+def create_Gemini_chat_LLM(role: str, model_parameters: Dict, callbacks: List) -> ChatGoogleGenerativeAI:
+    """
+    Creates a Gemini chat model, the default chat models factory.
+    Args:
+        role (str): The role of the model in the agent.
+        model_parameters (Dict): The model parameters.
+        callbacks (List): The callbacks of the model invocations.
+    Returns:
+        ChatGoogleGenerativeAI: The language model instance.
+    """
+    return ChatGoogleGenerativeAI(callbacks=callbacks, **model_parameters)
+
+
+# when recording or replaying a cassette, the models go through it
+if CASSETTE is not None:
+    set_chat_LLM_factory(lambda role, model_parameters, callbacks: create_cassette_chat_LLM(
+        role, model_parameters, callbacks, create_Gemini_chat_LLM
+    ))
+
+
+def get_routed_model(role: str, escalation_reason: Optional[str] = None) -> str:
+    """
+    Routes a role to the fast model, or to the strong model when an escalation is requested.
+    Escalations are declined when disabled or when the question deadline is close, and recorded in the question ledger.
+    Args:
+        role (str): The role of the model in the agent.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
+    Returns:
+        str: The model name.
+    """
+    if escalation_reason is None:
+        return GEMINI_FLASH
+
+    is_escalated = MODEL_ESCALATION_ENABLED and not is_deadline_close()
+    model = GEMINI_PRO if is_escalated else GEMINI_FLASH
+
+    logging.debug(f"Escalation of {role} requested on {escalation_reason}, routed to {model}")
+    record_routing_decision(role, escalation_reason, model, is_escalated)
+
+    return model
+
+
+def _create_chat_LLM(role: str, escalation_reason: Optional[str] = None, **parameters) -> BaseChatModel:
+    """
+    Creates a chat language model instance, every LLM factory goes through this function.
+    The request timeout is capped by the question deadline, and retries are disabled when the deadline is close.
+    Args:
+        role (str): The role of the model in the agent, used for tracing and accounting its invocations.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
+        **parameters: The model parameters, overriding the defaults.
+    Returns:
+        BaseChatModel: The language model instance, a Gemini model unless another factory is set.
+    """
+    model_parameters = {
+        "model": get_routed_model(role, escalation_reason),
+        "max_tokens": None,
+        "timeout": get_deadline_timeout(LLM_REQUEST_TIMEOUT),
+        "max_retries": 0 if is_deadline_close() else 2
+    }
+    model_parameters.update(parameters)
+
+    callbacks = [TracingCallbackHandler(role), LedgerCallbackHandler(role)]
+
+    create_chat_LLM = _CHAT_LLM_FACTORY if _CHAT_LLM_FACTORY is not None else create_Gemini_chat_LLM
+
+    return create_chat_LLM(role, model_parameters, callbacks)
+
+
+def get_baseline_LLM(escalation_reason: Optional[str] = None) -> ChatGoogleGenerativeAI:
     """
     Returns a baseline language model instance suitable for general-purpose tasks.
 
+    Args:
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
+
     Returns:
         ChatGoogleGenerativeAI: A language model instance configured for baseline usage.
     """
 
-    baseline_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        temperature=0.25,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    baseline_llm = _create_chat_LLM(
+        "baseline",
+        escalation_reason,
+        temperature=0.25
     )
 
     return baseline_llm
@@ -91,12 +204,9 @@ def get_EXCEL_calculation_LLM():
         ChatGoogleGenerativeAI: A language model instance for Excel calculation tasks.
     """
 
-    return ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        temperature=0.25,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    return _create_chat_LLM(
+        "excel_calculation",
+        temperature=0.25
     )
 
 
@@ -108,13 +218,10 @@ def get_query_optimization_LLM() -> ChatGoogleGenerativeAI:
         ChatGoogleGenerativeAI: A language model instance for query optimization.
     """
 
-    query_optimization_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
+    query_optimization_llm = _create_chat_LLM(
+        "query_optimization",
         temperature=0.25,
-        top_p=0.95,
-        timeout=None,
-        max_retries=2,
+        top_p=0.95
     )
 
     return query_optimization_llm
@@ -127,51 +234,60 @@ def get_content_relevance_LLM() -> ChatGoogleGenerativeAI:
         ChatGoogleGenerativeAI: An instance of a chat-based language model configured for content relevance tasks.
     """
 
-    content_relevance_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
+    content_relevance_llm = _create_chat_LLM(
+        "content_relevance",
         temperature=0.25,
-        top_p=0.95,
-        timeout=None,
-        max_retries=2,
+        top_p=0.95
     )
 
     return content_relevance_llm
 
 
-def get_strict_content_analysis_LLM() -> ChatGoogleGenerativeAI:
+def get_strict_content_analysis_LLM(
+        response_schema: Optional[Dict] = None,
+        escalation_reason: Optional[str] = None) -> ChatGoogleGenerativeAI:
     """
     Creates and returns a language model instance configured for strict content analysis.
+    Args:
+        response_schema (Optional[Dict], optional): The schema of the JSON object the model must return,
+            None for free text output.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
     Returns:
         ChatGoogleGenerativeAI: An initialized language model for content analysis tasks.
     """
 
-    strict_content_analysis_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
+    strict_content_analysis_llm = _create_chat_LLM(
+        "strict_content_analysis",
+        escalation_reason,
         temperature=0.25,
         top_p=0.95,
-        timeout=None,
-        max_retries=2,
+        response_mime_type="application/json" if response_schema is not None else None,
+        response_schema=response_schema
     )
 
     return strict_content_analysis_llm
 
 
-def get_loose_content_analysis_LLM() -> ChatGoogleGenerativeAI:
+def get_loose_content_analysis_LLM(
+        response_schema: Optional[Dict] = None,
+        escalation_reason: Optional[str] = None) -> ChatGoogleGenerativeAI:
     """
     Creates and returns a language model instance for loose content analysis.
+    Args:
+        response_schema (Optional[Dict], optional): The schema of the JSON object the model must return,
+            None for free text output.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
     Returns:
         ChatGoogleGenerativeAI: An initialized language model for content analysis tasks.
     """
 
-    loose_content_analysis_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
+    loose_content_analysis_llm = _create_chat_LLM(
+        "loose_content_analysis",
+        escalation_reason,
         temperature=0.75,
         top_p=0.75,
-        timeout=None,
-        max_retries=2,
+        response_mime_type="application/json" if response_schema is not None else None,
+        response_schema=response_schema
     )
 
     return loose_content_analysis_llm
@@ -184,11 +300,8 @@ def get_chess_analysis_LLM():
         An initialized language model object for analyzing chess games and positions.
     """
 
-    chess_analysis_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    chess_analysis_llm = _create_chat_LLM(
+        "chess_analysis"
     )
 
     return chess_analysis_llm
@@ -201,11 +314,8 @@ def get_vision_LLM():
         An instance of a vision-enabled language model ready for image processing tasks.
     """
 
-    vision_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    vision_llm = _create_chat_LLM(
+        "vision"
     )
 
     return vision_llm
@@ -218,11 +328,8 @@ def get_video_LLM():
         An initialized language model for video processing.
     """
 
-    video_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    video_llm = _create_chat_LLM(
+        "video"
     )
 
     return video_llm
@@ -235,29 +342,26 @@ def get_audio_LLM():
         An instance of a language model configured for audio-related interactions.
     """
 
-    audio_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    audio_llm = _create_chat_LLM(
+        "audio"
     )
 
     return audio_llm
 
 
-def get_final_answer_LLM():
+def get_final_answer_LLM(escalation_reason: Optional[str] = None):
     """
     Creates and returns a language model instance for generating final answers.
+    Args:
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
     Returns:
         An initialized language model object for answer generation.
     """
 
-    final_answer_llm = ChatGoogleGenerativeAI(
-        model=GEMINI_FLASH,
-        top_p=0.95,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2
+    final_answer_llm = _create_chat_LLM(
+        "final_answer",
+        escalation_reason,
+        top_p=0.95
     )
 
     return final_answer_llm
@@ -0,0 +1,59 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the tools memoization choices of the basic tooling agent.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the agent never reaches the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("HF_TOKEN", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="tests_cache_"))
+
+agent_basic_tooling = pytest.importorskip("agent_basic_tooling")
+
+
+@pytest.fixture
+def memoized_tools(monkeypatch):
+    memoized_tools = {}
+
+    def record_memoization(tool, ttl_seconds=None):
+        memoized_tools[tool.__name__] = ttl_seconds
+        return tool
+
+    monkeypatch.setattr(agent_basic_tooling, "TOOLS_MEMOIZATION_ENABLED", True)
+    monkeypatch.setattr(agent_basic_tooling, "memoize_tool", record_memoization)
+    return memoized_tools
+
+
+def test_opted_out_tools_are_not_memoized(memoized_tools):
+    tools_names = [tool.__name__ for tool in agent_basic_tooling.get_tools()]
+
+    # a misspelled opt out would silently memoize the tool
+    assert agent_basic_tooling.TOOLS_MEMOIZATION_OPT_OUTS <= set(tools_names)
+    assert set(memoized_tools) == set(tools_names) - agent_basic_tooling.TOOLS_MEMOIZATION_OPT_OUTS
+
+
+def test_memoized_tools_get_their_time_to_live(memoized_tools):
+    agent_basic_tooling.get_tools()
+
+    for tool_name, ttl_seconds in agent_basic_tooling.TOOLS_MEMOIZATION_TTL_SECONDS.items():
+        assert memoized_tools[tool_name] == ttl_seconds
+    assert memoized_tools["process_EXCEL_file"] is None
+
+
+def test_tools_are_not_memoized_when_memoization_is_disabled(memoized_tools, monkeypatch):
+    monkeypatch.setattr(agent_basic_tooling, "TOOLS_MEMOIZATION_ENABLED", False)
+
+    tools_names = [tool.__name__ for tool in agent_basic_tooling.get_tools(excluded_tools=["search_web_natural_language"])]
+
+    assert memoized_tools == {}
+    assert "search_web_natural_language" not in tools_names
@@ -0,0 +1,77 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the local chessboard recognition against diagrams rendered in the standard style.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+chess = pytest.importorskip("chess")
+library_chessboard_recognition = pytest.importorskip("library_chessboard_recognition")
+processing_chess_templates = pytest.importorskip("processing_chess_templates")
+
+from PIL import Image
+
+# positions and squares colors which are not among the diagrams the bundled templates are learned from
+RECOGNITION_FENS = [
+    "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+    "2kr3r/ppp2ppp/2n5/8/1b6/2N2N2/PPP2PPP/R3KB1R b KQ - 0 1"
+]
+RECOGNITION_SQUARES_COLORS = ("#eeeed2", "#769656")
+
+
+@pytest.fixture(autouse=True)
+def bundled_templates(monkeypatch):
+    monkeypatch.setattr(
+        library_chessboard_recognition,
+        "CHESS_TEMPLATES_FILE",
+        os.path.join(REPOSITORY_DIRECTORY, library_chessboard_recognition.CHESS_TEMPLATES_FILE)
+    )
+
+
+def _render_diagram(fen: str, square_size: int, is_flipped: bool = False) -> str:
+    board = chess.Board(fen)
+    if is_flipped:
+        board = board.transform(chess.flip_vertical).transform(chess.flip_horizontal)
+
+    file_descriptor, file_path = tempfile.mkstemp(suffix=".png", prefix="tests_chessboard_")
+    os.close(file_descriptor)
+    processing_chess_templates.render_standard_diagram(board.fen(), square_size, RECOGNITION_SQUARES_COLORS, file_path)
+    return file_path
+
+
+@pytest.mark.parametrize("fen", RECOGNITION_FENS)
+@pytest.mark.parametrize("square_size", [45, 80])
+def test_standard_diagrams_are_recognized(fen, square_size):
+    placement, confidence = library_chessboard_recognition.recognize_chessboard(_render_diagram(fen, square_size))
+
+    assert placement == fen.split()[0]
+    assert confidence >= 0.1
+
+
+def test_diagrams_drawn_from_black_point_of_view_are_recognized():
+    placement, confidence = library_chessboard_recognition.recognize_chessboard(_render_diagram(RECOGNITION_FENS[0], 56, is_flipped=True))
+
+    assert placement == RECOGNITION_FENS[0].split()[0]
+    assert confidence >= 0.1
+
+
+def test_chessboard_grid_is_found_in_a_page():
+    file_path = _render_diagram(RECOGNITION_FENS[1], 40)
+    diagram = Image.open(file_path)
+    page = Image.new("RGB", (diagram.width + 60, diagram.height + 90), "white")
+    page.paste(diagram, (25, 50))
+    page.save(file_path)
+
+    left, top, square_size = library_chessboard_recognition.find_chessboard_grid(
+        library_chessboard_recognition._load_grayscale_image(file_path)
+    )
+
+    assert abs(left - 25) <= 1
+    assert abs(top - 50) <= 1
+    assert abs(square_size - 40) <= 0.5
@@ -0,0 +1,202 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the media payloads routing, the JSON responses parsing and the tools memoization of the tools library.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the tools library never reaches the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("HF_TOKEN", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="tests_cache_"))
+
+library_tools = pytest.importorskip("library_tools")
+
+# a 300 bytes file is encoded to 400 bytes, under the inline limit, a 3000 bytes file to 4000 bytes, over it
+TESTS_MEDIA_INLINE_MAX_SIZE_BYTES = 1024
+
+
+def _write_media_file(file_size: int) -> str:
+    file_descriptor, file_path = tempfile.mkstemp(suffix=".mp3", prefix="tests_media_")
+    with os.fdopen(file_descriptor, "wb") as f:
+        f.write(os.urandom(file_size))
+    return file_path
+
+
+@pytest.fixture
+def media_uploads(monkeypatch):
+    uploads_directory = tempfile.mkdtemp(prefix="tests_media_uploads_")
+    uploads = []
+
+    class RecordingMediaUploader(library_tools.LocalMediaUploader):
+        def upload(self, file_path, mime_type):
+            uploads.append(file_path)
+            return super().upload(file_path, mime_type)
+
+    monkeypatch.setattr(library_tools, "MEDIA_INLINE_MAX_SIZE_BYTES", TESTS_MEDIA_INLINE_MAX_SIZE_BYTES)
+    monkeypatch.setattr(library_tools, "get_media_uploader", lambda: RecordingMediaUploader(uploads_directory))
+    return uploads
+
+
+def test_small_media_files_are_sent_inline(media_uploads):
+    media_content_part = library_tools.get_media_content_part(_write_media_file(300), "audio/mpeg")
+
+    assert len(media_content_part["data"]) == 400
+    assert "file_uri" not in media_content_part
+    assert media_uploads == []
+
+
+def test_large_media_files_are_uploaded_once(media_uploads):
+    file_path = _write_media_file(3000)
+
+    first_content_part = library_tools.get_media_content_part(file_path, "audio/mpeg")
+    second_content_part = library_tools.get_media_content_part(file_path, "audio/mpeg")
+
+    assert first_content_part["file_uri"].startswith("file://")
+    assert second_content_part["file_uri"] == first_content_part["file_uri"]
+    assert "data" not in first_content_part
+    assert media_uploads == [file_path]
+
+
+def test_inline_limit_applies_to_the_encoded_payload(media_uploads):
+    # 768 bytes are encoded to exactly 1024 bytes, one more byte takes the payload over the limit
+    assert "data" in library_tools.get_media_content_part(_write_media_file(768), "audio/mpeg")
+    assert "file_uri" in library_tools.get_media_content_part(_write_media_file(769), "audio/mpeg")
+
+
+def test_large_media_files_fail_without_upload_backend(monkeypatch):
+    monkeypatch.setattr(library_tools, "MEDIA_INLINE_MAX_SIZE_BYTES", TESTS_MEDIA_INLINE_MAX_SIZE_BYTES)
+    monkeypatch.setattr(library_tools, "get_media_uploader", lambda: library_tools.MediaUploader())
+
+    with pytest.raises(Exception, match="does not support uploads"):
+        library_tools.get_media_content_part(_write_media_file(3000), "audio/mpeg")
+
+
+def test_large_payloads_are_never_loaded_inline(monkeypatch):
+    monkeypatch.setattr(library_tools, "MEDIA_INLINE_MAX_SIZE_BYTES", TESTS_MEDIA_INLINE_MAX_SIZE_BYTES)
+
+    with pytest.raises(Exception, match="must be uploaded"):
+        library_tools.get_base_64_file_data_by_path(_write_media_file(3000))
+
+
+@pytest.mark.parametrize("content, json_content", [
+    # fences and surrounding text
+    ('```json\n{"confidence": 0.9, "response": "Paris"}\n```', {"confidence": 0.9, "response": "Paris"}),
+    ('The analysis is:\n{"confidence": 0.9, "response": "Paris"}\nHope it helps.', {"confidence": 0.9, "response": "Paris"}),
+    # trailing commas
+    ('{"confidence": 0.3, "response": "a, b", "items": [1, 2,],}', {"confidence": 0.3, "response": "a, b", "items": [1, 2]}),
+    # truncation
+    ('{"confidence": 0.7, "response": "The answer is 42, because', {"confidence": 0.7, "response": "The answer is 42, because"}),
+    ('{"confidence": 0.6, "response": "x", "items": ["a", "b', {"confidence": 0.6, "response": "x", "items": ["a", "b"]}),
+    ('{"confidence": 0.6, "response": "x", "reasoning":', {"confidence": 0.6, "response": "x"}),
+    # quote variants
+    ("{'confidence': 0.5, 'response': 'it's here'}", {"confidence": 0.5, "response": "it's here"}),
+    ("{'confidence': 0.5, 'response': 'it\\'s here'}", {"confidence": 0.5, "response": "it's here"}),
+    ("{'confidence': 1, 'response': 'He said \"hi\"'}", {"confidence": 1, "response": 'He said "hi"'}),
+    ('{“confidence”: 0.4, “response”: “yes”}', {"confidence": 0.4, "response": "yes"}),
+    # Python literals, which are kept inside strings
+    ("{'confidence': 0, 'response': 'None, True', 'exact': True, 'source': None}", {"confidence": 0, "response": "None, True", "exact": True, "source": None})
+])
+def test_malformed_json_responses_are_repaired(content, json_content):
+    assert library_tools.parse_json_response(content, required_keys=["confidence", "response"]) == json_content
+
+
+def test_unquoted_inner_quotes_are_recovered_field_by_field():
+    json_content = library_tools.parse_json_response('{"confidence": 0.8, "response": "The "Old Man" novel"}', required_keys=["response"])
+
+    assert json_content == {"confidence": 0.8, "response": 'The "Old Man" novel'}
+
+
+def test_json_responses_missing_required_keys_fail():
+    with pytest.raises(Exception, match="could not be parsed"):
+        library_tools.parse_json_response('{"confidence": 0.8}', required_keys=["confidence", "response"])
+
+
+class CountingTool():
+    """
+    Stands in for an agent tool, counting its calls and returning the prepared results in order.
+    """
+    def __init__(self, *results):
+        self.calls_count = 0
+        self.results = list(results)
+
+    def __call__(self, query: str, limit: int = 3):
+        self.calls_count = self.calls_count + 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _memoize_counting_tool(request, *results):
+    # the results caches are kept per tool name for the whole process, so each test memoizes its own tool
+    counting_tool = CountingTool(*results)
+
+    def tool(query: str, limit: int = 3):
+        return counting_tool(query, limit)
+
+    tool.__name__ = f"tests_{request.node.name}"
+    return library_tools.memoize_tool(tool), counting_tool
+
+
+@pytest.fixture
+def outside_deadline_and_budget(monkeypatch):
+    monkeypatch.setattr(library_tools, "is_deadline_close", lambda: False)
+    monkeypatch.setattr(library_tools, "is_question_budget_exceeded", lambda: False)
+
+
+@pytest.mark.parametrize("result, is_memoizable", [
+    ("The answer is 42.", True),
+    ({"answer": 42}, True),
+    ("", True),
+    (None, False),
+    (library_tools.UncachedToolResult("The tool failed."), False)
+])
+def test_memoizable_tool_results(outside_deadline_and_budget, result, is_memoizable):
+    assert library_tools.is_tool_result_memoizable(result) == is_memoizable
+
+
+@pytest.mark.parametrize("is_deadline_close, is_budget_exceeded", [(True, False), (False, True)])
+def test_partial_tool_results_are_not_memoizable(monkeypatch, is_deadline_close, is_budget_exceeded):
+    monkeypatch.setattr(library_tools, "is_deadline_close", lambda: is_deadline_close)
+    monkeypatch.setattr(library_tools, "is_question_budget_exceeded", lambda: is_budget_exceeded)
+
+    assert not library_tools.is_tool_result_memoizable("The answer is 42.")
+
+
+def test_tool_results_are_memoized_by_canonical_arguments(request, outside_deadline_and_budget):
+    memoized_tool, counting_tool = _memoize_counting_tool(request, "The answer is 42.")
+
+    assert memoized_tool("  the   question ") == "The answer is 42."
+    assert memoized_tool(query="the question", limit=3) == "The answer is 42."
+    assert counting_tool.calls_count == 1
+
+
+def test_failure_tool_results_are_not_memoized(request, outside_deadline_and_budget):
+    memoized_tool, counting_tool = _memoize_counting_tool(
+        request, library_tools.UncachedToolResult("The tool failed."), None, "The answer is 42.", "Another answer."
+    )
+
+    assert memoized_tool("question") == "The tool failed."
+    assert memoized_tool("question") is None
+    assert memoized_tool("question") == "The answer is 42."
+    assert memoized_tool("question") == "The answer is 42."
+    assert counting_tool.calls_count == 3
+
+
+def test_failed_tool_calls_are_not_memoized(request, outside_deadline_and_budget):
+    memoized_tool, counting_tool = _memoize_counting_tool(request, Exception("The service is unavailable."), "The answer is 42.")
+
+    with pytest.raises(Exception, match="unavailable"):
+        memoized_tool("question")
+
+    assert memoized_tool("question") == "The answer is 42."
+    assert counting_tool.calls_count == 2
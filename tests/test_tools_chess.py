@@ -0,0 +1,107 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the chess positions handling of the chess tools.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the chess tools never reach the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("HF_TOKEN", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="tests_cache_"))
+
+chess = pytest.importorskip("chess")
+tools_chess = pytest.importorskip("tools_chess")
+library_chess_engine = pytest.importorskip("library_chess_engine")
+
+STARTING_PLACEMENT = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+
+# the white rook gives check to the black king, so only black can be to move
+BLACK_IN_CHECK_PLACEMENT = "4k3/8/8/8/8/8/8/4RK2"
+
+# white mates in one with Ra8
+MATE_IN_ONE_FEN = "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"
+
+
+@pytest.mark.parametrize("fen, is_legal", [
+    (f"{STARTING_PLACEMENT} w KQkq - 0 1", True),
+    (STARTING_PLACEMENT, True),
+    (BLACK_IN_CHECK_PLACEMENT, True),
+    # two white kings
+    ("4k3/8/8/8/8/8/8/3KK3", False),
+    # a pawn on the first rank
+    ("4k3/8/8/8/8/8/8/P3K3", False),
+    # no black king
+    ("8/8/8/8/8/8/8/4K3", False),
+    # not a chessboard
+    ("8/8/8", False)
+])
+def test_legal_chess_placements(fen, is_legal):
+    assert tools_chess.is_legal_chess_placement(fen) == is_legal
+
+
+@pytest.mark.parametrize("query, side_to_move", [
+    ("What is the best move?", chess.WHITE),
+    ("It is black's turn. What is the best move?", chess.BLACK),
+    ("Black to move, which move wins?", chess.BLACK),
+    ("Find the winning move for white.", chess.WHITE)
+])
+def test_side_to_move_is_read_from_the_query(query, side_to_move):
+    board = tools_chess.get_chess_board(f"{STARTING_PLACEMENT} w KQkq - 0 1", query)
+
+    assert board.turn == side_to_move
+
+
+def test_query_side_to_move_overrides_the_fen():
+    board = tools_chess.get_chess_board(f"{STARTING_PLACEMENT} b KQkq - 0 1", "White to play.")
+
+    assert board.turn == chess.WHITE
+
+
+def test_side_to_move_leaving_the_opponent_in_check_is_not_legal():
+    assert tools_chess.get_chess_board(BLACK_IN_CHECK_PLACEMENT, "White to move.") is None
+    assert tools_chess.get_chess_board(BLACK_IN_CHECK_PLACEMENT, "Black to move.").turn == chess.BLACK
+
+
+def test_inconsistent_castling_and_en_passant_are_dropped():
+    board = tools_chess.get_chess_board("4k3/8/8/8/8/8/8/4K3 w KQkq e6 0 1", "")
+
+    assert board.castling_rights == 0
+    assert board.ep_square is None
+
+
+def test_fen_is_extracted_from_a_model_response():
+    response = f"The position is:\n```\n{STARTING_PLACEMENT} b KQkq -\n```"
+
+    assert tools_chess.extract_fen(response) == f"{STARTING_PLACEMENT} b KQkq -"
+    assert tools_chess.extract_fen("No chessboard was found.") is None
+
+
+def test_built_in_search_evaluations_are_marked_approximate(monkeypatch):
+    monkeypatch.setattr(library_chess_engine, "CHESS_ENGINE_PATH", None)
+    board = tools_chess.get_chess_board(f"{STARTING_PLACEMENT} w KQkq - 0 1", "")
+
+    analysis = library_chess_engine.analyse_chess_position(board, depth=2, time_limit=1.0)
+
+    assert analysis["is_approximate"]
+    assert "Reliability: approximate" in tools_chess.format_chess_analysis(board, analysis)
+
+
+def test_built_in_search_forced_mates_are_exact(monkeypatch):
+    monkeypatch.setattr(library_chess_engine, "CHESS_ENGINE_PATH", None)
+    board = tools_chess.get_chess_board(MATE_IN_ONE_FEN, "")
+
+    analysis = library_chess_engine.analyse_chess_position(board, depth=2, time_limit=5.0)
+
+    assert analysis["best_move_san"] == "Ra8#"
+    assert analysis["mate_in"] == 1
+    assert not analysis["is_approximate"]
+    assert "Reliability: exact" in tools_chess.format_chess_analysis(board, analysis)
@@ -0,0 +1,110 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the vision answers cache of the image tools.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the image tools never reach the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("HF_TOKEN", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="tests_cache_"))
+
+tools_image = pytest.importorskip("tools_image")
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+class CountingVisionLLM():
+    """
+    Stands in for the vision model, answering with the number of the request.
+    """
+    def __init__(self):
+        self.requests_count = 0
+
+    def invoke(self, messages):
+        self.requests_count = self.requests_count + 1
+        return type("Output", (), {"content": f"answer {self.requests_count}"})()
+
+
+@pytest.fixture
+def vision_llm(monkeypatch):
+    vision_llm = CountingVisionLLM()
+    monkeypatch.setattr(tools_image, "get_vision_LLM", lambda: vision_llm)
+    return vision_llm
+
+
+def _create_image() -> Image.Image:
+    # smooth color waves, close to a photo for the perceptual hash and the lossy re-encodings
+    y, x = np.mgrid[0:512, 0:512] / 512
+    pixels = np.stack([
+        128 + 100 * np.sin(6 * x + 2 * y),
+        128 + 100 * np.cos(5 * y - 3 * x),
+        128 + 100 * np.sin(24 * x * y)
+    ], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def _save_image(image: Image.Image, file_format: str, **save_parameters) -> str:
+    file_descriptor, file_path = tempfile.mkstemp(suffix=f".{file_format.lower()}", prefix="tests_image_")
+    with os.fdopen(file_descriptor, "wb") as f:
+        image.save(f, format=file_format, **save_parameters)
+    return file_path
+
+
+def test_identical_images_share_answers(vision_llm):
+    file_path = _save_image(_create_image(), "PNG")
+
+    first_answer = tools_image.get_requested_information_from_image_file(file_path, "What colors are shown?")
+    second_answer = tools_image.get_requested_information_from_image_file(file_path, "  what COLORS are shown ")
+
+    assert first_answer == second_answer
+    assert vision_llm.requests_count == 1
+
+
+def test_re_encoded_images_share_answers(vision_llm):
+    original_file_path = _save_image(_create_image(), "PNG")
+    re_encoded_file_path = _save_image(_create_image(), "JPEG", quality=90)
+
+    first_answer = tools_image.get_requested_information_from_image_file(original_file_path, "What is the dominant color?")
+    second_answer = tools_image.get_requested_information_from_image_file(re_encoded_file_path, "What is the dominant color?")
+
+    assert first_answer == second_answer
+    assert vision_llm.requests_count == 1
+
+
+def test_images_differing_in_one_small_region_do_not_share_answers(vision_llm, monkeypatch):
+    image = _create_image()
+    edited_image = _create_image()
+    ImageDraw.Draw(edited_image).rectangle((440, 440, 450, 450), fill="black")
+
+    original_file_path = _save_image(image, "PNG")
+    edited_file_path = _save_image(edited_image, "PNG")
+
+    # the perceptual hashes are made to collide, only the pixel comparison tells the images apart
+    monkeypatch.setattr(tools_image, "get_image_perceptual_hash", lambda file_path: "0123456789abcdef")
+
+    first_answer = tools_image.get_requested_information_from_image_file(original_file_path, "Is there a black square?")
+    second_answer = tools_image.get_requested_information_from_image_file(edited_file_path, "Is there a black square?")
+
+    assert first_answer != second_answer
+    assert vision_llm.requests_count == 2
+
+
+def test_similar_images_answers_can_be_disabled(vision_llm):
+    original_file_path = _save_image(_create_image(), "PNG")
+    re_encoded_file_path = _save_image(_create_image(), "JPEG", quality=90)
+
+    tools_image.get_requested_information_from_image_file(original_file_path, "Where is the brightest area?")
+    tools_image.get_requested_information_from_image_file(re_encoded_file_path, "Where is the brightest area?", allow_similar_images=False)
+
+    assert vision_llm.requests_count == 2
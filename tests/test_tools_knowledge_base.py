@@ -0,0 +1,55 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the relevance filtering of the knowledge base search.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the knowledge base search never reaches the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("HF_TOKEN", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="tests_cache_"))
+
+tools_knowledge_base = pytest.importorskip("tools_knowledge_base")
+
+KNOWLEDGE_BASE_FILE = os.path.join(REPOSITORY_DIRECTORY, tools_knowledge_base.KNOWLEDGE_BASE_FILE)
+
+
+@pytest.fixture(scope="module")
+def knowledge_base_index():
+    index_directory = tempfile.mkdtemp(prefix="tests_knowledge_base_index_")
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(tools_knowledge_base, "KNOWLEDGE_BASE_INDEX_DIRECTORY", index_directory)
+        monkeypatch.setattr(tools_knowledge_base, "KNOWLEDGE_BASE_LEXICAL_INDEX_FILE", os.path.join(index_directory, "lexical_index.json"))
+        # the vector index is left out, its similarities depend on a downloaded embedding model
+        monkeypatch.setattr(tools_knowledge_base.KnowledgeBaseIndex, "_update_vector_index", lambda self, records_hashes: None)
+
+        knowledge_base_index = tools_knowledge_base.KnowledgeBaseIndex(KNOWLEDGE_BASE_FILE)
+        knowledge_base_index.build()
+        yield knowledge_base_index
+
+
+def test_search_finds_a_knowledge_base_question(knowledge_base_index):
+    record = tools_knowledge_base.load_knowledge_base_records(KNOWLEDGE_BASE_FILE)[0]
+
+    records = knowledge_base_index.search(record["Question"])
+
+    assert records[0]["task_id"] == record["task_id"]
+
+
+@pytest.mark.parametrize("query", [
+    "What is the capital of France?",
+    "Who was the president of the United States in 1990?",
+    "What is the boiling point of water in Kelvin?"
+])
+def test_search_returns_no_record_for_an_off_topic_query(knowledge_base_index, query):
+    assert knowledge_base_index.search(query) == []
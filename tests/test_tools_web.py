@@ -0,0 +1,138 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# This module tests the query rewriting and the search results merging of the web tools.
+
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the web tools never reach the real services, the environment must be set before the agent modules are imported
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("HF_TOKEN", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CACHE_DIRECTORY", tempfile.mkdtemp(prefix="tests_cache_"))
+
+tools_web = pytest.importorskip("tools_web")
+library_tools = pytest.importorskip("library_tools")
+
+
+@pytest.mark.parametrize("url, canonical_url", [
+    ("https://www.example.com/page/", "https://example.com/page"),
+    ("HTTP://Example.COM:80/page", "https://example.com/page"),
+    ("https://example.com:8443/page", "https://example.com:8443/page"),
+    ("https://example.com/page#section", "https://example.com/page"),
+    ("https://example.com/page?utm_source=news&b=2&a=1&fbclid=x", "https://example.com/page?a=1&b=2"),
+    ("https://example.com/page?ref=home", "https://example.com/page"),
+    ("  https://example.com/Page  ", "https://example.com/Page")
+])
+def test_canonical_urls(url, canonical_url):
+    assert tools_web.get_canonical_url(url) == canonical_url
+
+
+def test_reciprocal_rank_fusion_favours_items_ranked_by_several_lists():
+    fused_items = library_tools.get_reciprocal_rank_fusion([["a", "b", "c"], ["c", "b", "d"]], k=60)
+
+    assert [item for item, _ in fused_items] == ["c", "b", "a", "d"]
+    assert fused_items[0][1] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused_items[1][1] == pytest.approx(2 / 62)
+    assert fused_items[2][1] == pytest.approx(1 / 61)
+
+
+def test_reciprocal_rank_fusion_of_a_single_list_keeps_its_order():
+    assert [item for item, _ in library_tools.get_reciprocal_rank_fusion([["x", "y", "z"]])] == ["x", "y", "z"]
+    assert library_tools.get_reciprocal_rank_fusion([]) == []
+
+
+def test_search_results_are_merged_by_canonical_url(monkeypatch):
+    monkeypatch.setattr(tools_web, "WEB_SEARCH_PROVIDERS", {
+        "first": lambda query: ["https://www.example.com/a/", "https://example.com/b"],
+        "second": lambda query: ["https://example.com/b?utm_source=search", "https://example.com/a", "https://example.com/c"]
+    })
+
+    results_links, results_scores = tools_web.get_web_search_results_links("query")
+
+    # the links keep the form given by the first provider returning them
+    assert results_links == ["https://www.example.com/a/", "https://example.com/b", "https://example.com/c"]
+    assert results_scores == sorted(results_scores, reverse=True)
+
+
+def test_slow_and_failing_providers_are_dropped(monkeypatch):
+    release_event = threading.Event()
+
+    def search_slowly(query):
+        release_event.wait(5)
+        return ["https://example.com/slow"]
+
+    def search_failing(query):
+        raise Exception("provider failure")
+
+    monkeypatch.setattr(tools_web, "WEB_SEARCH_PROVIDER_TIMEOUT", 0.2)
+    monkeypatch.setattr(tools_web, "WEB_SEARCH_PROVIDERS", {
+        "slow": search_slowly,
+        "failing": search_failing,
+        "fast": lambda query: ["https://example.com/fast"]
+    })
+
+    try:
+        results_links, _ = tools_web.get_web_search_results_links("query")
+    finally:
+        release_event.set()
+
+    assert results_links == ["https://example.com/fast"]
+
+
+@pytest.mark.parametrize("query, optimized_query, is_confident", [
+    ("What is the capital of France?", "capital France", True),
+    ("How many moons does Mars have?", "number moons Mars", True),
+    ("site:en.wikipedia.org Mercedes Sosa discography", "Mercedes Sosa discography site:en.wikipedia.org", True),
+    ("AT&T stock price in 2021", "AT&T stock price 2021", True),
+    # too many keywords
+    ("How many studio albums did Mercedes Sosa publish between 2000 and 2009?", "number studio albums Mercedes Sosa publish between 2000 2009", False),
+    # exact phrases
+    ("Who wrote \"The Old Man and the Sea\"?", "wrote Old Man Sea", False),
+    # several sentences
+    ("Albums of Mercedes Sosa. Studio albums only.", "Albums Mercedes Sosa Studio albums only", False),
+    # instructions
+    ("Give the first name of the Polish actor", "Give first name Polish actor", False),
+    # nothing left to search
+    ("what is the", "", False)
+])
+def test_local_query_rewrites(query, optimized_query, is_confident):
+    assert tools_web.get_local_optimized_web_query(query) == (optimized_query, is_confident)
+
+
+class CountingQueryOptimizationLLM():
+    """
+    Stands in for the query optimization model, counting its requests.
+    """
+    def __init__(self):
+        self.requests_count = 0
+
+    def invoke(self, prompt):
+        self.requests_count = self.requests_count + 1
+        return type("Output", (), {"content": " rewritten query \n"})()
+
+
+def test_confident_local_rewrites_skip_the_model(monkeypatch):
+    query_optimization_llm = CountingQueryOptimizationLLM()
+    monkeypatch.setattr(tools_web, "get_query_optimization_LLM", lambda: query_optimization_llm)
+
+    assert tools_web.get_optimized_web_query("What is the capital of France?") == "capital France"
+    assert query_optimization_llm.requests_count == 0
+
+
+def test_model_rewrites_are_memoized_by_normalized_query(monkeypatch):
+    query_optimization_llm = CountingQueryOptimizationLLM()
+    monkeypatch.setattr(tools_web, "get_query_optimization_LLM", lambda: query_optimization_llm)
+
+    query = "List the studio albums of Mercedes Sosa. Do not include live albums."
+    assert tools_web.get_optimized_web_query(query) == "rewritten query"
+    assert tools_web.get_optimized_web_query(f"  {query.upper()} ") == "rewritten query"
+    assert query_optimization_llm.requests_count == 1
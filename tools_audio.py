@@ -2,61 +2,300 @@
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains utility functions for audio transcription and analysis.
 
+import re
+import base64
 import logging
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
 
-from library_tools import get_file_data_base_64
+from library_media import detect_silences, extract_audio_segment, get_media_duration, get_segments_boundaries
+from library_cache import FileCache
+from library_deadline import check_deadline
+from library_quota import LLM_QUOTA_LIMITER
+from library_tools import get_file_digest, get_file_media_content_part
+from library_tracing import submit_with_context
 from setup import get_audio_LLM
+from tools_hfhub import get_GAIA_dataset_file
 from langchain_core.messages import HumanMessage
 
+# audio files longer than this are split on silences and transcribed segment by segment
+AUDIO_SEGMENTATION_MIN_DURATION = 180
+AUDIO_SEGMENT_TARGET_DURATION = 120
+AUDIO_SEGMENT_MAX_DURATION = 180
+AUDIO_SILENCE_NOISE_LEVEL = "-35dB"
+AUDIO_SILENCE_MIN_DURATION = 0.4
+AUDIO_TRANSCRIPTION_MAX_CONCURRENCY = 4
 
-def get_transcribed_audio_file_data(file_name: str) -> str:
-    """
-    Gets the transcribed audio file such as mp3 audio file. This can be used as a tool.
+# transcriptions are stored by audio file digest and reused for later queries on the same file
+AUDIO_TRANSCRIPTIONS_CACHE = FileCache("audio_transcriptions")
 
-    Args:
-        file_name: The name of the audio file.
+# queries mentioning these need the audio itself, all other queries are answered from the transcription
+# words such as "speaker", "voice" or "sound" are left out, they mostly appear in queries about what is said
+AUDIO_ACOUSTIC_QUERY_KEYWORDS = [
+    "accent", "beat", "chord", "gender", "instrument", "instruments", "laugh", "laughter",
+    "loud", "loudness", "melody", "noise", "pitch", "rhythm", "tempo", "volume"
+]
+
+# the first query on a short audio file is answered by the request producing its transcription
+AUDIO_TRANSCRIPTION_TAG = "transcription"
+AUDIO_ANALYSIS_TAG = "analysis"
 
+
+def _transcribe_audio_data(audio_content_part: Dict) -> str:
+    """
+    Transcribes audio data using a single model request.
+    Args:
+        audio_content_part (Dict): The message content part holding the audio data.
     Returns:
-        The transcribed text of the audio file.
+        str: The transcribed text of the audio data.
     """
-    logging.debug(f"File transcription tool called!")
-    logging.debug(f"File name: {file_name}")
+    audio_analysis_messages = HumanMessage(content=[
+        {
+            "type": "text",
+            "text": f"""
+                <role>
+                    You are an agent specialized in audio analysis and audio transcription.
+                </role>
+                <task>
+                    We will provide you the data for an audio file.
+                    Transcribe the content of the audio file with the highest fidelity possible.
+                </task>
+            """
+        },
+        audio_content_part
+    ])
 
-    mime_type = mimetypes.guess_type(file_name)[0]
+    with LLM_QUOTA_LIMITER:
+        check_deadline()
+        audio_llm = get_audio_LLM()
+        output = audio_llm.invoke(
+            [audio_analysis_messages]
+        )
 
-    logging.debug(f"Inferred mime type is: {mime_type}")
+    return output.content
 
-    base64_audio_data = get_file_data_base_64(file_name)
 
+def _transcribe_and_analyze_audio_data(audio_content_part: Dict, query: str) -> Tuple[Optional[str], str]:
+    """
+    Transcribes audio data and answers a query on it using a single model request.
+    The audio is sent once, the transcription is returned for later queries on the same file.
+    Args:
+        audio_content_part (Dict): The message content part holding the audio data.
+        query (str): The query used for the audio file analysis.
+    Returns:
+        Tuple[Optional[str], str]: The transcription, None if the answer holds none, and the analysis information.
+    """
     audio_analysis_messages = HumanMessage(content=[
         {
             "type": "text",
             "text": f"""
                 <role>
                     You are an agent specialized in audio analysis and audio transcription.
+                    You analyze the audio in great detail and provide exact and detailed analysis information.
                 </role>
                 <task>
                     We will provide you the data for an audio file.
-                    Transcribe the content of the audio file with the highest fidelity possible.
+                    First transcribe the content of the audio file with the highest fidelity possible, inside <{AUDIO_TRANSCRIPTION_TAG}></{AUDIO_TRANSCRIPTION_TAG}> tags.
+                    Then analyze the audio file using the provided query and return the analysis information, inside <{AUDIO_ANALYSIS_TAG}></{AUDIO_ANALYSIS_TAG}> tags.
+                    Explain in detail your choice step by step.
+                    Once the final answer is generated verify it against the entire audio file again to make sure it is correct in regards with the audio content and the query.
                 </task>
+                <query>
+                    {query}
+                </query>
             """
         },
-        {
-            "type": "media",
-            "data": base64_audio_data,
-            "mime_type": mime_type
-        }
+        audio_content_part
     ])
 
+    with LLM_QUOTA_LIMITER:
+        check_deadline()
+        audio_llm = get_audio_LLM()
+        output = audio_llm.invoke(
+            [audio_analysis_messages]
+        )
+
+    transcription_match = re.search(rf"<{AUDIO_TRANSCRIPTION_TAG}>(.*?)</{AUDIO_TRANSCRIPTION_TAG}>", output.content, re.DOTALL)
+    analysis_match = re.search(rf"<{AUDIO_ANALYSIS_TAG}>(.*?)(?:</{AUDIO_ANALYSIS_TAG}>|$)", output.content, re.DOTALL)
+
+    if transcription_match is None or analysis_match is None:
+        logging.debug("The combined audio answer is not tagged, its transcription is not kept")
+        return None, output.content
+
+    return transcription_match.group(1).strip(), analysis_match.group(1).strip()
+
+
+def _format_timestamp(seconds: float) -> str:
+    """
+    Formats a number of seconds as a minutes:seconds timestamp.
+    Args:
+        seconds (float): The number of seconds.
+    Returns:
+        str: The formatted timestamp.
+    """
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
+def _transcribe_audio_segment(file_location: str, segment: Tuple[float, float]) -> str:
+    """
+    Transcribes one segment of an audio file, prefixing the transcription with the segment timestamps.
+    Args:
+        file_location (str): The local path of the audio file.
+        segment (Tuple[float, float]): The segment as a (start, end) tuple, in seconds.
+    Returns:
+        str: The timestamped transcription of the segment.
+    """
+    segment_start, segment_end = segment
+    segment_data = extract_audio_segment(file_location, segment_start, segment_end)
+    segment_transcription = _transcribe_audio_data({
+        "type": "media",
+        "data": base64.b64encode(segment_data).decode("utf-8"),
+        "mime_type": "audio/mp3"
+    })
+
+    logging.debug(f"Transcribed audio segment {_format_timestamp(segment_start)} - {_format_timestamp(segment_end)}")
+
+    return f"[{_format_timestamp(segment_start)} - {_format_timestamp(segment_end)}] {segment_transcription.strip()}"
+
+
+def get_segmented_audio_transcription(file_location: str, duration: float) -> str:
+    """
+    Transcribes a long audio file by splitting it on silences and transcribing the segments concurrently.
+    The segments transcriptions are stitched together in order, each one prefixed by its timestamps.
+    Args:
+        file_location (str): The local path of the audio file.
+        duration (float): The duration of the audio file, in seconds.
+    Returns:
+        str: The timestamped transcription of the audio file.
+    """
+    silences = detect_silences(file_location, AUDIO_SILENCE_NOISE_LEVEL, AUDIO_SILENCE_MIN_DURATION)
+    segments = get_segments_boundaries(duration, silences, AUDIO_SEGMENT_TARGET_DURATION, AUDIO_SEGMENT_MAX_DURATION)
+
+    logging.debug(f"Transcribing {len(segments)} audio segments: {segments}")
+
+    with ThreadPoolExecutor(max_workers=AUDIO_TRANSCRIPTION_MAX_CONCURRENCY) as executor:
+        segments_futures = [
+            submit_with_context(executor, _transcribe_audio_segment, file_location, segment)
+            for segment in segments
+        ]
+        segments_transcriptions = [future.result() for future in segments_futures]
+
+    return "\n".join(segments_transcriptions)
+
+
+def _get_audio_duration(file_location: str) -> Optional[float]:
+    """
+    Gets the duration of an audio file, used to decide whether the file is segmented.
+    Args:
+        file_location (str): The local path of the audio file.
+    Returns:
+        Optional[float]: The duration of the audio file in seconds, None if it could not be determined.
+    """
+    try:
+        return get_media_duration(file_location)
+    except Exception as e:
+        logging.warning(f"Audio duration could not be determined, the file will not be segmented: {str(e)}")
+        return None
+
+
+def _is_segmented_audio(duration: Optional[float]) -> bool:
+    """
+    Checks whether an audio file is transcribed segment by segment.
+    Args:
+        duration (Optional[float]): The duration of the audio file in seconds, None if unknown.
+    Returns:
+        bool: True if the audio file is split on silences before the transcription, False otherwise.
+    """
+    return duration is not None and duration > AUDIO_SEGMENTATION_MIN_DURATION
+
+
+def get_transcribed_audio_file_data(file_name: str) -> str:
+    """
+    Gets the transcribed audio file such as mp3 audio file. This can be used as a tool.
+
+    Args:
+        file_name: The name of the audio file.
+
+    Returns:
+        The transcribed text of the audio file.
+    """
+    logging.debug(f"File transcription tool called!")
+    logging.debug(f"File name: {file_name}")
+
+    mime_type = mimetypes.guess_type(file_name)[0]
+
+    logging.debug(f"Inferred mime type is: {mime_type}")
+
+    file_location = get_GAIA_dataset_file(file_name)
+    file_digest = get_file_digest(file_location)
+
+    transcription = AUDIO_TRANSCRIPTIONS_CACHE.get(file_digest)
+    if transcription is not None:
+        logging.debug(f"Using cached transcription for the file digest: {file_digest}")
+        return transcription
+
+    duration = _get_audio_duration(file_location)
+    if _is_segmented_audio(duration):
+        transcription = get_segmented_audio_transcription(file_location, duration)
+    else:
+        transcription = _transcribe_audio_data(get_file_media_content_part(file_name))
+
+    AUDIO_TRANSCRIPTIONS_CACHE.set(file_digest, transcription)
+
+    logging.debug("The transcribed audio content is: %s", transcription)
+
+    return transcription
+
+
+def is_acoustic_query(query: str) -> bool:
+    """
+    Checks whether a query needs acoustic information which a transcription does not hold.
+    Args:
+        query (str): The query used for the audio file analysis.
+    Returns:
+        bool: True if the audio itself is needed to answer the query, False otherwise.
+    """
+    query_words = set(re.findall(r"[a-z]+", query.lower()))
+    return any(keyword in query_words for keyword in AUDIO_ACOUSTIC_QUERY_KEYWORDS)
+
+
+def get_analysis_information_from_audio_transcription(file_name: str, query: str) -> str:
+    """
+    Analyzes an audio file using its (cached) transcription, with a text only model request.
+    Args:
+        file_name (str): The name of the audio file.
+        query (str): The query used for the audio file analysis.
+    Returns:
+        str: The information analysis from the audio file transcription.
+    """
+    transcription = get_transcribed_audio_file_data(file_name)
+
+    audio_analysis_messages = HumanMessage(content=f"""
+        <role>
+            You are an agent specialized in audio analysis.
+            You analyze the transcription of an audio file in great detail and provide exact and detailed analysis information.
+            We will provide detailed instructions in the task section.
+        </role>
+        <task>
+            We will provide you the transcription of an audio file. Analyze the transcription using the provided query and return the analysis information.
+            Explain in detail your choice step by step.
+            Once the final answer is generated verify it against the entire transcription again to make sure it is correct in regards with the audio content and the query.
+        </task>
+        <query>
+            {query}
+        </query>
+        <transcription>
+            {transcription}
+        </transcription>
+    """)
+
     audio_llm = get_audio_LLM()
 
     output = audio_llm.invoke(
         [audio_analysis_messages]
     )
 
-    logging.debug(f"The transcribed audio content is: {output.content}")
-
     return output.content
 
 def get_analysis_information_from_audio_file(file_name: str, query: str) -> str:
@@ -74,11 +313,30 @@ def get_analysis_information_from_audio_file(file_name: str, query: str) -> str:
     logging.debug(f"File name: {file_name}")
     logging.debug(f"Query: {query}")
 
+    if not is_acoustic_query(query):
+        file_location = get_GAIA_dataset_file(file_name)
+        file_digest = get_file_digest(file_location)
+
+        # a short audio file without transcription is transcribed by the request answering the query,
+        # the transcription is then stored for the next queries, saving one request which sends the whole audio
+        if AUDIO_TRANSCRIPTIONS_CACHE.get(file_digest) is None and not _is_segmented_audio(_get_audio_duration(file_location)):
+            logging.debug(f"The query is answered by the request transcribing the audio file.")
+            transcription, analysis_content = _transcribe_and_analyze_audio_data(get_file_media_content_part(file_name), query)
+            if transcription is not None:
+                AUDIO_TRANSCRIPTIONS_CACHE.set(file_digest, transcription)
+            logging.debug("Obtained audio analysis content: %s", analysis_content)
+
+            return analysis_content
+
+        logging.debug(f"The query is answered using the audio file transcription.")
+        analysis_content = get_analysis_information_from_audio_transcription(file_name, query)
+        logging.debug("Obtained audio analysis content: %s", analysis_content)
+
+        return analysis_content
+
     mime_type = mimetypes.guess_type(file_name)[0]
     logging.debug(f"Inferred mime type is: {mime_type}")
 
-    base64_audio_data = get_file_data_base_64(file_name)
-
     audio_analysis_messages = HumanMessage(content=[
         {
             "type": "text",
@@ -98,11 +356,7 @@ def get_analysis_information_from_audio_file(file_name: str, query: str) -> str:
                 </query>
             """
         },
-        {
-            "type": "media",
-            "data": base64_audio_data,
-            "mime_type": mime_type
-        }
+        get_file_media_content_part(file_name)
     ])
 
 
@@ -113,6 +367,6 @@ def get_analysis_information_from_audio_file(file_name: str, query: str) -> str:
     )
 
     analysis_content = output.content
-    logging.debug(f"Obtained audio analysis content: {analysis_content}")
+    logging.debug("Obtained audio analysis content: %s", analysis_content)
     
     return analysis_content
\ No newline at end of file
@@ -2,12 +2,131 @@
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains utility functions for analyzing images and extracting information based on queries.
 
+import re
 import logging
+from typing import Dict, Optional
+
+import chess
+
 from setup import get_chess_analysis_LLM
-from tools_image import get_requested_information_from_image
+from library_cache import FileCache
+from library_chess_engine import analyse_chess_position
+from library_chessboard_recognition import recognize_chessboard, save_template_candidate
+from library_tools import UncachedToolResult, get_file_digest
+from tools_hfhub import get_GAIA_dataset_file
+from tools_image import get_requested_information_from_image_file
 
 from langchain_core.messages import HumanMessage
 
+# FEN notations extracted from chessboard images, keyed by image digest
+CHESS_FEN_CACHE = FileCache("chess_fen")
+
+# locally recognized diagrams are sent to the vision model when a piece does not match its best template
+# better than any other piece by at least this similarity margin
+CHESS_LOCAL_RECOGNITION_MIN_CONFIDENCE = 0.1
+
+FEN_PATTERN = r"((?:[pnbrqkPNBRQK1-8]{1,8}/){7}[pnbrqkPNBRQK1-8]{1,8})(\s+[wb](?:\s+(?:-|[KQkq]{1,4}))?(?:\s+(?:-|[a-h][36]))?)?"
+
+
+def extract_fen(response: str) -> Optional[str]:
+    """
+    Extracts the first FEN notation from a model response.
+    Args:
+        response (str): The model response.
+    Returns:
+        Optional[str]: The FEN notation, or None if no FEN notation was found.
+    """
+    match = re.search(FEN_PATTERN, response)
+    if match is None:
+        return None
+
+    return (match.group(1) + (match.group(2) or "")).strip()
+
+
+def get_chess_board(fen: str, query: str) -> Optional[chess.Board]:
+    """
+    Creates a legal chess board from a FEN notation, using the query to determine the side to move.
+    Castling and en passant information which is inconsistent with the position is dropped.
+    Args:
+        fen (str): The FEN notation.
+        query (str): The query, which may specify the side to move.
+    Returns:
+        Optional[chess.Board]: The chess board, or None if the position is not legal.
+    """
+    try:
+        board = chess.Board(fen)
+    except ValueError:
+        try:
+            board = chess.Board(f"{fen.split()[0]} w - - 0 1")
+        except ValueError:
+            return None
+
+    lowered_query = query.lower()
+    if re.search(r"black to (move|play)|black's (move|turn)|for black|black moves", lowered_query):
+        board.turn = chess.BLACK
+    elif re.search(r"white to (move|play)|white's (move|turn)|for white|white moves", lowered_query):
+        board.turn = chess.WHITE
+
+    board.castling_rights = board.clean_castling_rights()
+    if board.ep_square is not None and not board.has_legal_en_passant():
+        board.ep_square = None
+
+    if not board.is_valid():
+        logging.debug(f"The chess position is not legal: {board.status()}")
+        return None
+
+    return board
+
+
+def format_chess_analysis(board: chess.Board, analysis: Dict) -> str:
+    """
+    Formats a chess position analysis as text.
+    Args:
+        board (chess.Board): The analysed position.
+        analysis (Dict): The analysis returned by the chess engine.
+    Returns:
+        str: The formatted analysis.
+    """
+    side_to_move = "White" if board.turn == chess.WHITE else "Black"
+
+    if analysis["mate_in"] is not None and analysis["mate_in"] > 0:
+        evaluation = f"{side_to_move} mates in {analysis['mate_in']}"
+    elif analysis["mate_in"] is not None:
+        evaluation = f"{side_to_move} is mated in {-analysis['mate_in']}"
+    else:
+        evaluation = f"{analysis['centipawns'] / 100:+.2f} pawns for {side_to_move}"
+
+    if analysis.get("is_approximate", False):
+        reliability = (
+            f"approximate, a shallow search of depth {analysis['depth']} using a material evaluation, "
+            f"the best move must be verified before being relied on"
+        )
+    else:
+        reliability = "exact"
+
+    return f"""
+        Position (FEN): {board.fen()}
+        Side to move: {side_to_move}
+        Best move (algebraic notation): {analysis['best_move_san']}
+        Best move (UCI notation): {analysis['best_move_uci']}
+        Evaluation: {evaluation}
+        Principal variation: {' '.join(analysis['principal_variation'])}
+        Analysed by: {analysis['engine']}, depth {analysis['depth']}
+        Reliability: {reliability}
+    """
+
+
+def is_legal_chess_placement(fen: str) -> bool:
+    """
+    Checks whether a FEN notation describes a legal position for at least one side to move.
+    The side to move is often misread, so both sides are tried.
+    Args:
+        fen (str): The FEN notation.
+    Returns:
+        bool: True if the position is legal.
+    """
+    return any(get_chess_board(fen, side_query) is not None for side_query in ["white to move", "black to move"])
+
 
 def get_chessboard_information(file_name: str) -> str:
     """
@@ -31,10 +150,41 @@ def get_chessboard_information(file_name: str) -> str:
     Return only the chessboard information in FEN notation, without any additional text or explanation.
     """
 
-    response = get_requested_information_from_image(file_name, query)
+    file_location = get_GAIA_dataset_file(file_name)
+    file_digest = get_file_digest(file_location)
+
+    fen = CHESS_FEN_CACHE.get(file_digest)
+    if fen is not None:
+        logging.debug(f"Using cached FEN: {fen}")
+        return fen
+
+    try:
+        fen, confidence = recognize_chessboard(file_location)
+        if fen is not None and confidence >= CHESS_LOCAL_RECOGNITION_MIN_CONFIDENCE and is_legal_chess_placement(fen):
+            # local recognitions are not confirmed by the vision model, neither they nor the tool results
+            # built on them are cached, so that a wrong recognition is not kept
+            logging.debug(f"Using locally recognized FEN: {fen} with confidence {confidence}")
+            return UncachedToolResult(fen)
+    except Exception as e:
+        logging.warning(f"Local chessboard recognition failed: {str(e)}")
+
+    response = get_requested_information_from_image_file(file_location, query, allow_similar_images=False)
     logging.debug(f"Response: {response}")
 
-    return response
+    fen = extract_fen(response)
+    if fen is None:
+        return response
+
+    if is_legal_chess_placement(fen):
+        CHESS_FEN_CACHE.set(file_digest, fen)
+
+        # the diagram is kept for review, so that its style is learned once its FEN notation is confirmed
+        try:
+            save_template_candidate(file_location, fen)
+        except Exception as e:
+            logging.warning(f"Chessboard diagram could not be kept for templates review: {str(e)}")
+
+    return fen
 
 
 def get_chess_analysis_information_from_image(file_name: str, query: str) -> str:
@@ -55,6 +205,21 @@ def get_chess_analysis_information_from_image(file_name: str, query: str) -> str
     logging.debug(f"Query: {query}")
 
     chessboard_information = get_chessboard_information(file_name)
+    result_type = UncachedToolResult if isinstance(chessboard_information, UncachedToolResult) else str
+
+    board = get_chess_board(chessboard_information, query)
+    if board is not None:
+        analysis = analyse_chess_position(board)
+        if analysis is not None:
+            return result_type(format_chess_analysis(board, analysis))
+
+        outcome = board.outcome(claim_draw=True)
+        return result_type(f"""
+        Position (FEN): {board.fen()}
+        The game is over: {outcome.termination.name if outcome is not None else "no legal moves"}
+        """)
+
+    logging.debug(f"No legal chess position was extracted, the chess analysis model is used.")
 
     image_analysis_messages = HumanMessage(content=[
         {
@@ -84,6 +249,6 @@ def get_chess_analysis_information_from_image(file_name: str, query: str) -> str
         [image_analysis_messages]
     )
 
-    logging.debug(f"Obtained content is: {output.content}")
+    logging.debug("Obtained content is: %s", output.content)
 
     return output.content
@@ -29,7 +29,7 @@ def get_EXCEL_file_content_as_markdown(file_name: str) -> str:
 
     result = data_frame.to_markdown()
 
-    logging.debug(f"Extracted EXCEL file content as markdown: \n{result}")
+    logging.debug("Extracted EXCEL file content as markdown: \n%s", result)
 
     return result
 
@@ -49,7 +49,7 @@ def get_EXCEL_file_content_as_csv(file_name: str) -> str:
 
     result = data_frame.to_csv(index=False)
 
-    logging.debug(f"Extracted EXCEL file content as csv: \n{result}")
+    logging.debug("Extracted EXCEL file content as csv: \n%s", result)
 
     return result
 
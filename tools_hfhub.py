@@ -4,6 +4,7 @@
 
 from setup import HF_TOKEN
 from huggingface_hub import login, hf_hub_download 
+from library_cassette import record_or_replay_file
 
 def get_GAIA_dataset_validation_file(file_name: str) -> str:
     """
@@ -47,11 +48,14 @@ def get_GAIA_dataset_file(file_name: str) -> str:
     Returns:
         str: The path or identifier of the retrieved dataset file.
     """
-    login(HF_TOKEN)
-    response = None
-    try:
-        response = get_GAIA_dataset_validation_file(file_name)
-    except:
-        response = get_GAIA_dataset_test_file(file_name)
-            
-    return response
+    def download_file():
+        login(HF_TOKEN)
+        response = None
+        try:
+            response = get_GAIA_dataset_validation_file(file_name)
+        except:
+            response = get_GAIA_dataset_test_file(file_name)
+
+        return response
+
+    return record_or_replay_file("hf_hub", [file_name], download_file)
@@ -2,31 +2,248 @@
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains utility functions for analyzing images and extracting information based on queries.
 
+import io
+import re
+import base64
 import logging
 import mimetypes
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
 
 from setup import get_vision_LLM
-from library_tools import get_file_data_base_64
+from library_cache import FileCache, get_cache_key
+from library_tools import get_file_digest
+from tools_hfhub import get_GAIA_dataset_file
 
 from langchain_core.messages import HumanMessage
 
+# images are downscaled to this maximum width and height and recompressed before being sent
+IMAGE_MAX_SIZE = 1568
+IMAGE_LOSSY_QUALITY = 85
 
-def get_requested_information_from_image(file_name: str, query: str) -> str:
+# vision answers are cached by normalized query and by file digest, or by perceptual hash for near-identical images,
+# the 64 bits hash being unchanged by most re-encodings and rescalings
+IMAGE_ANSWERS_CACHE = FileCache("image_answers")
+IMAGE_PERCEPTUAL_HASH_SIZE = 8
+
+# a perceptual hash match is only a candidate, the answer is reused when the images downscaled to this size
+# differ by at most this value on every pixel channel, so that an image differing in one small region never matches
+IMAGE_COMPARISON_SIZE = 128
+IMAGE_COMPARISON_MAX_PIXEL_DIFFERENCE = 32
+
+
+def get_normalized_image_data(file_path: str) -> Tuple[bytes, str]:
     """
-    Gets requested information from an image by using a filename and a query. This can be used as a tool.
+    Normalizes an image before it is sent to the vision model.
+    The image is oriented, downscaled to IMAGE_MAX_SIZE and re-encoded as WEBP without metadata:
+    lossless for images with few colors (diagrams, screenshots), lossy otherwise (photos).
+    The original data is kept if it is smaller than the normalized one, or if the image cannot be decoded locally
+    (SVG, HEIC, ...), the vision model possibly supporting it.
+    Args:
+        file_path (str): The path of the image file.
+    Returns:
+        Tuple[bytes, str]: The image data and its mime type.
+    """
+    with open(file_path, "rb") as f:
+        original_data = f.read()
+
+    try:
+        image = Image.open(io.BytesIO(original_data))
+        image.load()
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError) as e:
+        logging.debug(f"The image cannot be decoded and is sent as is: {str(e)}")
+        return original_data, mimetypes.guess_type(file_path)[0]
+
+    image.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE))
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
 
+    normalized_image = io.BytesIO()
+    if image.getcolors(256) is not None:
+        image.save(normalized_image, format="WEBP", lossless=True)
+    else:
+        image.save(normalized_image, format="WEBP", quality=IMAGE_LOSSY_QUALITY)
+    normalized_data = normalized_image.getvalue()
+
+    logging.debug(f"Normalized image from {len(original_data)} to {len(normalized_data)} bytes")
+
+    if len(normalized_data) >= len(original_data):
+        return original_data, mimetypes.guess_type(file_path)[0]
+
+    return normalized_data, "image/webp"
+
+
+def get_image_perceptual_hash(file_path: str) -> str:
+    """
+    Computes the DCT based perceptual hash of an image, which changes little for near-identical images.
     Args:
-        file_name: The name of the image file
-        query: the query used for extracting the information from the image
+        file_path (str): The path of the image file.
+    Returns:
+        str: The perceptual hash as a hexadecimal string.
+    """
+    sample_size = IMAGE_PERCEPTUAL_HASH_SIZE * 4
+
+    image = ImageOps.exif_transpose(Image.open(file_path)).convert("L")
+    pixels = np.asarray(image.resize((sample_size, sample_size), Image.LANCZOS), dtype=np.float64)
+
+    indexes = np.arange(sample_size)
+    dct_matrix = np.cos(np.pi * (2 * indexes[None, :] + 1) * indexes[:, None] / (2 * sample_size))
+    frequencies = (dct_matrix @ pixels @ dct_matrix.T)[:IMAGE_PERCEPTUAL_HASH_SIZE, :IMAGE_PERCEPTUAL_HASH_SIZE]
 
+    hash_bits = (frequencies > np.median(frequencies[1:, 1:])).flatten()
+    hash_value = int("".join("1" if bit else "0" for bit in hash_bits), 2)
+
+    return f"{hash_value:0{len(hash_bits) // 4}x}"
+
+
+def get_image_comparison_data(file_path: str) -> str:
+    """
+    Creates the small image used for confirming that two images with the same perceptual hash are near-identical.
+    Args:
+        file_path (str): The path of the image file.
     Returns:
-        The information from the image file.
+        str: The oriented RGB image, downscaled to IMAGE_COMPARISON_SIZE, as Base64-encoded PNG data.
     """
-    base64_image_data = get_file_data_base_64(file_name)
-    mime_type = mimetypes.guess_type(file_name)[0]
+    image = ImageOps.exif_transpose(Image.open(file_path)).convert("RGB")
+    image.thumbnail((IMAGE_COMPARISON_SIZE, IMAGE_COMPARISON_SIZE), Image.LANCZOS)
+
+    comparison_image = io.BytesIO()
+    image.save(comparison_image, format="PNG")
+
+    return base64.b64encode(comparison_image.getvalue()).decode("utf-8")
+
+
+def are_near_identical_images(first_comparison_data: str, second_comparison_data: str) -> bool:
+    """
+    Compares two images pixel by pixel, tolerating the small differences left by re-encodings and rescalings.
+    Args:
+        first_comparison_data (str): The comparison data of the first image, see get_image_comparison_data.
+        second_comparison_data (str): The comparison data of the second image, see get_image_comparison_data.
+    Returns:
+        bool: True if the images have the same size and no pixel channel differs by more than
+            IMAGE_COMPARISON_MAX_PIXEL_DIFFERENCE, False otherwise.
+    """
+    first_pixels = np.asarray(Image.open(io.BytesIO(base64.b64decode(first_comparison_data))), dtype=np.int16)
+    second_pixels = np.asarray(Image.open(io.BytesIO(base64.b64decode(second_comparison_data))), dtype=np.int16)
+
+    if first_pixels.shape != second_pixels.shape:
+        return False
+
+    return int(np.abs(first_pixels - second_pixels).max()) <= IMAGE_COMPARISON_MAX_PIXEL_DIFFERENCE
+
+
+def get_normalized_query(query: str) -> str:
+    """
+    Normalizes a query so that trivially different formulations share cached answers.
+    Args:
+        query (str): The query.
+    Returns:
+        str: The lower case query with collapsed whitespace and no trailing punctuation.
+    """
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?.!")
 
-    logging.debug(f"Using the image information extraction tool on the file: {file_name}")
-    logging.debug(f"Inferred mime type is: {mime_type}")
+
+def _get_image_answer_keys(file_digest: str, perceptual_hash: Optional[str], query: str) -> List[str]:
+    """
+    Creates the keys of the cached vision answers for an image and a query.
+    Args:
+        file_digest (str): The digest of the image file.
+        perceptual_hash (Optional[str]): The perceptual hash of the image, None if it cannot be computed.
+        query (str): The query used for extracting the information from the image.
+    Returns:
+        List[str]: The key of the identical image answer, followed by the key of the near-identical images answer.
+    """
+    normalized_query = get_normalized_query(query)
+
+    cache_keys = [get_cache_key("file_digest", file_digest, normalized_query)]
+    if perceptual_hash is not None:
+        cache_keys.append(get_cache_key("perceptual_hash", perceptual_hash, normalized_query))
+
+    return cache_keys
+
+
+def _get_cached_image_answer(file_digest: str, perceptual_hash: Optional[str], comparison_data: Optional[str], query: str, allow_similar_images: bool) -> Optional[str]:
+    """
+    Retrieves a cached vision answer for an identical, or near-identical, image and the same query.
+    Answers cached for a near-identical image are reused only when the pixel comparison of both images confirms it.
+    Args:
+        file_digest (str): The digest of the image file.
+        perceptual_hash (Optional[str]): The perceptual hash of the image, None if it cannot be computed.
+        comparison_data (Optional[str]): The comparison data of the image, None if it cannot be computed.
+        query (str): The query used for extracting the information from the image.
+        allow_similar_images (bool): Whether answers for near-identical images may be reused.
+    Returns:
+        Optional[str]: The cached answer, or None if no answer was cached.
+    """
+    identical_image_key, *similar_images_keys = _get_image_answer_keys(file_digest, perceptual_hash, query)
+
+    cached_answer = IMAGE_ANSWERS_CACHE.get(identical_image_key)
+    if cached_answer is not None or not allow_similar_images or comparison_data is None:
+        return cached_answer
+
+    for cache_key in similar_images_keys:
+        cached_entry = IMAGE_ANSWERS_CACHE.get(cache_key)
+        if not isinstance(cached_entry, dict):
+            continue
+        if are_near_identical_images(cached_entry["comparison_data"], comparison_data):
+            return cached_entry["answer"]
+        logging.debug(f"The image with the same perceptual hash differs when compared pixel by pixel, its answer is not reused")
+
+    return None
+
+
+def _set_cached_image_answer(file_digest: str, perceptual_hash: Optional[str], comparison_data: Optional[str], query: str, answer: str) -> None:
+    """
+    Stores a vision answer in the image answers cache, one entry per key so that concurrent answers are all kept.
+    The near-identical images entry keeps the comparison data of the image, used for confirming later matches.
+    Args:
+        file_digest (str): The digest of the image file.
+        perceptual_hash (Optional[str]): The perceptual hash of the image, None if it cannot be computed.
+        comparison_data (Optional[str]): The comparison data of the image, None if it cannot be computed.
+        query (str): The query used for extracting the information from the image.
+        answer (str): The vision answer.
+    """
+    identical_image_key, *similar_images_keys = _get_image_answer_keys(file_digest, perceptual_hash, query)
+
+    IMAGE_ANSWERS_CACHE.set(identical_image_key, answer)
+    if comparison_data is not None:
+        for cache_key in similar_images_keys:
+            IMAGE_ANSWERS_CACHE.set(cache_key, {"answer": answer, "comparison_data": comparison_data})
+
+
+def get_requested_information_from_image_file(file_path: str, query: str, allow_similar_images: bool = True) -> str:
+    """
+    Gets requested information from a local image file by using a query, reusing cached answers where possible.
+    Args:
+        file_path (str): The path of the image file.
+        query (str): The query used for extracting the information from the image.
+        allow_similar_images (bool, optional): Whether answers cached for near-identical images may be reused.
+            Defaults to True.
+    Returns:
+        str: The information from the image file.
+    """
+    file_digest = get_file_digest(file_path)
+    try:
+        perceptual_hash = get_image_perceptual_hash(file_path)
+        comparison_data = get_image_comparison_data(file_path)
+    except (UnidentifiedImageError, OSError) as e:
+        logging.debug(f"The image cannot be decoded, answers are cached for identical images only: {str(e)}")
+        perceptual_hash = None
+        comparison_data = None
+
+    cached_answer = _get_cached_image_answer(file_digest, perceptual_hash, comparison_data, query, allow_similar_images)
+    if cached_answer is not None:
+        logging.debug(f"Using cached image answer: {cached_answer}")
+        return cached_answer
+
+    image_data, mime_type = get_normalized_image_data(file_path)
+    base64_image_data = base64.b64encode(image_data).decode("utf-8")
+
+    logging.debug(f"Using mime type: {mime_type}")
 
     image_analysis_messages = HumanMessage(content=[
         {
@@ -59,6 +276,26 @@ def get_requested_information_from_image(file_name: str, query: str) -> str:
         [image_analysis_messages]
     )
 
-    logging.debug(f"Obtained content is: {output.content}")
+    logging.debug("Obtained content is: %s", output.content)
+
+    _set_cached_image_answer(file_digest, perceptual_hash, comparison_data, query, output.content)
 
     return output.content
+
+
+def get_requested_information_from_image(file_name: str, query: str) -> str:
+    """
+    Gets requested information from an image by using a filename and a query. This can be used as a tool.
+
+    Args:
+        file_name: The name of the image file
+        query: the query used for extracting the information from the image
+
+    Returns:
+        The information from the image file.
+    """
+    logging.debug(f"Using the image information extraction tool on the file: {file_name}")
+
+    file_location = get_GAIA_dataset_file(file_name)
+
+    return get_requested_information_from_image_file(file_location, query)
@@ -0,0 +1,368 @@
+# Copyright (c) Iuga Marin
+# This file is part of the HuggingFace free AI Agents course assignment.
+# It contains a local knowledge base search tool, combining a lexical (BM25) and a vector index.
+
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from library_cache import CACHE_DIRECTORY
+from library_embeddings import get_embedding_function
+from library_tools import UncachedToolResult, get_reciprocal_rank_fusion
+
+KNOWLEDGE_BASE_FILE = "./data/knowledge_base/knowledge_base.jsonl"
+
+# the indices are persisted and only updated for the records which changed since they were built
+KNOWLEDGE_BASE_INDEX_DIRECTORY = os.path.join(CACHE_DIRECTORY, "knowledge_base_index")
+KNOWLEDGE_BASE_LEXICAL_INDEX_FILE = os.path.join(KNOWLEDGE_BASE_INDEX_DIRECTORY, "lexical_index.json")
+KNOWLEDGE_BASE_COLLECTION_NAME = "knowledge_base"
+
+KNOWLEDGE_BASE_SEARCH_RESULTS = 3
+KNOWLEDGE_BASE_STEPS_MAX_SIZE = 1500
+
+# records are returned only when similar enough to the query in at least one of the indices, the lexical
+# similarity requiring both a minimum BM25 score and a minimum fraction of the query terms, weighted by their
+# inverse document frequency so that frequent words ("what", "is", "the") barely count
+KNOWLEDGE_BASE_MIN_SIMILARITY = 0.6
+KNOWLEDGE_BASE_MIN_TERMS_COVERAGE = 0.6
+KNOWLEDGE_BASE_MIN_LEXICAL_SCORE = 10.0
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def load_knowledge_base_records(file_path: str = KNOWLEDGE_BASE_FILE) -> List[Dict]:
+    """
+    Loads the knowledge base records, stored as concatenated JSON objects.
+    Args:
+        file_path (str, optional): The path of the knowledge base file.
+    Returns:
+        List[Dict]: The knowledge base records.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    decoder = json.JSONDecoder()
+    records = []
+    position = 0
+    while True:
+        while position < len(content) and content[position].isspace():
+            position = position + 1
+        if position >= len(content):
+            break
+
+        record, position = decoder.raw_decode(content, position)
+        records.append(record)
+
+    return records
+
+
+def get_record_hash(record: Dict) -> str:
+    """
+    Computes the hash of a knowledge base record, used for detecting updated records.
+    Args:
+        record (Dict): The knowledge base record.
+    Returns:
+        str: The hash of the record.
+    """
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_terms(text: str) -> List[str]:
+    """
+    Splits a text into lower case terms.
+    Args:
+        text (str): The text.
+    Returns:
+        List[str]: The terms of the text.
+    """
+    return re.findall(r"\w+", text.lower())
+
+
+class KnowledgeBaseIndex():
+    """
+    Searches the knowledge base records using a BM25 lexical index and a vector index,
+    the rankings of both indices being merged with reciprocal rank fusion.
+    The vector index is optional, only the lexical index is used when the embedding model is not available.
+    """
+
+    def __init__(self, file_path: str = KNOWLEDGE_BASE_FILE):
+        """
+        Initializes the index.
+        Args:
+            file_path (str, optional): The path of the knowledge base file.
+        """
+        self._file_path = file_path
+        self._records = {}
+        self._lexical_documents = {}
+        self._documents_frequencies = Counter()
+        self._average_document_length = 0.0
+        self._collection = None
+
+    def _update_lexical_index(self, records_hashes: Dict[str, str]) -> None:
+        """
+        Loads the persisted lexical index and updates the documents of the new, changed or removed records.
+        Args:
+            records_hashes (Dict[str, str]): The hashes of the current records, keyed by task id.
+        """
+        lexical_documents = {}
+        if os.path.isfile(KNOWLEDGE_BASE_LEXICAL_INDEX_FILE):
+            with open(KNOWLEDGE_BASE_LEXICAL_INDEX_FILE, "r", encoding="utf-8") as f:
+                lexical_documents = json.load(f)
+
+        is_updated = set(lexical_documents) != set(records_hashes)
+        lexical_documents = {
+            task_id: document for task_id, document in lexical_documents.items() if task_id in records_hashes
+        }
+
+        for task_id, record_hash in records_hashes.items():
+            if task_id in lexical_documents and lexical_documents[task_id]["hash"] == record_hash:
+                continue
+
+            record = self._records[task_id]
+            terms = get_terms(f"{record['Question']} {record['Final answer']}")
+            lexical_documents[task_id] = {"hash": record_hash, "length": len(terms), "terms": Counter(terms)}
+            is_updated = True
+
+        if is_updated:
+            os.makedirs(KNOWLEDGE_BASE_INDEX_DIRECTORY, exist_ok=True)
+            temporary_index_file = KNOWLEDGE_BASE_LEXICAL_INDEX_FILE + ".tmp"
+            with open(temporary_index_file, "w", encoding="utf-8") as f:
+                json.dump(lexical_documents, f)
+            os.replace(temporary_index_file, KNOWLEDGE_BASE_LEXICAL_INDEX_FILE)
+            logging.debug(f"Knowledge base lexical index updated")
+
+        self._lexical_documents = lexical_documents
+        self._documents_frequencies = Counter(
+            term for document in lexical_documents.values() for term in document["terms"]
+        )
+        self._average_document_length = (
+            sum(document["length"] for document in lexical_documents.values()) / max(len(lexical_documents), 1)
+        )
+
+    def _update_vector_index(self, records_hashes: Dict[str, str]) -> None:
+        """
+        Opens the persisted vector index and updates the embeddings of the new, changed or removed records.
+        Args:
+            records_hashes (Dict[str, str]): The hashes of the current records, keyed by task id.
+        """
+        import chromadb
+        from chromadb.config import Settings
+
+        client = chromadb.PersistentClient(
+            path=KNOWLEDGE_BASE_INDEX_DIRECTORY, settings=Settings(anonymized_telemetry=False))
+        collection = client.get_or_create_collection(
+            name=KNOWLEDGE_BASE_COLLECTION_NAME,
+            embedding_function=get_embedding_function(),
+            metadata={"hnsw:space": "cosine"}
+        )
+
+        indexed_records = collection.get(include=["metadatas"])
+        indexed_hashes = {
+            task_id: metadata["hash"] for task_id, metadata in zip(indexed_records["ids"], indexed_records["metadatas"])
+        }
+
+        removed_ids = [task_id for task_id in indexed_hashes if task_id not in records_hashes]
+        if len(removed_ids) > 0:
+            collection.delete(ids=removed_ids)
+
+        updated_ids = [
+            task_id for task_id, record_hash in records_hashes.items() if indexed_hashes.get(task_id) != record_hash
+        ]
+        if len(updated_ids) > 0:
+            collection.upsert(
+                ids=updated_ids,
+                documents=[self._records[task_id]["Question"] for task_id in updated_ids],
+                metadatas=[{"hash": records_hashes[task_id]} for task_id in updated_ids]
+            )
+
+        logging.debug(f"Knowledge base vector index updated: {len(updated_ids)} upserted, {len(removed_ids)} removed")
+
+        self._collection = collection
+
+    def build(self) -> None:
+        """
+        Loads the knowledge base records and brings the persisted indices up to date.
+        """
+        records = load_knowledge_base_records(self._file_path)
+        self._records = {record["task_id"]: record for record in records}
+        records_hashes = {task_id: get_record_hash(record) for task_id, record in self._records.items()}
+
+        self._update_lexical_index(records_hashes)
+
+        try:
+            self._update_vector_index(records_hashes)
+        except Exception as e:
+            logging.warning(f"Knowledge base vector index is not available, only the lexical index is used: {str(e)}")
+            self._collection = None
+
+        logging.debug(f"Knowledge base index built with {len(self._records)} records")
+
+    def _get_inverse_frequency(self, term: str) -> float:
+        """
+        Computes the BM25 inverse document frequency of a term, terms missing from the index getting the highest one.
+        Args:
+            term (str): The term.
+        Returns:
+            float: The inverse document frequency.
+        """
+        documents_count = len(self._lexical_documents)
+        document_frequency = self._documents_frequencies[term]
+
+        return math.log(1 + (documents_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _search_lexical_index(self, query: str) -> List[Tuple[str, float, float]]:
+        """
+        Searches the lexical index using BM25.
+        Args:
+            query (str): The search query.
+        Returns:
+            List[Tuple[str, float, float]]: The matching task ids, their BM25 score and the fraction of the query terms
+                they contain weighted by inverse document frequency, by decreasing score.
+        """
+        inverse_frequencies = {term: self._get_inverse_frequency(term) for term in set(get_terms(query))}
+        query_weight = sum(inverse_frequencies.values())
+
+        results = []
+        for task_id, document in self._lexical_documents.items():
+            score = 0.0
+            matched_weight = 0.0
+            for term, inverse_frequency in inverse_frequencies.items():
+                term_frequency = document["terms"].get(term, 0)
+                if term_frequency == 0:
+                    continue
+
+                matched_weight = matched_weight + inverse_frequency
+                length_normalization = 1 - BM25_B + BM25_B * document["length"] / self._average_document_length
+                score = score + inverse_frequency * term_frequency * (BM25_K1 + 1) / (term_frequency + BM25_K1 * length_normalization)
+
+            if score > 0:
+                results.append((task_id, score, matched_weight / query_weight))
+
+        return sorted(results, key=lambda result: result[1], reverse=True)
+
+    def _search_vector_index(self, query: str, max_results: int) -> List[Tuple[str, float]]:
+        """
+        Searches the vector index.
+        Args:
+            query (str): The search query.
+            max_results (int): The maximum number of results.
+        Returns:
+            List[Tuple[str, float]]: The nearest task ids and their cosine similarity, by decreasing similarity.
+        """
+        if self._collection is None:
+            return []
+
+        results = self._collection.query(query_texts=[query], n_results=max_results, include=["distances"])
+
+        return [(task_id, 1 - distance) for task_id, distance in zip(results["ids"][0], results["distances"][0])]
+
+    def search(self, query: str, max_results: int = KNOWLEDGE_BASE_SEARCH_RESULTS) -> List[Dict]:
+        """
+        Searches the knowledge base records relevant to a query.
+        Args:
+            query (str): The search query.
+            max_results (int, optional): The maximum number of returned records.
+        Returns:
+            List[Dict]: The relevant records, by decreasing relevance.
+        """
+        candidates_count = max(4 * max_results, 10)
+
+        lexical_results = self._search_lexical_index(query)[:candidates_count]
+        vector_results = self._search_vector_index(query, candidates_count)
+
+        relevant_ids = {
+            task_id for task_id, score, terms_coverage in lexical_results
+            if score >= KNOWLEDGE_BASE_MIN_LEXICAL_SCORE and terms_coverage >= KNOWLEDGE_BASE_MIN_TERMS_COVERAGE
+        } | {
+            task_id for task_id, similarity in vector_results if similarity >= KNOWLEDGE_BASE_MIN_SIMILARITY
+        }
+
+        fused_results = get_reciprocal_rank_fusion([
+            [task_id for task_id, _, _ in lexical_results],
+            [task_id for task_id, _ in vector_results]
+        ])
+
+        return [self._records[task_id] for task_id, _ in fused_results if task_id in relevant_ids][:max_results]
+
+
+_KNOWLEDGE_BASE_INDEX = None
+_KNOWLEDGE_BASE_INDEX_LOCK = threading.Lock()
+
+
+def get_knowledge_base_index() -> Optional[KnowledgeBaseIndex]:
+    """
+    Returns the knowledge base index, built once per process.
+    Returns:
+        Optional[KnowledgeBaseIndex]: The index, or None if the knowledge base cannot be loaded.
+    """
+    global _KNOWLEDGE_BASE_INDEX
+
+    with _KNOWLEDGE_BASE_INDEX_LOCK:
+        if _KNOWLEDGE_BASE_INDEX is None:
+            try:
+                knowledge_base_index = KnowledgeBaseIndex()
+                knowledge_base_index.build()
+                _KNOWLEDGE_BASE_INDEX = knowledge_base_index
+            except Exception as e:
+                logging.error(f"Knowledge base index could not be built: {str(e)}")
+
+    return _KNOWLEDGE_BASE_INDEX
+
+
+def format_knowledge_base_record(record: Dict) -> str:
+    """
+    Formats a knowledge base record for the agent.
+    Args:
+        record (Dict): The knowledge base record.
+    Returns:
+        str: The formatted record.
+    """
+    steps = record.get("Annotator Metadata", {}).get("Steps", "")
+    if len(steps) > KNOWLEDGE_BASE_STEPS_MAX_SIZE:
+        steps = steps[:KNOWLEDGE_BASE_STEPS_MAX_SIZE] + " ..."
+
+    return f"""
+Question: {record['Question']}
+Final answer: {record['Final answer']}
+Steps followed for finding the answer:
+{steps}
+"""
+
+
+def search_knowledge_base(query: str = None) -> str:
+    """
+    Searches the local knowledge base of previously solved questions, with their answers and the steps used for finding them.
+    Use this before searching the web, it is fast and free.
+    Check that a returned question really matches the task before using its answer.
+    This can be used as a tool.
+
+    Args:
+        query: the query used to search the knowledge base, use the text of the task you are performing.
+        Always provide the query.
+
+    Returns:
+        The most relevant knowledge base entries, or a message stating that no relevant entry was found.
+    """
+    if query is None:
+        return None
+
+    logging.debug(f"Received request to search the knowledge base with the query: {query}")
+
+    knowledge_base_index = get_knowledge_base_index()
+    if knowledge_base_index is None:
+        return UncachedToolResult("The knowledge base is not available.")
+
+    records = knowledge_base_index.search(query)
+    logging.debug(f"Knowledge base search found {len(records)} relevant records")
+
+    if len(records) == 0:
+        return "No relevant entry has been found in the knowledge base."
+
+    return "\n---\n".join(format_knowledge_base_record(record) for record in records)
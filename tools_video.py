@@ -2,13 +2,24 @@
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains utility functions for video file transcription and analysis.
 
+import base64
 import logging
 import mimetypes
+from typing import Dict, List
 
-from library_tools import get_base_64_file_data_by_path
+from library_media import extract_audio_track, extract_video_keyframes, subsample_evenly
+from library_tools import get_media_content_part
 from setup import get_video_LLM
 from langchain_core.messages import HumanMessage
 
+# local preprocessing of videos before analysis
+VIDEO_PREPROCESSING_ENABLED = True
+VIDEO_FRAMES_BUDGET = 32
+VIDEO_PAYLOAD_BYTES_BUDGET = 8 * 1024 * 1024
+VIDEO_FRAME_MAX_SIZE = 768
+VIDEO_SCENE_CHANGE_THRESHOLD = 0.3
+VIDEO_INCLUDE_AUDIO_TRACK = True
+
 
 def get_transcribed_video(video_file_path: str) -> str:
     """
@@ -26,8 +37,6 @@ def get_transcribed_video(video_file_path: str) -> str:
     mime_type = mimetypes.guess_type(video_file_path)[0]
     logging.debug(f"Inferred mime type is: {mime_type}")
 
-    base64_video_data = get_base_64_file_data_by_path(video_file_path)
-
     video_transcription_messages = HumanMessage(content=[
         {
             "type": "text",
@@ -41,11 +50,7 @@ def get_transcribed_video(video_file_path: str) -> str:
                 </task>
             """
         },
-        {
-            "type": "media",
-            "data": base64_video_data,
-            "mime_type": mime_type
-        }
+        get_media_content_part(video_file_path, mime_type)
     ])
 
     vision_llm = get_video_LLM()
@@ -55,11 +60,114 @@ def get_transcribed_video(video_file_path: str) -> str:
     )
 
     transcription_content = output.content
-    logging.debug(f"Obtained video transcription content: {transcription_content}")
+    logging.debug("Obtained video transcription content: %s", transcription_content)
 
     return transcription_content
 
 
+def get_video_inline_content_parts(video_file_path: str) -> List[Dict]:
+    """
+    Creates the message content parts which send the whole video file inline.
+    Args:
+        video_file_path (str): The path of the video file.
+    Returns:
+        List[Dict]: The message content parts holding the video file data.
+    """
+    mime_type = mimetypes.guess_type(video_file_path)[0]
+    logging.debug(f"Inferred mime type is: {mime_type}")
+
+    return [
+        get_media_content_part(video_file_path, mime_type)
+    ]
+
+
+def get_video_preprocessed_content_parts(
+        video_file_path: str,
+        frames_budget: int = VIDEO_FRAMES_BUDGET,
+        bytes_budget: int = VIDEO_PAYLOAD_BYTES_BUDGET,
+        include_audio: bool = VIDEO_INCLUDE_AUDIO_TRACK) -> List[Dict]:
+    """
+    Creates the message content parts which send downscaled keyframes and, optionally, the audio track of a video.
+    The audio track may use at most half of the bytes budget, the keyframes are evenly reduced to fit the rest.
+    Args:
+        video_file_path (str): The path of the video file.
+        frames_budget (int, optional): The maximum number of keyframes to send.
+        bytes_budget (int, optional): The maximum size of the Base64-encoded payload, in bytes.
+        include_audio (bool, optional): Whether the audio track of the video should be sent.
+    Returns:
+        List[Dict]: The message content parts holding the keyframes and the audio track.
+    """
+    content_parts = []
+    remaining_bytes_budget = bytes_budget
+
+    if include_audio:
+        audio_data = extract_audio_track(video_file_path)
+        if audio_data is None:
+            logging.debug(f"The video has no audio track.")
+        else:
+            base64_audio_data = base64.b64encode(audio_data).decode("utf-8")
+            if len(base64_audio_data) <= bytes_budget // 2:
+                remaining_bytes_budget = remaining_bytes_budget - len(base64_audio_data)
+                content_parts.append({
+                    "type": "media",
+                    "data": base64_audio_data,
+                    "mime_type": "audio/mp3"
+                })
+            else:
+                logging.warning(f"The audio track exceeds half of the payload budget and will not be sent.")
+
+    keyframes = extract_video_keyframes(
+        video_file_path,
+        frames_budget=frames_budget,
+        frame_max_size=VIDEO_FRAME_MAX_SIZE,
+        scene_change_threshold=VIDEO_SCENE_CHANGE_THRESHOLD
+    )
+
+    if len(keyframes) == 0:
+        raise Exception(f"No keyframe could be extracted from the video {video_file_path}")
+
+    keyframes_size = sum(4 * ((len(frame_data) + 2) // 3) for _, frame_data in keyframes)
+    if keyframes_size > remaining_bytes_budget:
+        # at least one keyframe is sent, even when a single keyframe exceeds the remaining budget
+        affordable_frames = max(1, int(len(keyframes) * remaining_bytes_budget / keyframes_size))
+        logging.debug(f"Keyframes exceed the payload budget, reducing from {len(keyframes)} to {affordable_frames}")
+        keyframes = subsample_evenly(keyframes, affordable_frames)
+
+    for timestamp, frame_data in keyframes:
+        content_parts.append({
+            "type": "text",
+            "text": f"Keyframe at {timestamp:.2f} seconds:"
+        })
+        content_parts.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64.b64encode(frame_data).decode('utf-8')}"
+            }
+        })
+
+    logging.debug(f"Created preprocessed video payload with {len(keyframes)} keyframes")
+
+    return content_parts
+
+
+def get_video_content_parts(video_file_path: str) -> List[Dict]:
+    """
+    Creates the message content parts used for sending a video to the model.
+    Keyframes are preferred, the whole video is sent inline when preprocessing is disabled or fails.
+    Args:
+        video_file_path (str): The path of the video file.
+    Returns:
+        List[Dict]: The message content parts holding the video data.
+    """
+    if VIDEO_PREPROCESSING_ENABLED:
+        try:
+            return get_video_preprocessed_content_parts(video_file_path)
+        except Exception as e:
+            logging.warning(f"Video preprocessing failed, the whole video will be sent: {str(e)}")
+
+    return get_video_inline_content_parts(video_file_path)
+
+
 def get_analysis_information_from_video(video_file_path: str, query: str) -> str:
     """
     Analyzes a video file such as mp4, obtaining the information from the file. This can be used as a tool.
@@ -75,11 +183,6 @@ def get_analysis_information_from_video(video_file_path: str, query: str) -> str
     logging.debug(f"File path: {video_file_path}")
     logging.debug(f"Query: {query}")
 
-    mime_type = mimetypes.guess_type(video_file_path)[0]
-    logging.debug(f"Inferred mime type is: {mime_type}")
-
-    base64_video_data = get_base_64_file_data_by_path(video_file_path)
-
     video_analysis_messages = HumanMessage(content=[
         {
             "type": "text",
@@ -90,7 +193,8 @@ def get_analysis_information_from_video(video_file_path: str, query: str) -> str
                     We will provide detailed instructions in the task section.
                 </role>
                 <task>
-                    We will provide you the data for an video file. Analyze the video file using the provided query and return the analysis information.
+                    We will provide you the data for a video file, either the whole video or keyframes sampled from it along with its audio track.
+                    Analyze the video file using the provided query and return the analysis information.
                     Analyze each video frame in detail before generating the final answer. Explain in detail your choice step by step.
                     Once the final answer is generated verify it against the entire video again to make sure is correct.
                 </task>
@@ -98,13 +202,8 @@ def get_analysis_information_from_video(video_file_path: str, query: str) -> str
                     {query}
                 </query>
             """
-        },
-        {
-            "type": "media",
-            "data": base64_video_data,
-            "mime_type": mime_type
         }
-    ])
+    ] + get_video_content_parts(video_file_path))
 
     vision_llm = get_video_LLM()
 
@@ -113,6 +212,6 @@ def get_analysis_information_from_video(video_file_path: str, query: str) -> str
     )
 
     analysis_content = output.content
-    logging.debug(f"Obtained video analysis content: {analysis_content}")
+    logging.debug("Obtained video analysis content: %s", analysis_content)
 
     return analysis_content
@@ -2,39 +2,191 @@
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains utility functions for web search, content retrieval, and analysis.
 
-import json
 import logging
+import mimetypes
 import re
-import time
-from typing import List, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-import markdownify
 import requests
 from fake_useragent import UserAgent
 
 from langchain_community.tools import DuckDuckGoSearchResults
 from langchain_tavily import TavilySearch
 
+from library_cache import FileCache, get_cache_key
+from library_cassette import decode_bytes, encode_bytes, record_or_replay
+from library_deadline import check_deadline, get_deadline_timeout, get_remaining_time, is_deadline_close
+from library_documents import extract_csv_text, extract_html_text, extract_json_text, extract_pdf_text, extract_plain_text
+from library_embeddings import get_embeddings, get_text_chunks
+from library_quota import LLM_QUOTA_LIMITER
+from library_tracing import set_span_attributes, submit_with_context, traced
+from library_tools import UncachedToolResult, get_reciprocal_rank_fusion, parse_json_response
+from setup import MODEL_ESCALATION_ENABLED
 from setup import get_content_relevance_LLM
 from setup import get_loose_content_analysis_LLM
 from setup import get_query_optimization_LLM
 from setup import get_strict_content_analysis_LLM
 
+# search results are cached by provider, normalized query and search parameters
+WEB_SEARCH_CACHE = FileCache("web_search_results", ttl_seconds=7 * 24 * 60 * 60)
+
+# expired search results are still served for this long while being refreshed in the background
+WEB_SEARCH_CACHE_STALE_SECONDS = 30 * 24 * 60 * 60
+
+TAVILY_SEARCH_PARAMETERS = {
+    "max_results": 5,
+    "topic": "general"
+}
+
+DUCKDUCKGO_SEARCH_PARAMETERS = {
+    "output_format": "list"
+}
+
+# search providers queried concurrently, a provider not answering within the timeout is dropped
+WEB_SEARCH_PROVIDER_TIMEOUT = 10
+WEB_SEARCH_MAX_RESULTS = 6
+
+# the provider searches of all the questions share a bounded pool, a search outliving its timeout holds a worker
+# until its provider answers instead of leaving a new thread behind at each timeout
+WEB_SEARCH_PROVIDERS_MAX_WORKERS = 8
+WEB_SEARCH_PROVIDERS_EXECUTOR = ThreadPoolExecutor(max_workers=WEB_SEARCH_PROVIDERS_MAX_WORKERS, thread_name_prefix="web_search_provider")
+
+# query parameters which only track the visitor and do not change the page content
+URL_TRACKING_PARAMETERS_PREFIXES = ("utm_",)
+URL_TRACKING_PARAMETERS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "srsltid"}
+
+# pages are analyzed concurrently in score order, the analysis stops once an answer reaches this confidence
+WEB_ANALYSIS_CONFIDENCE_THRESHOLD = 0.8
+WEB_ANALYSIS_MAX_WORKERS = 3
+
+# strict answers at or below this confidence trigger the loose analysis of the already fetched pages
+WEB_ANALYSIS_MIN_CONFIDENCE = 0.33
+
+# when no fast model analysis is confident enough, the best scored fetched pages are analyzed again by the strong model
+WEB_ANALYSIS_ESCALATED_PAGES = 2
+
+# close to the question deadline, only the best scored pages are analyzed and the loose analysis is skipped
+WEB_ANALYSIS_URLS_NEAR_DEADLINE = 2
+
+# pages are ranked by their chunks most similar to the query, only the first chunks of long pages are embedded
+WEB_RANKING_MAX_CHUNKS_PER_PAGE = 48
+
+# the listwise LLM ranking fallback only receives the beginning of each page
+WEB_RANKING_SUMMARY_SIZE = 1500
+
+# web pages are streamed with connection and read timeouts, downloads stop at a byte budget per content type
+WEB_PAGE_REQUEST_TIMEOUT = (5, 20)
+WEB_PAGE_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+WEB_PAGE_MAX_BYTES = {
+    "application/pdf": 20 * 1024 * 1024,
+    "text/html": 5 * 1024 * 1024,
+    "default": 2 * 1024 * 1024
+}
+
+WEB_PAGE_CONTENT_EXTRACTORS = {
+    "text/html": extract_html_text,
+    "application/xhtml+xml": extract_html_text,
+    "application/pdf": extract_pdf_text,
+    "text/plain": extract_plain_text,
+    "text/markdown": extract_plain_text,
+    "application/json": extract_json_text,
+    "text/csv": extract_csv_text
+}
+
+# structured output enforced on the content analysis models
+CONTENT_ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "confidence": {"type": "number"},
+        "response": {"type": "string"},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["confidence", "response", "reasoning"]
+}
+
+# LLM query rewrites are memoized by normalized query
+WEB_QUERY_REWRITES_CACHE = FileCache("web_query_rewrites")
+
+# the local query rewriter is trusted for queries with at most this many keywords
+LOCAL_QUERY_REWRITE_MAX_KEYWORDS = 8
+
+QUERY_STOP_WORDS = {
+    "a", "about", "according", "after", "all", "also", "am", "an", "and", "any", "are", "as", "at", "be",
+    "been", "before", "being", "by", "can", "could", "did", "do", "does", "for", "from", "had", "has",
+    "have", "how", "i", "if", "in", "into", "is", "it", "its", "me", "my", "of", "on", "or", "please",
+    "should", "so", "some", "tell", "than", "that", "the", "their", "them", "then", "there", "these",
+    "this", "those", "to", "was", "were", "what", "when", "where", "which", "who", "whom", "whose",
+    "why", "will", "with", "would", "you", "your"
+}
+
+# words which reveal instructions or constraints a keyword query cannot express
+QUERY_COMPLEXITY_MARKERS = {
+    "answer", "assume", "except", "format", "give", "if", "list", "not", "only", "provide", "return", "unless", "without"
+}
+
+
+def get_local_optimized_web_query(query: str) -> Tuple[str, bool]:
+    """
+    Optimizes a web search query using local rules, without any model call.
+    Stop words and punctuation are trimmed, "site:" filters, years and numbers are kept and
+    "how many" questions are turned into "number of" queries.
+    Args:
+        query (str): The initial web search query to be optimized.
+    Returns:
+        Tuple[str, bool]: The optimized web search query and whether the rewrite can be trusted.
+            Rewrites of long queries, queries with several sentences or with instructions are not trusted.
+    """
+    site_filters = re.findall(r"site:\S+", query, flags=re.IGNORECASE)
+    remaining_query = re.sub(r"site:\S+", " ", query, flags=re.IGNORECASE)
+    remaining_query = re.sub(r"\bhow\s+many\b", "number of", remaining_query, flags=re.IGNORECASE)
+
+    words = re.findall(r"[\w][\w'.&+-]*[\w]|[\w]", remaining_query)
+    keywords = [word for word in words if word.lower() not in QUERY_STOP_WORDS]
+
+    sentences_count = len([sentence for sentence in re.split(r"[.?!;]\s+", query.strip()) if len(sentence) > 0])
+    has_complexity_markers = any(word.lower() in QUERY_COMPLEXITY_MARKERS for word in words)
+
+    is_confident = (
+        0 < len(keywords) <= LOCAL_QUERY_REWRITE_MAX_KEYWORDS and
+        sentences_count <= 1 and
+        not has_complexity_markers and
+        '"' not in query
+    )
+
+    optimized_query = " ".join(keywords + site_filters)
+
+    return optimized_query, is_confident
+
 
 def get_optimized_web_query(query: str) -> str:
     """
     Optimizes a given web search query to improve relevance and effectiveness for web engine searches.
+    The local rule based rewriter is used when it is confident, otherwise the memoized LLM rewrite is used.
     Args:
         query (str): The initial web search query to be optimized.
     Returns:
         str: The optimized web search query.
     """
 
-    query_optimization_llm = get_query_optimization_LLM()
-
     logging.debug(f"Query optimization tool is called.")
     logging.debug(f"Query: {query}]")
 
+    local_optimized_query, is_confident = get_local_optimized_web_query(query)
+    if is_confident or is_deadline_close():
+        logging.debug(f"Created local optimized query: {local_optimized_query}")
+        return local_optimized_query
+
+    cache_key = get_cache_key(get_normalized_search_query(query))
+    optimized_query = WEB_QUERY_REWRITES_CACHE.get(cache_key)
+    if optimized_query is not None:
+        logging.debug(f"Using memoized optimized query: {optimized_query}")
+        return optimized_query
+
+    query_optimization_llm = get_query_optimization_LLM()
+
     prompt = f"""
     <role>
         You are an agent highly specialized in web query optimization.
@@ -56,12 +208,26 @@ def get_optimized_web_query(query: str) -> str:
     """
 
     result = query_optimization_llm.invoke(prompt)
-    optimized_query = result.content
+    optimized_query = result.content.strip()
     logging.debug(f"Created optimized query: {optimized_query}")
 
+    WEB_QUERY_REWRITES_CACHE.set(cache_key, optimized_query)
+
     return optimized_query
 
 
+def get_normalized_search_query(query: str) -> str:
+    """
+    Normalizes a web search query so that trivially different formulations share cached results.
+    Args:
+        query (str): The web search query.
+    Returns:
+        str: The lower case query with collapsed whitespace and no surrounding quotes or trailing punctuation.
+    """
+    normalized_query = re.sub(r"\s+", " ", query.lower()).strip()
+    return normalized_query.strip("\"'`").rstrip("?.!").strip()
+
+
 def get_web_search_results_links_duckduckgo(query: str) -> str:
     """
     Searches the web based on a query and retrieves the search results page links.
@@ -75,12 +241,22 @@ def get_web_search_results_links_duckduckgo(query: str) -> str:
     Returns:
         The search results list of search results page links.
     """
-    ddg_tool = DuckDuckGoSearchResults(output_format="list")
-    search_results = ddg_tool.invoke(query)
+    def search_duckduckgo():
+        ddg_tool = DuckDuckGoSearchResults(**DUCKDUCKGO_SEARCH_PARAMETERS)
+        search_results = record_or_replay(
+            "duckduckgo", [query, DUCKDUCKGO_SEARCH_PARAMETERS], lambda: ddg_tool.invoke(query)
+        )
+
+        search_results_links = []
+        for search_result_item in search_results:
+            search_results_links.append(search_result_item["link"])
 
-    search_results_links = []
-    for search_result_item in search_results:
-        search_results_links.append(search_result_item["link"])
+        return search_results_links
+
+    cache_key = get_cache_key("duckduckgo", get_normalized_search_query(query), DUCKDUCKGO_SEARCH_PARAMETERS)
+    search_results_links = WEB_SEARCH_CACHE.get_or_compute(cache_key, search_duckduckgo, WEB_SEARCH_CACHE_STALE_SECONDS)
+
+    logging.debug("Obtained DuckDuckGo search results links \n %s \n", search_results_links)
 
     return search_results_links
 
@@ -97,42 +273,159 @@ def get_web_search_results_links_tavily(query: str) -> str:
     Returns:
         The search results list of search results page links.
         """
-    tavily_search_tool = TavilySearch(
-        max_results=5,
-        topic="general"
-    )
+    def search_tavily():
+        tavily_search_tool = TavilySearch(**TAVILY_SEARCH_PARAMETERS)
+        results = record_or_replay(
+            "tavily", [query, TAVILY_SEARCH_PARAMETERS], lambda: tavily_search_tool.invoke({"query": query})
+        )
+
+        logging.debug("Obtained Tavily search results \n %s \n", results)
 
-    results = tavily_search_tool.invoke({"query": query})
+        return {
+            "links": [result["url"] for result in results["results"]],
+            "scores": [result["score"] for result in results["results"]]
+        }
 
-    logging.debug(f"Obtained Tavily search results \n {results} \n")
+    cache_key = get_cache_key("tavily", get_normalized_search_query(query), TAVILY_SEARCH_PARAMETERS)
+    results = WEB_SEARCH_CACHE.get_or_compute(cache_key, search_tavily, WEB_SEARCH_CACHE_STALE_SECONDS)
 
-    results_links = []
-    results_scores = []
-    for result in results["results"]:
-        results_links.append(result["url"])
-        results_scores.append(result["score"])
+    results_links = results["links"]
+    results_scores = results["scores"]
 
-    logging.debug(f"Obtained Tavily search results links \n {results_links} \n")
-    logging.debug(f"Obtained Tavily search results scores \n {results_scores} \n")
+    logging.debug("Obtained Tavily search results links \n %s \n", results_links)
+    logging.debug("Obtained Tavily search results scores \n %s \n", results_scores)
+    logging.debug(f"Web search cache statistics: {WEB_SEARCH_CACHE.get_statistics()}")
 
     return results_links, results_scores
 
 
-def get_web_page_content(url: str) -> str:
+# search providers by name, each returning the result links of a query, best first
+WEB_SEARCH_PROVIDERS = {
+    "tavily": lambda provider_query: get_web_search_results_links_tavily(provider_query)[0],
+    "duckduckgo": get_web_search_results_links_duckduckgo
+}
+
+
+def get_canonical_url(url: str) -> str:
     """
-    Gets a WEB page content using an URL. 
-    The content is transformed using markdown. 
-    This can be used as a tool. 
+    Canonicalizes an URL so that links to the same page from different search providers can be deduplicated.
+    The scheme and host are lower cased, "www." and default ports are dropped, tracking query parameters,
+    fragments and trailing slashes are removed and the remaining query parameters are sorted.
+    Args:
+        url (str): The URL.
+    Returns:
+        str: The canonical URL.
+    """
+    url_parts = urlsplit(url.strip())
+
+    host = (url_parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[len("www."):]
+    if url_parts.port is not None and url_parts.port not in (80, 443):
+        host = f"{host}:{url_parts.port}"
 
+    query_parameters = sorted(
+        (name, value) for name, value in parse_qsl(url_parts.query, keep_blank_values=True)
+        if not name.lower().startswith(URL_TRACKING_PARAMETERS_PREFIXES) and name.lower() not in URL_TRACKING_PARAMETERS
+    )
+
+    return urlunsplit(("https", host, url_parts.path.rstrip("/"), urlencode(query_parameters), ""))
+
+
+def get_web_search_results_links(query: str) -> Tuple[List[str], List[float]]:
+    """
+    Searches the web using all the WEB_SEARCH_PROVIDERS concurrently and merges their results.
+    Results are deduplicated by canonical URL and ranked using reciprocal rank fusion.
+    A provider which does not answer within WEB_SEARCH_PROVIDER_TIMEOUT seconds, or fails, is dropped,
+    its search being cancelled when it has not started yet.
     Args:
-        url: the url to the page
+        query (str): The query used for searching information on the web.
+    Returns:
+        Tuple[List[str], List[float]]: The search results page links and their fused scores, best results first.
+    """
+    web_search_providers = dict(WEB_SEARCH_PROVIDERS)
+
+    providers_futures = {
+        provider_name: submit_with_context(WEB_SEARCH_PROVIDERS_EXECUTOR, provider_search, query)
+        for provider_name, provider_search in web_search_providers.items()
+    }
+    wait(providers_futures.values(), timeout=get_deadline_timeout(WEB_SEARCH_PROVIDER_TIMEOUT))
+    for provider_future in providers_futures.values():
+        provider_future.cancel()
+
+    ranked_lists = []
+    original_links = {}
+    for provider_name, provider_future in providers_futures.items():
+        if provider_future.cancelled() or not provider_future.done():
+            logging.warning(f"Search provider {provider_name} timed out and is dropped.")
+            continue
+        if provider_future.exception() is not None:
+            logging.warning(f"Search provider {provider_name} failed and is dropped: {str(provider_future.exception())}")
+            continue
+
+        ranked_list = []
+        for link in provider_future.result():
+            canonical_link = get_canonical_url(link)
+            original_links.setdefault(canonical_link, link)
+            if canonical_link not in ranked_list:
+                ranked_list.append(canonical_link)
+        ranked_lists.append(ranked_list)
+
+    fused_results = get_reciprocal_rank_fusion(ranked_lists)[:WEB_SEARCH_MAX_RESULTS]
+
+    results_links = [original_links[canonical_link] for canonical_link, _ in fused_results]
+    results_scores = [score for _, score in fused_results]
+
+    logging.debug("Obtained fused search results links \n %s \n", results_links)
+    logging.debug("Obtained fused search results scores \n %s \n", results_scores)
+
+    return results_links, results_scores
 
+
+def get_web_page_content_type(response: requests.Response, first_data: bytes) -> str:
+    """
+    Determines the content type of a web page from its headers, its URL extension or its first bytes.
+    Args:
+        response (requests.Response): The streamed response.
+        first_data (bytes): The first bytes of the page.
     Returns:
-        The content of the WEB page designated by the URL.
+        str: The mime type of the page.
     """
-    logging.debug(f"Get Web page content tools is called")
-    logging.debug(f"URL: {url}")
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    if first_data.startswith(b"%PDF"):
+        return "application/pdf"
+    if content_type.endswith("+json"):
+        return "application/json"
+    if content_type in ("", "application/octet-stream", "binary/octet-stream"):
+        content_type = mimetypes.guess_type(urlsplit(response.url).path)[0] or "text/html"
+
+    return content_type
+
+
+def get_web_page_content_extractor(content_type: str) -> Optional[Callable[[bytes, Optional[str], bool], str]]:
+    """
+    Selects the text extractor of a content type.
+    Args:
+        content_type (str): The mime type of the page.
+    Returns:
+        Optional[Callable[[bytes, Optional[str], bool], str]]: The extractor, None when the content type is not supported.
+    """
+    extract_content = WEB_PAGE_CONTENT_EXTRACTORS.get(content_type)
+    if extract_content is None and content_type.startswith("text/"):
+        extract_content = extract_plain_text
+
+    return extract_content
 
+
+def download_web_page(url: str) -> Dict:
+    """
+    Streams a WEB page, up to the byte budget of its content type.
+    Args:
+        url (str): The url of the page.
+    Returns:
+        Dict: The page "data", its "content_type", its declared "encoding" and whether it "is_truncated".
+    """
     user_agent = UserAgent().firefox
     request_headers = {
         'user-agent': user_agent
@@ -140,74 +433,210 @@ def get_web_page_content(url: str) -> str:
 
     logging.debug(f"Using user agent: {user_agent}")
 
-    response = requests.get(url, headers=request_headers)
-    response.raise_for_status()
+    connect_timeout, read_timeout = WEB_PAGE_REQUEST_TIMEOUT
+    request_timeout = (get_deadline_timeout(connect_timeout), get_deadline_timeout(read_timeout))
 
-    logging.debug(f"Content successfully retrieved.")
+    with requests.get(url, headers=request_headers, timeout=request_timeout, stream=True) as response:
+        response.raise_for_status()
 
-    html_content = response.content
-    page_content = markdownify.markdownify(html_content, heading_style="ATX")
+        chunks = response.iter_content(chunk_size=WEB_PAGE_DOWNLOAD_CHUNK_SIZE)
+        first_data = next(chunks, b"")
 
-    logging.debug(f"Content successfully transformed to markdown.")
+        content_type = get_web_page_content_type(response, first_data)
+        if get_web_page_content_extractor(content_type) is None:
+            raise Exception(f"The content type {content_type} of the page {url} is not supported.")
 
-    return page_content
+        max_bytes = WEB_PAGE_MAX_BYTES.get(content_type, WEB_PAGE_MAX_BYTES["default"])
+        data = bytearray(first_data)
+        is_truncated = False
+        for chunk in chunks:
+            check_deadline()
+            if len(data) + len(chunk) > max_bytes:
+                data.extend(chunk[:max_bytes - len(data)])
+                is_truncated = True
+                break
+            data.extend(chunk)
+
+        encoding = response.encoding if "charset" in response.headers.get("content-type", "") else None
+
+    return {"data": bytes(data), "content_type": content_type, "encoding": encoding, "is_truncated": is_truncated}
 
 
-def compare_content_relevance(source_content: str, target_content: str, query: str) -> int:
+@traced("http.fetch")
+def get_web_page_content(url: str) -> str:
     """
-    Compares the source and target content for relevance towards a query.
+    Gets a WEB page content using an URL. 
+    HTML pages are transformed using markdown, PDF, text, JSON and CSV documents are converted to text. 
     This can be used as a tool. 
 
     Args:
-        source_content: the source content
-        source_content: the source content
+        url: the url to the page
 
     Returns:
-        0 if the source content is more relevant, otherwise 1
+        The content of the WEB page designated by the URL.
     """
+    logging.debug(f"Get Web page content tools is called")
+    logging.debug(f"URL: {url}")
+
+    web_page = record_or_replay(
+        "http",
+        [url],
+        lambda: download_web_page(url),
+        to_record=lambda page: dict(page, data=encode_bytes(page["data"])),
+        from_record=lambda page: dict(page, data=decode_bytes(page["data"]))
+    )
+    data = web_page["data"]
+    content_type = web_page["content_type"]
+    encoding = web_page["encoding"]
+    is_truncated = web_page["is_truncated"]
+
+    logging.debug(f"Content successfully retrieved: {len(data)} bytes of {content_type}, truncated: {is_truncated}")
+    set_span_attributes(**{
+        "http.url": url,
+        "http.content_type": content_type,
+        "http.response_bytes": len(data),
+        "http.truncated": is_truncated
+    })
+
+    extract_content = get_web_page_content_extractor(content_type)
+    page_content = extract_content(data, encoding, is_truncated)
 
-    logging.debug(f"Content relevance tool is called.")
-    logging.debug(f"Source content: \n {source_content[:500]} ...")
-    logging.debug(f"Target content: \n {target_content[:500]} ...")
-    logging.debug(f"Query: \n {query}")
+    logging.debug(f"Content successfully transformed to text.")
 
+    return page_content
+
+
+def rank_content_relevance_with_embeddings(pages_contents: List[str], query: str) -> List[float]:
+    """
+    Scores the relevance of pages towards a query with the local embedding model.
+    Each page is scored by the cosine similarity between the query and its most similar chunk.
+    Args:
+        pages_contents (List[str]): The contents of the pages.
+        query (str): The query.
+    Returns:
+        List[float]: The relevance score of each page.
+    """
+    pages_chunks = [
+        get_text_chunks(page_content, max_chunks=WEB_RANKING_MAX_CHUNKS_PER_PAGE) or [""]
+        for page_content in pages_contents
+    ]
+    chunks = [chunk for page_chunks in pages_chunks for chunk in page_chunks]
+
+    embeddings = get_embeddings([query] + chunks)
+    similarities = embeddings[1:] @ embeddings[0]
+
+    scores = []
+    offset = 0
+    for page_chunks in pages_chunks:
+        scores.append(float(similarities[offset:offset + len(page_chunks)].max()))
+        offset = offset + len(page_chunks)
+
+    return scores
+
+
+def rank_content_relevance_with_LLM(pages_contents: List[str], query: str) -> List[float]:
+    """
+    Scores the relevance of pages towards a query with a single listwise LLM call over the beginning of each page.
+    Args:
+        pages_contents (List[str]): The contents of the pages.
+        query (str): The query.
+    Returns:
+        List[float]: The relevance score of each page, higher being more relevant.
+    """
     content_relevance_llm = get_content_relevance_LLM()
 
+    pages_summaries = "\n".join(
+        f"""
+        <page id="{index}">
+            {page_content[:WEB_RANKING_SUMMARY_SIZE]}
+        </page>"""
+        for index, page_content in enumerate(pages_contents)
+    )
+
     content_relevance_prompt = f"""
     <role>
         You are an agent highly specialized in content comparison and content relevance analysis.
     </role>
     <task>
-        You will be provided with a source content, a target content and a query.
-        You will be asked to determine which content is more relevant to the query: the source content or the target content. 
-        Determine the content relevance based on the information and its relevance for the query.
+        You will be provided with the beginning of several pages, each with an id, and a query.
+        Rank the pages by the relevance of their information for the query, the most relevant first.
         Return the result exactly in the format we request. 
     </task>
-    <source_content>
-        {source_content}
-    </source_content>
-    <target_content>
-        {target_content}
-    </target_content>
+    <pages>
+        {pages_summaries}
+    </pages>
     <query>
         {query}
     </query>
     <format>
-        Return an integer which is 0 if the source content is more relevant, 1 if the target content is more relevant.
-        Return just the integer and nothing else.
+        Return the page ids separated by commas, the most relevant first.
+        Return just the ids and nothing else.
     </format>
     """
 
-    relevance_raw_response = content_relevance_llm.invoke(content_relevance_prompt).content
-    logging.debug(f"Retrieved content relevance raw response: \n {relevance_raw_response}")
+    with LLM_QUOTA_LIMITER:
+        relevance_raw_response = content_relevance_llm.invoke(content_relevance_prompt).content
+    logging.debug("Retrieved content relevance raw response: \n %s", relevance_raw_response)
 
-    relevance_flag = int(relevance_raw_response)
-    logging.debug(f"Obtained relevance flag: {relevance_flag}")
+    ranked_ids = []
+    for page_id in re.findall(r"\d+", relevance_raw_response):
+        if int(page_id) < len(pages_contents) and int(page_id) not in ranked_ids:
+            ranked_ids.append(int(page_id))
 
-    return relevance_flag
+    return [
+        float(len(pages_contents) - ranked_ids.index(index)) if index in ranked_ids else 0.0
+        for index in range(len(pages_contents))
+    ]
 
 
-def analyze_content_strict_mode(page_content: str, query: str) -> Tuple[float, str]:
+def rank_content_relevance(pages_contents: List[str], query: str) -> List[float]:
+    """
+    Scores the relevance of several pages towards a query at once.
+    The local embedding model is used, a single listwise LLM call is used when it is not available.
+
+    Args:
+        pages_contents: the contents of the pages
+        query: the query
+
+    Returns:
+        The relevance score of each page, higher being more relevant.
+    """
+    logging.debug(f"Content relevance ranking of {len(pages_contents)} pages for query: \n {query}")
+
+    try:
+        scores = rank_content_relevance_with_embeddings(pages_contents, query)
+    except Exception as e:
+        logging.warning(f"Embedding based content relevance ranking failed, using the LLM ranking: {str(e)}")
+        scores = rank_content_relevance_with_LLM(pages_contents, query)
+
+    logging.debug(f"Obtained content relevance scores: {scores}")
+
+    return scores
+
+
+def parse_content_analysis(analysis_content: str) -> Tuple[float, str]:
+    """
+    Parses the JSON content analysis returned by a content analysis model, repairing it when malformed.
+    Args:
+        analysis_content (str): The raw content analysis.
+    Returns:
+        Tuple[float, str]: The confidence, clamped between 0 and 1, and the response.
+    """
+    json_content = parse_json_response(analysis_content, required_keys=["confidence", "response"])
+    logging.debug("We have obtained the following cleaned analysis content: \n%s\n", json_content)
+
+    response = str(json_content["response"])
+    confidence = min(max(float(json_content["confidence"]), 0.0), 1.0)
+    reasoning = json_content.get("reasoning")
+
+    logging.debug(f"The response is {response}")
+    logging.debug(f"The confidence is {confidence}")
+    logging.debug(f"The reasoning is {reasoning}")
+
+    return confidence, response
+
+
+def analyze_content_strict_mode(page_content: str, query: str, escalation_reason: Optional[str] = None) -> Tuple[float, str]:
     """
     Analyzes the provided page content in strict mode to answer a given query.
     This function uses a language model to evaluate the relevance and accuracy of the page content
@@ -216,6 +645,7 @@ def analyze_content_strict_mode(page_content: str, query: str) -> Tuple[float, s
     Args:
         page_content (str): The textual content of the page to be analyzed.
         query (str): The question or query to be answered based on the page content.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
     Returns:
         Tuple[float, str]: A tuple containing:
             - confidence (float): A score between 0 and 1 representing the confidence in the response.
@@ -250,30 +680,15 @@ def analyze_content_strict_mode(page_content: str, query: str) -> Tuple[float, s
                 </page_content>
             """
 
-    content_analysis_LLM = get_strict_content_analysis_LLM()
+    content_analysis_LLM = get_strict_content_analysis_LLM(CONTENT_ANALYSIS_RESPONSE_SCHEMA, escalation_reason)
 
     analysis_content = content_analysis_LLM.invoke(content_analysis_prompt).content
-    logging.debug(f"We have obtained the following raw analysis content: \n{analysis_content}\n")
-
-    pattern = r'^```json\s*(.*?)\s*```$'
-    cleaned_analysis_content = analysis_content.replace("\n", "")
-    cleaned_analysis_content = re.sub(pattern, r'\1', cleaned_analysis_content, flags=re.DOTALL)
+    logging.debug("We have obtained the following raw analysis content: \n%s\n", analysis_content)
 
-    json_content = json.loads(cleaned_analysis_content)
-    logging.debug(f"We have obtained the following cleaned analysis content: \n{json_content}\n")
+    return parse_content_analysis(analysis_content)
 
-    response = json_content["response"]
-    confidence = float(json_content["confidence"])
-    reasoning = json_content["reasoning"]
 
-    logging.debug(f"The response is {response}")
-    logging.debug(f"The confidence is {confidence}")
-    logging.debug(f"The reasoning is {reasoning}")
-
-    return confidence, response
-
-
-def analyze_content_loose_mode(page_content: str, query: str) -> Tuple[float, str]:
+def analyze_content_loose_mode(page_content: str, query: str, escalation_reason: Optional[str] = None) -> Tuple[float, str]:
     """
     Analyzes the provided page content in relation to a given query using a language model in 'loose mode'.
     This function evaluates how well the page content can answer the specified query, inferring answers when necessary.
@@ -281,6 +696,7 @@ def analyze_content_loose_mode(page_content: str, query: str) -> Tuple[float, st
     Args:
         page_content (str): The textual content of the page to be analyzed.
         query (str): The question or query to be evaluated against the page content.
+        escalation_reason (Optional[str], optional): The signal asking for the strong model, None for the fast model.
     Returns:
         Tuple[float, str]: A tuple containing:
             - confidence (float): A score between 0 and 1 representing the confidence in the response.
@@ -318,88 +734,98 @@ def analyze_content_loose_mode(page_content: str, query: str) -> Tuple[float, st
                 </page_content>
             """
 
-    content_analysis_LLM = get_loose_content_analysis_LLM()
+    content_analysis_LLM = get_loose_content_analysis_LLM(CONTENT_ANALYSIS_RESPONSE_SCHEMA, escalation_reason)
 
     analysis_content = content_analysis_LLM.invoke(content_analysis_prompt).content
-    logging.debug(f"We have obtained the following raw analysis content: \n{analysis_content}\n")
+    logging.debug("We have obtained the following raw analysis content: \n%s\n", analysis_content)
 
-    pattern = r'^```json\s*(.*?)\s*```$'
-    cleaned_analysis_content = analysis_content.replace("\n", "")
-    cleaned_analysis_content = re.sub(pattern, r'\1', cleaned_analysis_content, flags=re.DOTALL)
+    return parse_content_analysis(analysis_content)
 
-    json_content = json.loads(cleaned_analysis_content)
-    logging.debug(f"We have obtained the following cleaned analysis content: \n{json_content}\n")
 
-    response = json_content["response"]
-    confidence = float(json_content["confidence"])
-    reasoning = json_content["reasoning"]
+def analyze_content_escalated_mode(page_content: str, query: str) -> Tuple[float, str]:
+    """
+    Analyzes the provided page content in strict mode using the strong model,
+    for pages on which the fast model had a low confidence.
+    Args:
+        page_content (str): The textual content of the page to be analyzed.
+        query (str): The question or query to be answered based on the page content.
+    Returns:
+        Tuple[float, str]: The confidence, between 0 and 1, and the response.
+    """
+    return analyze_content_strict_mode(page_content, query, "low_confidence")
 
-    logging.debug(f"The response is {response}")
-    logging.debug(f"The confidence is {confidence}")
-    logging.debug(f"The reasoning is {reasoning}")
 
-    return confidence, response
+def _analyze_web_page(
+        url_link: str,
+        query: str,
+        analyze_content_mode,
+        pages_contents: Dict[str, str],
+        stop_event: threading.Event) -> Optional[Tuple[float, str]]:
+    """
+    Fetches a page, unless its content is already held, and analyzes it.
+    Args:
+        url_link (str): The URL of the page.
+        query (str): The query to find relevant information for.
+        analyze_content_mode: The content analysis function, strict or loose.
+        pages_contents (Dict[str, str]): The contents of the fetched pages, keyed by URL, updated with the fetched page.
+        stop_event (threading.Event): Set when the analysis of the remaining pages is no longer needed.
+    Returns:
+        Optional[Tuple[float, str]]: The confidence and the response, or None if the analysis was stopped.
+    """
+    if stop_event.is_set():
+        return None
+    check_deadline()
 
+    page_content = pages_contents.get(url_link)
+    if page_content is None:
+        page_content = get_web_page_content(url_link)
+        pages_contents[url_link] = page_content
 
-def process_results_url_links(url_links: List[str], url_scores: List[float], query: str) -> str:
+    if stop_event.is_set():
+        return None
+
+    with LLM_QUOTA_LIMITER:
+        check_deadline()
+        return analyze_content_mode(page_content, query)
+
+
+def analyze_web_pages(
+        url_links: List[str],
+        url_scores: List[float],
+        query: str,
+        analyze_content_mode,
+        pages_contents: Dict[str, str]) -> List[Dict]:
     """
-    Processes a list of URL links and their associated scores to find the most relevant response to a given query.
-    This function iterates through the provided URLs, analyzes the content of each page using different content analysis modes,
-    and selects the response with the highest confidence score that is relevant to the query. If no sufficiently relevant response
-    is found, a generic message is returned.
+    Analyzes pages concurrently, scheduled in score order, until an answer reaches WEB_ANALYSIS_CONFIDENCE_THRESHOLD.
+    The pages not yet analyzed when the threshold is reached, or when the question deadline expires, are cancelled.
     Args:
-        url_links (List[str]): A list of URLs to be processed.
-        url_scores (List[float]): A list of scores corresponding to the relevance or quality of each URL.
-        query (str): The query string to find relevant information for.
+        url_links (List[str]): The URLs of the pages, ordered by score.
+        url_scores (List[float]): The scores of the pages.
+        query (str): The query to find relevant information for.
+        analyze_content_mode: The content analysis function, strict or loose.
+        pages_contents (Dict[str, str]): The contents of the already fetched pages, keyed by URL,
+            updated with the pages fetched during the analysis.
     Returns:
-        str: The most relevant response found based on the query and URL content, or a generic message if no relevant answer is found.
+        List[Dict]: The completed analyses, holding the URL, its rank, the confidence and the response.
     """
-    last_meaningful_response_confidence = -1
-    last_meaningful_response = None
-    last_meaningful_page_content = None
+    logging.debug(f"Processing URL links using analyze content mode: {analyze_content_mode.__name__}")
 
-    logging.debug(f"Processing URL links tool called.")
-    logging.debug(f"URL links: \n{url_links}\n")
-    logging.debug(f"URL scores: \n{url_scores}\n")
-    logging.debug(f"Query: \n{query}\n")
+    analyses = []
+    stop_event = threading.Event()
+
+    executor = ThreadPoolExecutor(max_workers=WEB_ANALYSIS_MAX_WORKERS)
+    analyses_futures = {
+        submit_with_context(executor, _analyze_web_page, url_link, query, analyze_content_mode, pages_contents, stop_event): index
+        for index, url_link in enumerate(url_links)
+    }
 
-    for analyze_content_mode in [analyze_content_strict_mode, analyze_content_loose_mode]:
-        logging.debug(f"Processing URL links using analyze content mode: {analyze_content_mode.__name__}")
+    try:
+        for future in as_completed(analyses_futures, timeout=get_remaining_time()):
+            index = analyses_futures[future]
+            url_link, url_score = url_links[index], url_scores[index]
 
-        for index in range(len(url_links)):
             try:
-                url_link = url_links[index]
-                url_score = url_scores[index]
-
-                logging.debug(f"Current processed link: {url_link}")
-                logging.debug(f"Current processed score: {url_score}")
-
-                page_content = get_web_page_content(url_link)
-
-                current_confidence, current_response = analyze_content_mode(page_content, query)
-
-                if current_confidence > 0 and current_confidence >= last_meaningful_response_confidence:
-                    content_relevance_flag = 1
-                    if current_confidence == last_meaningful_response_confidence:
-                        # force relevance comparison
-                        content_relevance_flag = compare_content_relevance(
-                            last_meaningful_page_content, page_content, query)
-
-                    if content_relevance_flag == 1:
-                        last_meaningful_response_confidence = current_confidence
-                        last_meaningful_response = current_response
-                        last_meaningful_page_content = page_content
-
-                        logging.debug(
-                            f"Using new meaningful response: \n{last_meaningful_response}\n with confidence {current_confidence}")
-                    else:
-                        logging.debug(f"Content relevance is low and will be skipped.")
-                else:
-                    logging.debug(f"Response confidence is low and will be skipped.")
-
-                # !!!! Sleep in order to avoid quota issues
-                logging.debug(f"Sleeping for preventing quota usage.")
-                time.sleep(20)
+                result = future.result()
             except Exception as e:
                 logging.error(f"""
                     Failed to analyze the content of the web page:              
@@ -409,23 +835,134 @@ def process_results_url_links(url_links: List[str], url_scores: List[float], que
                     exception: {str(e)}
                     \n
                 """)
+                continue
 
+            if result is None:
                 continue
 
-        if (last_meaningful_response is not None) and (last_meaningful_response_confidence > 0.33):
-            logging.debug(
-                f"Found meaningful response with confidence {last_meaningful_response_confidence} using analyze content mode: {analyze_content_mode.__name__}")
-            logging.debug(f"Found meaningful response: \n{last_meaningful_response}\n")
+            confidence, response = result
+            logging.debug(f"Analyzed link {url_link} with score {url_score}: confidence {confidence}")
+
+            analyses.append({"url": url_link, "rank": index, "confidence": confidence, "response": response})
+
+            if confidence >= WEB_ANALYSIS_CONFIDENCE_THRESHOLD:
+                logging.debug(f"Confidence threshold reached, the remaining pages are not analyzed")
+                stop_event.set()
+                break
+    except TimeoutError:
+        logging.warning(f"The question deadline expired, the remaining pages are not analyzed")
+        stop_event.set()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return analyses
+
+
+def select_best_analysis(analyses: List[Dict], pages_contents: Dict[str, str], query: str) -> Optional[Dict]:
+    """
+    Selects the analysis with the highest confidence.
+    Analyses tied on confidence are ranked by the relevance of their pages, computed at once for all tied pages.
+    Args:
+        analyses (List[Dict]): The page analyses.
+        pages_contents (Dict[str, str]): The contents of the fetched pages, keyed by URL.
+        query (str): The query to find relevant information for.
+    Returns:
+        Optional[Dict]: The best analysis, or None if no analysis has a positive confidence.
+    """
+    meaningful_analyses = sorted(
+        [analysis for analysis in analyses if analysis["confidence"] > 0],
+        key=lambda analysis: analysis["rank"]
+    )
+    if len(meaningful_analyses) == 0:
+        return None
+
+    best_confidence = max(analysis["confidence"] for analysis in meaningful_analyses)
+    tied_analyses = [analysis for analysis in meaningful_analyses if analysis["confidence"] == best_confidence]
+
+    tied_urls = []
+    for analysis in tied_analyses:
+        if analysis["url"] not in tied_urls:
+            tied_urls.append(analysis["url"])
+
+    if len(tied_urls) == 1:
+        return tied_analyses[0]
+
+    try:
+        relevance_scores = rank_content_relevance([pages_contents[url] for url in tied_urls], query)
+    except Exception as e:
+        logging.error(f"Failed to rank the content relevance, the best scored page is used: {str(e)}")
+        return tied_analyses[0]
 
-            # if the response is found, we can stop the processing
-            return last_meaningful_response
+    # max keeps the first, best scored, page among pages with equal relevance
+    return max(tied_analyses, key=lambda analysis: relevance_scores[tied_urls.index(analysis["url"])])
 
-    if last_meaningful_response is None:
+
+def process_results_url_links(url_links: List[str], url_scores: List[float], query: str) -> str:
+    """
+    Processes a list of URL links and their associated scores to find the most relevant response to a given query.
+    The pages are fetched and analyzed in strict mode concurrently, in score order, stopping as soon as an answer
+    is confident enough. When no strict answer is meaningful, the pages already fetched are analyzed in loose mode,
+    without being fetched again, and when no answer is meaningful still, the best scored of them are analyzed by the
+    strong model. If no relevant response is found, a generic message is returned.
+    Args:
+        url_links (List[str]): A list of URLs to be processed.
+        url_scores (List[float]): A list of scores corresponding to the relevance or quality of each URL.
+        query (str): The query string to find relevant information for.
+    Returns:
+        str: The most relevant response found based on the query and URL content, or a generic message if no relevant answer is found.
+    """
+    logging.debug(f"Processing URL links tool called.")
+    logging.debug("URL links: \n%s\n", url_links)
+    logging.debug("URL scores: \n%s\n", url_scores)
+    logging.debug(f"Query: \n{query}\n")
+
+    if is_deadline_close():
+        logging.debug(f"The question deadline is close, only {WEB_ANALYSIS_URLS_NEAR_DEADLINE} pages are analyzed")
+        url_links = url_links[:WEB_ANALYSIS_URLS_NEAR_DEADLINE]
+        url_scores = url_scores[:WEB_ANALYSIS_URLS_NEAR_DEADLINE]
+
+    pages_contents = {}
+
+    analyses = analyze_web_pages(url_links, url_scores, query, analyze_content_strict_mode, pages_contents)
+    best_analysis = select_best_analysis(analyses, pages_contents, query)
+
+    is_loose_analysis_needed = best_analysis is None or best_analysis["confidence"] <= WEB_ANALYSIS_MIN_CONFIDENCE
+    if is_loose_analysis_needed and not is_deadline_close():
+        fetched_indexes = [index for index, url_link in enumerate(url_links) if url_link in pages_contents]
+        fetched_links = [url_links[index] for index in fetched_indexes]
+        fetched_scores = [url_scores[index] for index in fetched_indexes]
+
+        loose_analyses = analyze_web_pages(fetched_links, fetched_scores, query, analyze_content_loose_mode, pages_contents)
+        for analysis in loose_analyses:
+            analysis["rank"] = fetched_indexes[analysis["rank"]]
+
+        best_analysis = select_best_analysis(analyses + loose_analyses, pages_contents, query)
+        analyses = analyses + loose_analyses
+
+    is_escalation_needed = best_analysis is None or best_analysis["confidence"] <= WEB_ANALYSIS_MIN_CONFIDENCE
+    if is_escalation_needed and MODEL_ESCALATION_ENABLED and len(pages_contents) > 0 and not is_deadline_close():
+        escalated_indexes = [index for index, url_link in enumerate(url_links) if url_link in pages_contents]
+        escalated_indexes = escalated_indexes[:WEB_ANALYSIS_ESCALATED_PAGES]
+        escalated_links = [url_links[index] for index in escalated_indexes]
+        escalated_scores = [url_scores[index] for index in escalated_indexes]
+
+        escalated_analyses = analyze_web_pages(escalated_links, escalated_scores, query, analyze_content_escalated_mode, pages_contents)
+        for analysis in escalated_analyses:
+            analysis["rank"] = escalated_indexes[analysis["rank"]]
+
+        best_analysis = select_best_analysis(analyses + escalated_analyses, pages_contents, query)
+
+    logging.debug(f"Web pages analyses performed: {len(analyses)} with the fast model, {len(pages_contents)} pages fetched")
+
+    if best_analysis is None:
         logging.warning(
             f"No relevant answer has been found while processing the URL links. We will use a generic no results answer.")
-        last_meaningful_response = "No results have been found, the processing has failed."
+        return UncachedToolResult("No results have been found, the processing has failed.")
+
+    logging.debug(f"Found meaningful response with confidence {best_analysis['confidence']} from {best_analysis['url']}")
+    logging.debug("Found meaningful response: \n%s\n", best_analysis['response'])
 
-    return last_meaningful_response
+    return best_analysis["response"]
 
 
 def search_web(query: str = None) -> str:
@@ -450,9 +987,9 @@ def search_web(query: str = None) -> str:
     optimized_query = get_optimized_web_query(query)
     logging.debug(f"Searching with optimized query: {optimized_query}]")
 
-    url_links, url_scores = get_web_search_results_links_tavily(optimized_query)
+    url_links, url_scores = get_web_search_results_links(optimized_query)
     content = process_results_url_links(url_links, url_scores,  query)
-    logging.debug(f"Received search response: {content}]")
+    logging.debug("Received search response: %s]", content)
 
     return content
 
@@ -478,8 +1015,8 @@ def search_web_natural_language(query: str = None) -> str:
     optimized_query = get_optimized_web_query(query)
     logging.debug(f"Searching with optimized query: {optimized_query}]")
 
-    url_links, url_scores = get_web_search_results_links_tavily(optimized_query)
+    url_links, url_scores = get_web_search_results_links(optimized_query)
     content = process_results_url_links(url_links, url_scores,  query)
-    logging.debug(f"Received knowledge base search response: {content}]")
+    logging.debug("Received knowledge base search response: %s]", content)
 
     return content
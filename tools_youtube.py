@@ -2,31 +2,279 @@
 # This file is part of the HuggingFace free AI Agents course assignment.
 # It contains utility functions for downloading and analyzing YouTube videos.
 
+import os
+import re
+import json
+import time
 import logging
+import threading
+from typing import Dict, Optional
 
+import requests
 from pytubefix import YouTube
-from pytubefix.cli import on_progress
 
+from library_cache import file_lock
+from library_deadline import check_deadline, get_deadline_timeout
 from tools_video import get_analysis_information_from_video
 
+VIDEOS_DIRECTORY_CACHE = "./data/videos"
+VIDEOS_CACHE_MANIFEST = "./data/videos/manifest.json"
 
-def get_youtube_video(video_url: str) -> str:
+# concurrent questions may download the same video or update the manifest, both are guarded by lock files
+VIDEOS_CACHE_MANIFEST_LOCK = VIDEOS_CACHE_MANIFEST + ".lock"
+
+# the downloaded videos directory is kept under this size by evicting the least recently used videos
+VIDEOS_CACHE_MAX_SIZE_BYTES = 4 * 1024 * 1024 * 1024
+
+# partial downloads older than this are considered abandoned and removed
+VIDEOS_PARTIAL_DOWNLOAD_MAX_AGE_SECONDS = 24 * 60 * 60
+
+# the smallest stream with at least this resolution is downloaded, keyframes are downscaled anyway
+VIDEO_MINIMUM_RESOLUTION = 480
+
+VIDEO_DOWNLOAD_CHUNK_SIZE = 9 * 1024 * 1024
+VIDEO_DOWNLOAD_TIMEOUT = 60
+
+
+def get_youtube_video_id(video_url: str) -> str:
+    """
+    Extracts the YouTube video ID from a video URL without any network access.
+    Args:
+        video_url (str): The URL of the YouTube video.
+    Returns:
+        str: The YouTube video ID.
+    Raises:
+        Exception: If no video ID can be found in the URL.
+    """
+    match = re.search(r"(?:v=|youtu\.be/|shorts/|embed/|live/)([A-Za-z0-9_-]{11})", video_url)
+    if match is None:
+        raise Exception(f"No YouTube video ID found in the URL: {video_url}")
+
+    return match.group(1)
+
+
+def _load_videos_manifest() -> Dict:
+    """
+    Loads the downloaded videos manifest, dropping entries whose files no longer exist.
+    Returns:
+        Dict: The manifest, mapping video IDs to their cached file information.
+    """
+    manifest = {}
+    if os.path.isfile(VIDEOS_CACHE_MANIFEST):
+        with open(VIDEOS_CACHE_MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    return {
+        video_id: video_item
+        for video_id, video_item in manifest.items()
+        if os.path.isfile(video_item["file_path"])
+    }
+
+
+def _save_videos_manifest(manifest: Dict) -> None:
+    """
+    Saves the downloaded videos manifest atomically.
+    Args:
+        manifest (Dict): The manifest to save.
+    """
+    temporary_manifest = f"{VIDEOS_CACHE_MANIFEST}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_manifest, VIDEOS_CACHE_MANIFEST)
+
+
+def _remove_abandoned_partial_downloads() -> None:
+    """
+    Removes partial downloads which were not resumed for a long time.
+    """
+    for file_name in os.listdir(VIDEOS_DIRECTORY_CACHE):
+        file_path = os.path.join(VIDEOS_DIRECTORY_CACHE, file_name)
+        if file_name.endswith(".part") and time.time() - os.path.getmtime(file_path) > VIDEOS_PARTIAL_DOWNLOAD_MAX_AGE_SECONDS:
+            logging.debug(f"Removing abandoned partial download: {file_path}")
+            os.remove(file_path)
+
+
+def _evict_videos(manifest: Dict, kept_video_id: str) -> None:
+    """
+    Evicts the least recently used videos until the cached videos fit the cache size limit.
+    Args:
+        manifest (Dict): The manifest of cached videos, updated in place.
+        kept_video_id (str): The ID of a video which must not be evicted.
+    """
+    cache_size = sum(video_item["size"] for video_item in manifest.values())
+    videos_by_usage = sorted(manifest.items(), key=lambda item: item[1]["last_accessed"])
+
+    for video_id, video_item in videos_by_usage:
+        if cache_size <= VIDEOS_CACHE_MAX_SIZE_BYTES:
+            break
+        if video_id == kept_video_id:
+            continue
+
+        logging.debug(f"Evicting cached video {video_id}: {video_item['file_path']}")
+        os.remove(video_item["file_path"])
+        cache_size = cache_size - video_item["size"]
+        del manifest[video_id]
+
+
+def get_stream_resolution(stream) -> int:
+    """
+    Returns the vertical resolution of a stream.
+    Args:
+        stream (Stream): The stream.
+    Returns:
+        int: The vertical resolution, 0 when the stream does not report it.
+    """
+    if stream.resolution is None:
+        return 0
+
+    return int(stream.resolution.rstrip("p"))
+
+
+def select_youtube_stream(you_tube_proxy: YouTube, minimum_resolution: int):
+    """
+    Selects the smallest progressive MP4 stream meeting the minimum resolution.
+    If no stream meets the minimum resolution, the highest resolution stream is selected.
+    Args:
+        you_tube_proxy (YouTube): The YouTube video proxy.
+        minimum_resolution (int): The minimum vertical resolution needed for the analysis.
+    Returns:
+        Stream: The selected stream.
+    Raises:
+        Exception: If the video has no downloadable stream.
+    """
+    streams = you_tube_proxy.streams.filter(progressive=True, file_extension="mp4")
+    streams = sorted(
+        [stream for stream in streams if stream.resolution is not None],
+        key=get_stream_resolution
+    )
+
+    for stream in streams:
+        if get_stream_resolution(stream) >= minimum_resolution:
+            return stream
+
+    if len(streams) > 0:
+        return streams[-1]
+
+    stream = you_tube_proxy.streams.get_highest_resolution()
+    if stream is None:
+        raise Exception(f"No downloadable stream found for the video {you_tube_proxy.watch_url}")
+
+    return stream
+
+
+def _download_stream(stream, file_path: str) -> None:
+    """
+    Downloads a stream into a file, resuming a previous partial download if one exists.
+    Servers ignoring the requested range send the whole file, which then replaces the partial download.
+    Args:
+        stream (Stream): The stream to download.
+        file_path (str): The path of the downloaded file.
+    Raises:
+        Exception: If the server stops sending data before the end of the file.
+    """
+    partial_file_path = file_path + ".part"
+    total_size = stream.filesize
+
+    downloaded_size = os.path.getsize(partial_file_path) if os.path.isfile(partial_file_path) else 0
+    if downloaded_size > 0:
+        logging.debug(f"Resuming partial download at {downloaded_size} of {total_size} bytes")
+
+    with open(partial_file_path, "ab") as f:
+        while downloaded_size < total_size:
+            range_end = min(downloaded_size + VIDEO_DOWNLOAD_CHUNK_SIZE, total_size) - 1
+            response = requests.get(
+                stream.url,
+                headers={"Range": f"bytes={downloaded_size}-{range_end}"},
+                timeout=get_deadline_timeout(VIDEO_DOWNLOAD_TIMEOUT)
+            )
+            response.raise_for_status()
+            check_deadline()
+
+            if response.status_code != 206:
+                logging.debug(f"The range request was ignored with status {response.status_code}, the download restarts")
+                f.seek(0)
+                f.truncate()
+                downloaded_size = 0
+
+            if len(response.content) == 0:
+                raise Exception(f"The video download stopped at {downloaded_size} of {total_size} bytes")
+
+            f.write(response.content)
+            f.flush()
+            downloaded_size = downloaded_size + len(response.content)
+
+    os.replace(partial_file_path, file_path)
+
+
+def get_youtube_video(video_url: str, minimum_resolution: int = VIDEO_MINIMUM_RESOLUTION) -> str:
     """
     Downloads a video from youtube using the video URL.
+    Videos are cached by video ID, a video already downloaded at a sufficient resolution, or at the best resolution
+    available when none is sufficient, is never fetched again.
 
     Args:
         video_url: the URL for the YouTube video
+        minimum_resolution: the minimum vertical resolution needed for the analysis
 
     Returns:
         The path of the downloaded video file.
     """
-    VIDEOS_DIRECTORY_CACHE = "./data/videos"
+    os.makedirs(VIDEOS_DIRECTORY_CACHE, exist_ok=True)
+
+    video_id = get_youtube_video_id(video_url)
+
+    # the video lock keeps concurrent questions from downloading the same video into the same partial file
+    with file_lock(os.path.join(VIDEOS_DIRECTORY_CACHE, f"{video_id}.lock")):
+        with file_lock(VIDEOS_CACHE_MANIFEST_LOCK):
+            video_item: Optional[Dict] = _load_videos_manifest().get(video_id)
+
+        replaced_file_path = None
+        if video_item is not None and (video_item["resolution"] >= minimum_resolution or video_item.get("is_best_available", False)):
+            logging.debug(f"Using cached video {video_id}: {video_item['file_path']}")
+        else:
+            you_tube_proxy = YouTube(video_url)
+            you_tube_stream = select_youtube_stream(you_tube_proxy, minimum_resolution)
+            resolution = get_stream_resolution(you_tube_stream)
+            # when no stream meets the minimum resolution, the selected stream is the best one available
+            is_best_available = resolution < minimum_resolution
+
+            if video_item is not None and video_item["resolution"] >= resolution:
+                logging.debug(f"No better stream than the cached video {video_id} is available")
+                video_item["is_best_available"] = is_best_available
+            else:
+                logging.debug(f"Downloading video {video_id} using the {you_tube_stream.resolution} stream")
+
+                video_file_path = os.path.join(VIDEOS_DIRECTORY_CACHE, f"{video_id}_{resolution}p.mp4")
+                _download_stream(you_tube_stream, video_file_path)
+
+                if video_item is not None and video_item["file_path"] != video_file_path:
+                    replaced_file_path = video_item["file_path"]
+
+                video_item = {
+                    "url": video_url,
+                    "title": you_tube_proxy.title,
+                    "file_path": video_file_path,
+                    "resolution": resolution,
+                    "is_best_available": is_best_available,
+                    "size": os.path.getsize(video_file_path),
+                    "downloaded_at": time.time()
+                }
+
+        video_item["last_accessed"] = time.time()
+
+        # the manifest is reloaded, other questions may have updated it during the download
+        with file_lock(VIDEOS_CACHE_MANIFEST_LOCK):
+            manifest = _load_videos_manifest()
+            manifest[video_id] = video_item
+
+            if replaced_file_path is not None and os.path.isfile(replaced_file_path):
+                os.remove(replaced_file_path)
 
-    you_tube_proxy = YouTube(video_url)
-    you_tube_stream = you_tube_proxy.streams.get_highest_resolution()
-    video_file_path = you_tube_stream.download(VIDEOS_DIRECTORY_CACHE)
+            _remove_abandoned_partial_downloads()
+            _evict_videos(manifest, video_id)
+            _save_videos_manifest(manifest)
 
-    return video_file_path
+    return video_item["file_path"]
 
 
 def get_analysis_information_from_youtube_video(youtube_video_url: str, query: str) -> str:
@@ -50,6 +298,6 @@ def get_analysis_information_from_youtube_video(youtube_video_url: str, query: s
 
     video_file_path = get_youtube_video(youtube_video_url)
     video_analysis_content = get_analysis_information_from_video(video_file_path, query)
-    logging.debug(f"Obtained video analysis content: {video_analysis_content}")
+    logging.debug("Obtained video analysis content: %s", video_analysis_content)
 
     return video_analysis_content